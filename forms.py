@@ -1,9 +1,11 @@
+import uuid
+
 from django import forms
 from django.contrib.auth.forms import UserCreationForm, UserChangeForm
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
 
-from respool.models import Item, RentalFee, Category
+from respool.models import Item, RentalFee, Category, Upload
 from accounts.models import Lender
 
 '''Authors: Sebastian Brehm, Michael Götz'''
@@ -25,6 +27,13 @@ class ItemForm(forms.Form):
     loan_agreement_file = forms.FileField(required=False, label='Leihvertrag')
     images = forms.FileField(required=False, label='Bilder',
                              widget=forms.ClearableFileInput(attrs={'multiple': True}))
+    # ids of completed chunked uploads, alternatively to the files above
+    loan_agreement_upload = forms.ModelChoiceField(required=False, widget=forms.HiddenInput,
+                                                   queryset=Upload.objects.filter(completed=True,
+                                                                                  purpose=Upload.LOAN_AGREEMENT))
+    image_uploads = forms.ModelMultipleChoiceField(required=False, widget=forms.MultipleHiddenInput,
+                                                   queryset=Upload.objects.filter(completed=True,
+                                                                                  purpose=Upload.IMAGE))
 
     location_title = forms.CharField(required=False, label='Bezeichnung')
     location_house_number = forms.IntegerField(required=True, min_value=0, label='Hausnummer')
@@ -39,6 +48,15 @@ class ItemForm(forms.Form):
                                                       choices=RentalFee.INTERVAL_UNIT_CHOICES)
     loan_rental_fee_costs = forms.FloatField(required=False, label='Mietkosten')
 
+    def clean_image_uploads(self):
+        """
+        Returns the image uploads in the submitted order, which is the order of the images.
+        """
+        image_uploads = {upload.pk: upload for upload in self.cleaned_data['image_uploads']}
+        upload_ids = dict.fromkeys(uuid.UUID(upload_id) for upload_id in self.data.getlist(
+            self.add_prefix('image_uploads')))
+        return [image_uploads[upload_id] for upload_id in upload_ids]
+
 
 class ItemDimensionForm(forms.Form):
     """
@@ -134,6 +152,10 @@ class LenderForm(UserCreationForm):
                              choices=Lender.TYPE_CHOICES)
     description = forms.CharField(required=False, label='Beschreibung')
     loan_agreement = forms.FileField(required=False, label='Standard Leihvertrag')
+    # id of a completed chunked upload, alternatively to the file above
+    loan_agreement_upload = forms.ModelChoiceField(required=False, widget=forms.HiddenInput,
+                                                   queryset=Upload.objects.filter(completed=True,
+                                                                                  purpose=Upload.LOAN_AGREEMENT))
     website = forms.CharField(required=False, label='Website')
     location_title = forms.CharField(required=False, label='Bezeichnung')
     location_street = forms.CharField(required=True, label='Straße')
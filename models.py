@@ -1,7 +1,9 @@
 from django.contrib.auth.models import User
 from django.db import models
+from django.db.models import Q
+from django.dispatch import receiver
 
-from respool.models import Item, LoanAgreement, Location
+from respool.models import Item, LoanAgreement, Location, change_catalog, release_loan_agreement
 
 '''Models for managing user accounts of the app'''
 '''Authors: Michael Götz, Marius Hofmann'''
@@ -11,6 +13,9 @@ MAX_PHONE_NUMBER_MOBILE_LENGTH = 16
 MAX_WEBSITE_LENGTH = 64
 MAX_DESC_LENGTH = 1024
 
+# fields of the user which are part of the api representation of the items of a lender (see LenderSerializer)
+CATALOG_USER_FIELDS = {'username', 'first_name', 'last_name'}
+
 
 class Borrower(models.Model):
     """
@@ -50,3 +55,32 @@ class Lender(models.Model):
             return '{} - {}'.format(self.user.username, self.TYPE_CHOICES[self.type][1])
         else:
             return '{}'.format(self.user.username)
+
+
+@receiver(models.signals.post_delete, sender=Lender)
+def release_default_loan_agreement(sender, instance, *args, **kwargs):
+    """
+    Releases the default loan agreement of a deleted Lender, it is deleted unless items still use it.
+    Called via receiver/signal on Lender `post_delete`
+    """
+    release_loan_agreement(instance.default_loan_agreement_id)
+
+
+@receiver(models.signals.post_save, sender=Lender)
+def lender_changed(sender, instance, *args, **kwargs):
+    """
+    Bumps the catalog version and touches the items of a saved Lender, the lender is part of their api representation.
+    Called via receiver/signal on Lender `post_save`
+    """
+    change_catalog(Q(lender=instance.pk))
+
+
+@receiver(models.signals.post_save, sender=User)
+def lender_user_changed(sender, instance, update_fields=None, *args, **kwargs):
+    """
+    Bumps the catalog version and touches the items of the Lender of a saved User, if the name of the user may have
+    changed. Saves of other fields, like the last login, leave the catalog as it is.
+    Called via receiver/signal on User `post_save`
+    """
+    if update_fields is None or CATALOG_USER_FIELDS & set(update_fields):
+        change_catalog(Q(lender__user=instance.pk))
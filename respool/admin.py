@@ -1,6 +1,7 @@
 from django.contrib import admin
 
-from respool.models import Item, Image, Location, Loan, LoanAgreement, RentalFee, Category, Dimension, TimeInterval
+from respool.models import Item, Image, Location, Loan, LoanAgreement, RentalFee, Category, Dimension, TimeInterval, \
+    GeoCodeCacheEntry
 
 # Register your models here.
 # respool.models
@@ -13,3 +14,4 @@ admin.site.register(Location)
 admin.site.register(Loan)
 admin.site.register(RentalFee)
 admin.site.register(TimeInterval)
+admin.site.register(GeoCodeCacheEntry)
@@ -0,0 +1,156 @@
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+
+from respool.api.v1.serializers import ItemBulkSerializer
+from respool.models import Item, Category, Dimension, Loan, Location, RentalFee, add_geocode, schedule_geocode, \
+    items_bulk_saved
+from respool.utils import bulk
+
+'''
+Author: Marius Hofmann
+'''
+
+ITEM_FIELDS = ('title', 'description', 'type', 'weight', 'amount', 'location', 'loan', 'dimension', 'updated_at')
+
+
+class BulkItemWriter:
+    """
+    Creates and updates many items of a lender in one transaction.
+    Rows are validated by ItemBulkSerializer and Item.clean, nothing is written if any row is invalid.
+    Equal locations, loans, rental fees and dimensions are shared between the rows and matched against
+    existing rows, like the get_or_create calls of the item forms.
+    """
+
+    def __init__(self, lender, rows):
+        """
+        :param lender: Lender owning the items
+        :param rows: list of item rows, see ItemBulkSerializer
+        """
+        self.lender = lender
+        self.rows = rows
+        self.errors = []
+        self.results = []
+        self._items = []
+
+    def is_valid(self):
+        """
+        Validates all rows, the errors are collected per row in 'errors' as {'index', 'errors'}.
+
+        :return: True if all rows are valid
+        """
+        validated = []
+        for index, row in enumerate(self.rows):
+            serializer = ItemBulkSerializer(data=row)
+            if serializer.is_valid():
+                validated.append((index, serializer.validated_data))
+            else:
+                self.errors.append({'index': index, 'errors': serializer.errors})
+
+        item_ids = [data['id'] for _, data in validated if 'id' in data]
+        existing_items = Item.objects.filter(lender=self.lender).in_bulk(item_ids) if item_ids else {}
+        category_ids = {category_id for _, data in validated for category_id in data.get('categories', [])}
+        known_category_ids = set(Category.objects.filter(id__in=category_ids).values_list('id', flat=True)) \
+            if category_ids else set()
+
+        seen_item_ids = set()
+        for index, data in validated:
+            errors = {}
+            item_id = data.get('id')
+            if item_id is not None:
+                if item_id not in existing_items:
+                    errors['id'] = ['Unknown item {}.'.format(item_id)]
+                elif item_id in seen_item_ids:
+                    errors['id'] = ['Item {} occurs more than once.'.format(item_id)]
+                seen_item_ids.add(item_id)
+            unknown_category_ids = set(data.get('categories', [])) - known_category_ids
+            if unknown_category_ids:
+                errors['categories'] = ['Unknown categories {}.'.format(sorted(unknown_category_ids))]
+
+            item = existing_items.get(item_id) or Item(lender=self.lender)
+            previous_location_id = item.location_id
+            self.build(item, data)
+            try:
+                item.clean()
+            except ValidationError as err:
+                errors['non_field_errors'] = err.messages
+
+            if errors:
+                self.errors.append({'index': index, 'errors': errors})
+            else:
+                self._items.append((index, item, set(data.get('categories', [])), previous_location_id))
+        self.errors.sort(key=lambda error: error['index'])
+        return not self.errors
+
+    @staticmethod
+    def build(item, data):
+        """
+        Sets the fields of an item from a validated row, related objects are set as unsaved instances.
+        """
+        loan_data = data.get('loan') or {}
+        rental_fee_data = loan_data.get('rental_fee')
+        dimension_data = data.get('dimension')
+        item.title = data['title']
+        item.description = data['description']
+        item.type = data['type']
+        item.weight = data.get('weight')
+        item.amount = data.get('amount')
+        item.location = Location(**data['location'])
+        item.loan = Loan(caution=loan_data.get('caution'), single_rent=loan_data.get('single_rent'),
+                         rental_fee=RentalFee(**rental_fee_data) if rental_fee_data else None)
+        item.dimension = Dimension(**dimension_data) if dimension_data else None
+
+    def save(self):
+        """
+        Writes all valid rows in one transaction, the written items are listed in 'results' as
+        {'index', 'id', 'created'}.
+        """
+        assert not self.errors, 'save() requires valid rows'
+        items = [item for _, item, _, _ in self._items]
+        with transaction.atomic():
+            loans = [item.loan for item in items]
+            rental_fees, _ = bulk.get_or_create_many(RentalFee, [loan.rental_fee for loan in loans if loan.rental_fee],
+                                                     ['interval_unit', 'costs'])
+            rental_fees = iter(rental_fees)
+            for loan in loans:
+                if loan.rental_fee:
+                    loan.rental_fee = next(rental_fees)
+            loans, _ = bulk.get_or_create_many(Loan, loans, ['caution', 'single_rent', 'rental_fee'])
+
+            dimensions, _ = bulk.get_or_create_many(Dimension, [item.dimension for item in items if item.dimension],
+                                                    ['width', 'height', 'depth'])
+            dimensions = iter(dimensions)
+
+            locations, _ = bulk.get_or_create_many(Location, [item.location for item in items],
+                                                   ['house_number', 'street', 'city'],
+                                                   pre_save=[add_geocode], post_save=[schedule_geocode])
+
+            now = timezone.now()
+            for item, loan, location in zip(items, loans, locations):
+                item.loan = loan
+                item.location = location
+                if item.dimension:
+                    item.dimension = next(dimensions)
+                item.updated_at = now
+
+            updated_items = [item for item in items if item.pk]
+            created_items = [item for item in items if not item.pk]
+            bulk.bulk_update(Item, updated_items, ITEM_FIELDS)
+            bulk.bulk_insert(Item, created_items)
+
+            through = Item.categories.through
+            if updated_items:
+                through.objects.filter(item_id__in=[item.pk for item in updated_items]).delete()
+            through.objects.bulk_create([through(item_id=item.pk, category_id=category_id)
+                                         for _, item, category_ids, _ in self._items
+                                         for category_id in sorted(category_ids)])
+
+            location_ids = {item.location_id for item in items}
+            location_ids.update(previous_location_id for _, _, _, previous_location_id in self._items
+                                if previous_location_id)
+            items_bulk_saved.send(sender=Item, item_ids=[item.pk for item in items], location_ids=location_ids)
+
+        created_ids = {item.pk for item in created_items}
+        self.results = [{'index': index, 'id': item.pk, 'created': item.pk in created_ids}
+                        for index, item, _, _ in self._items]
+        return self.results
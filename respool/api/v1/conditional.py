@@ -0,0 +1,61 @@
+from respool.models import CatalogVersion, Item
+from respool.utils import tiles
+
+'''
+Validators for conditional GET requests, answered before any queryset is built.
+Author: Marius Hofmann
+'''
+
+
+def _representation(request):
+    # json and the browsable api share urls, so the negotiated format is part of every ETag
+    renderer = getattr(request, 'accepted_renderer', None)
+    return renderer.format if renderer else ''
+
+
+# the ETags are weak, one representation is served with different content codings (see response_cache)
+
+
+def get_catalog_version(request):
+    """
+    Returns the CatalogVersion, fetched once per request.
+    """
+    if not hasattr(request, '_catalog_version'):
+        request._catalog_version = CatalogVersion.get()
+    return request._catalog_version
+
+
+def catalog_etag(request, *args, **kwargs):
+    return 'W/"{}-{}"'.format(get_catalog_version(request).version, _representation(request))
+
+
+def catalog_last_modified(request, *args, **kwargs):
+    return get_catalog_version(request).updated
+
+
+def get_item_updated_at(request, pk):
+    """
+    Returns updated_at of an item, fetched once per request.
+
+    :return: datetime or None if the item does not exist
+    """
+    if not hasattr(request, '_item_updated_at'):
+        request._item_updated_at = Item.objects.filter(pk=pk).values_list('updated_at', flat=True).first()
+    return request._item_updated_at
+
+
+def item_etag(request, pk, *args, **kwargs):
+    updated_at = get_item_updated_at(request, pk)
+    if updated_at is None:
+        return None
+    return 'W/"{}-{}-{}"'.format(pk, updated_at.timestamp(), _representation(request))
+
+
+def item_last_modified(request, pk, *args, **kwargs):
+    return get_item_updated_at(request, pk)
+
+
+def tile_etag(request, z, x, y, *args, **kwargs):
+    if not tiles.is_valid(z, x, y):
+        return None
+    return 'W/"{}-{}"'.format(tiles.get_version(z, x, y), _representation(request))
@@ -0,0 +1,80 @@
+from django.core.exceptions import EmptyResultSet
+from django.db import connection
+
+from accounts.models import Lender
+from respool.models import Item, Category, Loan, RentalFee
+
+'''
+Author: Michael Götz, Marius Hofmann
+'''
+
+CATEGORY_FACET = 'categories'
+TYPE_FACET = 'types'
+LENDER_FACET = 'lenders'
+RENTAL_FEE_INTERVAL_FACET = 'rental-fee-intervals'
+
+
+def _facet_sql():
+    """
+    Returns the sql of the facet stage with an '{items}' placeholder for the query of the filtered item ids.
+    The ids are selected once as a common table expression, each group yields rows of (facet, id, title, count).
+    """
+    qn = connection.ops.quote_name
+    filtered_items = qn('filtered_items')
+    items = '(SELECT {} FROM {})'.format(qn('id'), filtered_items)
+    item = qn(Item._meta.db_table)
+    item_categories = qn(Item.categories.through._meta.db_table)
+    item_id = qn(Item.categories.field.m2m_column_name())
+    category_id = qn(Item.categories.field.m2m_reverse_name())
+    user = Lender._meta.get_field('user').related_model
+    groups = [
+        "SELECT '{facet}', i.{type}, NULL, COUNT(*) FROM {item} i WHERE i.{id} IN {items} "
+        "GROUP BY i.{type}".format(facet=TYPE_FACET, items=items, type=qn('type'), item=item, id=qn('id')),
+
+        "SELECT '{facet}', i.{lender_id}, u.{username}, COUNT(*) FROM {item} i "
+        "INNER JOIN {lender} l ON l.{id} = i.{lender_id} INNER JOIN {user} u ON u.{id} = l.{user_id} "
+        "WHERE i.{id} IN {items} GROUP BY i.{lender_id}, u.{username}".format(
+            facet=LENDER_FACET, items=items, item=item, lender=qn(Lender._meta.db_table), user=qn(user._meta.db_table),
+            id=qn('id'), lender_id=qn('lender_id'), user_id=qn('user_id'), username=qn('username')),
+
+        "SELECT '{facet}', f.{interval_unit}, NULL, COUNT(*) FROM {item} i "
+        "INNER JOIN {loan} l ON l.{id} = i.{loan_id} INNER JOIN {rental_fee} f ON f.{id} = l.{rental_fee_id} "
+        "WHERE i.{id} IN {items} GROUP BY f.{interval_unit}".format(
+            facet=RENTAL_FEE_INTERVAL_FACET, items=items, item=item, loan=qn(Loan._meta.db_table),
+            rental_fee=qn(RentalFee._meta.db_table), id=qn('id'), loan_id=qn('loan_id'),
+            rental_fee_id=qn('rental_fee_id'), interval_unit=qn('interval_unit')),
+
+        "SELECT '{facet}', c.{id}, c.{title}, COUNT(*) FROM {item_categories} ic "
+        "INNER JOIN {category} c ON c.{id} = ic.{category_id} WHERE ic.{item_id} IN {items} "
+        "GROUP BY c.{id}, c.{title}".format(
+            facet=CATEGORY_FACET, items=items, item_categories=item_categories, category=qn(Category._meta.db_table),
+            id=qn('id'), title=qn('title'), item_id=item_id, category_id=category_id),
+    ]
+    return 'WITH {} ({}) AS ({{items}}) {}'.format(filtered_items, qn('id'), ' UNION ALL '.join(groups))
+
+
+def compute_facets(queryset):
+    """
+    Counts the items of a filtered Item queryset per category, type, lender and rental fee interval.
+    All counts are computed by a single grouped query over the filtered item ids.
+
+    :param queryset: filtered Item queryset
+    :return: dict of facet name to a list of {'id', 'title', 'count'} dicts, sorted by id
+    """
+    facets = {CATEGORY_FACET: [], TYPE_FACET: [], LENDER_FACET: [], RENTAL_FEE_INTERVAL_FACET: []}
+    try:
+        items_sql, items_params = queryset.order_by().values('id').query.sql_with_params()
+    except EmptyResultSet:
+        # the filters can never match, e.g. an empty id__in list
+        return facets
+
+    labels = {TYPE_FACET: dict(Item.TYPE_CHOICES), RENTAL_FEE_INTERVAL_FACET: dict(RentalFee.INTERVAL_UNIT_CHOICES)}
+    with connection.cursor() as cursor:
+        cursor.execute(_facet_sql().replace('{items}', items_sql), items_params)
+        for facet, value, title, count in cursor.fetchall():
+            if facet in labels:
+                title = labels[facet].get(value)
+            facets[facet].append({'id': value, 'title': title, 'count': count})
+    for values in facets.values():
+        values.sort(key=lambda value: value['id'])
+    return facets
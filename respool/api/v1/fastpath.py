@@ -0,0 +1,130 @@
+import json
+
+from django.db.models import OuterRef, Subquery
+from django.templatetags.static import static
+from django.urls import reverse
+
+from respool.models import THUMB_PLACEHOLDER, Item, Image, ImageVariant
+
+try:
+    import orjson
+except ImportError:  # falls back to the json module with the same output
+    orjson = None
+
+'''
+Serialization of item lists from .values() rows, producing the same json as MinimalItemSerializer and
+ExtendedItemSerializer rendered by DRF's JSONRenderer, without model instances and serializer fields per row.
+Author: Marius Hofmann
+'''
+
+ITEM_FIELDS = ('id', 'title', 'description')
+LOCATION_FIELDS = ('title', 'house_number', 'street', 'city', 'latitude', 'longitude')
+# any item id, only used to split the reversed detail page url into prefix and suffix
+URL_PLACEHOLDER_ID = 4711
+
+
+def is_supported(request):
+    """
+    Checks whether the accepted renderer of a request produces the output of the fast path,
+    i.e. compact, non ascii escaped json without indentation.
+    """
+    renderer = request.accepted_renderer
+    return renderer.format == 'json' and renderer.compact and not renderer.ensure_ascii \
+        and renderer.get_indent(request.accepted_media_type, {}) is None
+
+
+def item_rows(queryset, data_type=None):
+    """
+    Turns a filtered Item queryset into a values queryset holding the fields of the item list.
+
+    :param queryset: filtered Item queryset, its ordering is kept
+    :param data_type: 'map' for rows including the location
+    :return: values queryset
+    """
+    fields = ITEM_FIELDS
+    if data_type == 'map':
+        fields += tuple('location__' + field for field in LOCATION_FIELDS)
+    return queryset.prefetch_related(None).values(*fields)
+
+
+def get_srcsets(image_ids):
+    """
+    Loads the srcset values of the variants of images, like Image.get_srcset.
+
+    :param image_ids: list of image ids
+    :return: dict of (image id, format) to srcset
+    """
+    storage = ImageVariant._meta.get_field('file').storage
+    candidates = {}
+    rows = ImageVariant.objects.filter(image_id__in=image_ids).order_by('image_id', 'width') \
+        .values_list('image_id', 'format', 'width', 'file')
+    for image_id, format, width, file in rows:
+        candidates.setdefault((image_id, format), []).append('{} {}w'.format(storage.url(file), width))
+    return {key: ', '.join(values) for key, values in candidates.items()}
+
+
+def get_default_images(item_ids):
+    """
+    Loads the image with the lowest order id of each item, like prefetch.default_image_prefetch.
+
+    :param item_ids: list of item ids
+    :return: dict of item id to {'thumb', 'file', 'srcset', 'webp_srcset'} with the urls of the image files,
+        see DefaultImageThumbSerializer
+    """
+    through = Item.images.through
+    first_image_id = Image.objects.filter(item=OuterRef('item_id')).order_by('order_id').values('id')[:1]
+    rows = list(through.objects.filter(item_id__in=item_ids, image_id=Subquery(first_image_id))
+                .values_list('item_id', 'image_id', 'image__file', 'image__thumb'))
+    # like prefetch_related, the variants are only queried if there are images
+    srcsets = get_srcsets([image_id for _, image_id, _, _ in rows]) if rows else {}
+    file_storage = Image._meta.get_field('file').storage
+    thumb_storage = Image._meta.get_field('thumb').storage
+    placeholder = static(THUMB_PLACEHOLDER)
+    return {item_id: {'thumb': thumb_storage.url(thumb) if thumb else placeholder,
+                      'file': file_storage.url(file) if file else None,
+                      'srcset': srcsets.get((image_id, ImageVariant.JPEG), ''),
+                      'webp_srcset': srcsets.get((image_id, ImageVariant.WEBP), '')}
+            for item_id, image_id, file, thumb in rows}
+
+
+def serialize_items(rows, request, data_type=None):
+    """
+    Serializes item rows from item_rows() like MinimalItemSerializer resp. ExtendedItemSerializer.
+
+    :param rows: iterable of item row dicts
+    :param request: the current request, used for the absolute detail page urls
+    :param data_type: 'map' for rows including the location
+    :return: list of item dicts
+    """
+    rows = list(rows)
+    images = get_default_images([row['id'] for row in rows])
+    url_prefix, url_suffix = request.build_absolute_uri(
+        reverse('respool:item-detail', args=[URL_PLACEHOLDER_ID])).rsplit(str(URL_PLACEHOLDER_ID), 1)
+    items = []
+    for row in rows:
+        item = {
+            'id': row['id'],
+            'title': row['title'],
+            'description': row['description'],
+            'default_image': images.get(row['id']),
+            'detail_page_url': '{}{}{}'.format(url_prefix, row['id'], url_suffix),
+        }
+        if data_type == 'map':
+            item['location'] = {field: row['location__' + field] for field in LOCATION_FIELDS}
+        items.append(item)
+    return items
+
+
+def render(data):
+    """
+    Renders data to json bytes, identical to DRF's compact, unicode JSONRenderer.
+
+    :param data: json compatible data of dicts, lists, strings, numbers and None
+    :return: utf-8 encoded json
+    """
+    if orjson:
+        content = orjson.dumps(data)
+    else:
+        content = json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    # DRF escapes these to keep the output a strict javascript subset
+    return content.replace('\u2028'.encode('utf-8'), b'\\u2028').replace('\u2029'.encode('utf-8'), b'\\u2029')
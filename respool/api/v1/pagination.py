@@ -0,0 +1,39 @@
+from rest_framework.pagination import CursorPagination
+
+'''
+Author: Michael Götz, Marius Hofmann
+'''
+
+
+class ItemCursorPagination(CursorPagination):
+    """
+        keyset pagination for item lists.
+
+        pages are sliced by the (unique, indexed) item id instead of an OFFSET, so fetching a page costs the same
+        no matter how deep the client has scrolled. the returned cursor is opaque to the client.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page-size'
+    page_size = 50
+    max_page_size = 500
+    ordering = 'id'
+    template = None
+
+    def is_requested(self, request):
+        """
+        returns true if the client opted in to cursor based paging
+
+        :param request: the api request
+        :return: true if a cursor or a page size was given
+        """
+        return self.cursor_query_param in request.query_params or \
+            self.page_size_query_param in request.query_params
+
+    def is_first_page(self, request):
+        """
+        returns true if no cursor was given, i.e. the first page of a query is requested
+
+        :param request: the api request
+        :return: true on the first page
+        """
+        return not request.query_params.get(self.cursor_query_param)
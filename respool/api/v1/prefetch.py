@@ -0,0 +1,71 @@
+from django.db.models import Prefetch, OuterRef, Subquery
+
+from respool.models import Image
+
+'''
+Author: Michael Götz, Marius Hofmann
+'''
+
+DEFAULT_IMAGES_ATTR = 'default_images'
+
+
+def default_image_prefetch():
+    """
+    Returns a prefetch which only loads the image with the lowest order id of each item, including its variants.
+    The image is stored as a one element list in the 'default_images' attribute of the item.
+
+    :return: Prefetch object for Item querysets
+    """
+    first_image_id = Image.objects.filter(item=OuterRef('item')).order_by('order_id').values('id')[:1]
+    return Prefetch('images', queryset=Image.objects.filter(id=Subquery(first_image_id)).prefetch_related('variants'),
+                    to_attr=DEFAULT_IMAGES_ATTR)
+
+
+def _minimal_plan(queryset):
+    """ plan for MinimalItemSerializer: the default image only """
+    return queryset.prefetch_related(default_image_prefetch())
+
+
+def _map_plan(queryset):
+    """ plan for ExtendedItemSerializer: default image and location """
+    return queryset.select_related('location').prefetch_related(default_image_prefetch())
+
+
+def _detail_plan(queryset):
+    """ plan for ItemSerializer: all related objects """
+    return queryset.select_related('dimension', 'loan_agreement', 'location', 'lender__user', 'loan__rental_fee') \
+        .prefetch_related('images__variants', 'occupancies')
+
+
+# prefetch plan per 'data-type' query parameter
+PREFETCH_PLANS = {
+    None: _minimal_plan,
+    'map': _map_plan,
+    'detail': _detail_plan,
+}
+
+
+def plan_queryset(queryset, data_type=None):
+    """
+    Applies the prefetch plan of the given data type to an Item queryset, so the serializer of that data type
+    can read all related objects from memory.
+
+    :param queryset: Item queryset
+    :param data_type: the requested data type, e.g. 'map' or 'detail'. Unknown types use the default plan.
+    :return: the planned queryset
+    """
+    return PREFETCH_PLANS.get(data_type, _minimal_plan)(queryset)
+
+
+def get_default_image(item):
+    """
+    Returns the image with the lowest order id of an item.
+    Uses the prefetched image if the item was loaded by a planned queryset.
+
+    :param item: Item instance
+    :return: Image instance or None
+    """
+    if hasattr(item, DEFAULT_IMAGES_ATTR):
+        images = getattr(item, DEFAULT_IMAGES_ATTR)
+        return images[0] if images else None
+    return item.images.all().first()
@@ -1,9 +1,16 @@
+import os
+
 from django.contrib.auth.models import User
 from rest_framework import serializers
+from django.templatetags.static import static
+from django.utils.text import get_valid_filename
 from rest_framework.reverse import reverse
 
 from accounts.models import Lender
-from respool.models import Item, Dimension, LoanAgreement, Image, Location, Loan, RentalFee, Category, TimeInterval
+from respool.api.v1.prefetch import get_default_image
+from respool.models import THUMB_PLACEHOLDER, Item, Dimension, LoanAgreement, Image, ImageVariant, Location, Loan, \
+    RentalFee, Category, TimeInterval, Upload
+from respool.utils import uploads
 
 '''
 Author: Michael Götz, Marius Hofmann
@@ -38,14 +45,44 @@ class LoanAgreementSerializer(serializers.ModelSerializer):
         fields = ('file',)
 
 
+class ThumbField(serializers.ImageField):
+    """
+        serializes the thumbnail url, or the placeholder image url while the thumbnail is generated
+    """
+
+    def to_representation(self, value):
+        if value:
+            return super().to_representation(value)
+        url = static(THUMB_PLACEHOLDER)
+        request = self.context.get('request', None)
+        if request is not None:
+            return request.build_absolute_uri(url)
+        return url
+
+
 class DefaultImageThumbSerializer(serializers.ModelSerializer):
     """
-        serializes a image with thumb
+        serializes a image with thumb and the srcset values of its jpeg and webp variants
     """
+    thumb = ThumbField(read_only=True)
+    srcset = serializers.SerializerMethodField()
+    webp_srcset = serializers.SerializerMethodField()
+
+    def get_variant_srcset(self, image, format):
+        request = self.context.get('request', None)
+        if request is not None:
+            return image.get_srcset(format, request.build_absolute_uri)
+        return image.get_srcset(format)
+
+    def get_srcset(self, image):
+        return self.get_variant_srcset(image, ImageVariant.JPEG)
+
+    def get_webp_srcset(self, image):
+        return self.get_variant_srcset(image, ImageVariant.WEBP)
 
     class Meta:
         model = Image
-        fields = ('thumb', 'file')
+        fields = ('thumb', 'file', 'srcset', 'webp_srcset')
 
 
 class TinyItemSerializer(serializers.HyperlinkedModelSerializer):
@@ -73,7 +110,7 @@ class MinimalItemSerializer(serializers.HyperlinkedModelSerializer):
         return reverse('respool:item-detail', [instance.id], request=self.context['request'])
 
     def get_default_image(self, instance):
-        image = instance.images.all().first()
+        image = get_default_image(instance)
         if image:
             return DefaultImageThumbSerializer(image).data
         return None
@@ -226,7 +263,7 @@ class ExtendedItemSerializer(serializers.HyperlinkedModelSerializer):
         return reverse('respool:item-detail', [instance.id], request=self.context['request'])
 
     def get_default_image(self, instance):
-        image = instance.images.all().first()
+        image = get_default_image(instance)
         if image:
             return DefaultImageThumbSerializer(image).data
         return None
@@ -234,3 +271,73 @@ class ExtendedItemSerializer(serializers.HyperlinkedModelSerializer):
     class Meta:
         model = Item
         fields = ('id', 'title', 'description', 'default_image', 'detail_page_url', 'location')
+
+
+class RentalFeeWriteSerializer(serializers.ModelSerializer):
+    """
+        validates a rental fee of a bulk item row:
+         interval_unit, costs
+    """
+
+    class Meta:
+        model = RentalFee
+        fields = ('interval_unit', 'costs')
+
+
+class LoanWriteSerializer(serializers.ModelSerializer):
+    """
+        validates the loan of a bulk item row:
+         'caution', 'single_rent', 'rental_fee'('interval_unit', 'costs')
+    """
+    rental_fee = RentalFeeWriteSerializer(required=False, allow_null=True)
+
+    class Meta:
+        model = Loan
+        fields = ('caution', 'single_rent', 'rental_fee')
+
+
+class ItemBulkSerializer(serializers.ModelSerializer):
+    """
+        validates a single row of the bulk item api, rows with an id replace all fields of that item:
+         'id', 'title', 'description', 'type', 'categories'[ids], 'weight', 'amount',
+         'location'('title', 'house_number', 'street', 'city', 'latitude', 'longitude'),
+         'loan'('caution', 'single_rent', 'rental_fee'('interval_unit', 'costs')),
+         'dimension'('width', 'height', 'depth')
+    """
+    id = serializers.IntegerField(required=False)
+    # existence is checked for all rows at once by the writer
+    categories = serializers.ListField(child=serializers.IntegerField(), required=False)
+    location = LocationSerializer()
+    loan = LoanWriteSerializer(required=False, allow_null=True)
+    dimension = DimensionSerializer(required=False, allow_null=True)
+
+    class Meta:
+        model = Item
+        fields = ('id', 'title', 'description', 'type', 'categories', 'location', 'loan', 'dimension', 'weight',
+                  'amount')
+
+
+class UploadSerializer(serializers.ModelSerializer):
+    """
+        creates a chunked upload and serializes its state:
+         'id', 'purpose', 'filename', 'size', 'offset', 'completed'
+    """
+
+    def validate_filename(self, filename):
+        filename = get_valid_filename(os.path.basename(filename))
+        if not filename:
+            raise serializers.ValidationError('A file name is required.')
+        return filename
+
+    def validate_size(self, size):
+        max_size = uploads.get_max_file_size()
+        if size < 1:
+            raise serializers.ValidationError('Empty files can not be uploaded.')
+        if size > max_size:
+            raise serializers.ValidationError('Files may have at most {} bytes.'.format(max_size))
+        return size
+
+    class Meta:
+        model = Upload
+        fields = ('id', 'purpose', 'filename', 'size', 'offset', 'completed')
+        read_only_fields = ('offset', 'completed')
@@ -5,8 +5,15 @@ from respool.api.v1 import views
 urlpatterns = [
     # API Version 1
     path('items/', views.ApiItems.as_view(), name='items'),
+    path('items/bulk', views.ApiItemsBulk.as_view(), name='items-bulk'),
+    path('items/batch', views.ApiItemBatch.as_view(), name='item-batch'),
+    path('items/clusters', views.ApiItemClusters.as_view(), name='item-clusters'),
     path('items/<int:pk>/', views.ApiItem.as_view(), name='item'),
     path('items/<int:pk>/order-images', views.ApiItemImageOrdering.as_view(), name='item-image-ordering'),
     path('items/default-image', views.ApiItemImagesDefault.as_view(), name='items-default-image'),
+    path('tiles/<int:z>/<int:x>/<int:y>.json', views.ApiItemTile.as_view(), name='item-tile'),
+    path('uploads/', views.ApiUploads.as_view(), name='uploads'),
+    path('uploads/<uuid:pk>', views.ApiUpload.as_view(), name='upload'),
+    path('cache-stats', views.ApiCacheStats.as_view(), name='cache-stats'),
     path('rental-fees/intervals', views.ApiRentalFeeIntervallOptions.as_view(), name='rental-fee-intervall-options'),
 ]
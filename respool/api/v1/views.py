@@ -1,27 +1,45 @@
 from __future__ import unicode_literals
 
-from datetime import datetime
+import math
 
 import coreapi
 import coreschema
-from django.db.models import Q
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import F, Q
+from django.http import Http404, HttpResponse
 from django.templatetags.static import static
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
 from rest_framework import generics, schemas, views, status
 from rest_framework.decorators import permission_classes
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.exceptions import ParseError
+from rest_framework.permissions import IsAuthenticated, AllowAny, IsAdminUser
 from rest_framework.response import Response
 
+from accounts.models import Lender
+from respool.api.v1 import conditional, fastpath
+from respool.api.v1.bulk import BulkItemWriter
+from respool.api.v1.facets import compute_facets, CATEGORY_FACET
+from respool.api.v1.pagination import ItemCursorPagination
+from respool.api.v1.prefetch import plan_queryset
 from respool.api.v1.serializers import MinimalItemSerializer, ItemSerializer, DefaultItemImageSerializer, \
-    CategorySerializer, RentalFeeChoicesSerializer, ExtendedItemSerializer
-from respool.models import Item, Category, RentalFee
-from respool.utils import geocoding
+    CategorySerializer, RentalFeeChoicesSerializer, ExtendedItemSerializer, UploadSerializer
+from respool.models import Item, Category, RentalFee, Location, Upload, set_image_order
+from respool.utils import availability, clustering, geocoding, geohash, response_cache, search, tiles, uploads
 
 '''
 Authors: Michael Götz, Marius Hofmann
 '''
 
+DEFAULT_ITEM_BATCH_SIZE = 100
+DEFAULT_BULK_MAX_ITEMS = 500
+
 
 @permission_classes((AllowAny,))
+@method_decorator(condition(etag_func=conditional.catalog_etag, last_modified_func=conditional.catalog_last_modified),
+                  name='get')
 class ApiItems(generics.ListAPIView):
     """
         Return a list of items filtered by given parameter.
@@ -32,7 +50,8 @@ class ApiItems(generics.ListAPIView):
             required=False,
             location="query",
             schema=coreschema.String(
-                description='Search for the token in each title of an item'
+                description='Full text search in title and description of the items. '
+                            'Results are ordered by relevance'
             ),
         ),
         coreapi.Field(
@@ -134,44 +153,119 @@ class ApiItems(generics.ListAPIView):
             required=False,
             location="query",
             schema=coreschema.String(
-                description='needed for occupancy search. format = %Y-%m-%d. Requires: end-date field', ),
+                description='only items free for the whole range from start-date to end-date. '
+                            'format = %Y-%m-%d. Requires: end-date field', ),
         ),
         coreapi.Field(
             "end-date",
             required=False,
             location="query",
             schema=coreschema.String(
-                description='needed for occupancy search. format = %Y-%m-%d. Requires: start-date field', ),
+                description='only items free for the whole range from start-date to end-date. '
+                            'format = %Y-%m-%d. Requires: start-date field', ),
+        ),
+        coreapi.Field(
+            "lat",
+            required=False,
+            location="query",
+            schema=coreschema.Number(
+                description='center of a radius based search. Requires: lon, distance field', ),
+        ),
+        coreapi.Field(
+            "lon",
+            required=False,
+            location="query",
+            schema=coreschema.Number(
+                description='center of a radius based search. Requires: lat, distance field', ),
         ),
         coreapi.Field(
             "house-number",
             required=False,
             location="query",
             schema=coreschema.Integer(
-                description='needed for bounding box search. Requires: street, city, distance field', ),
+                description='address based radius search, if lat and lon are not given. '
+                            'Requires: street, city, distance field', ),
         ),
         coreapi.Field(
             "street",
             required=False,
             location="query",
             schema=coreschema.String(
-                description='needed for bounding box search. Requires: house-number, city, distance field', ),
+                description='address based radius search, if lat and lon are not given. '
+                            'Requires: house-number, city, distance field', ),
         ),
         coreapi.Field(
             "city",
             required=False,
             location="query",
             schema=coreschema.String(
-                description='needed for radius based search. Requires: house-number, street, distance field', ),
+                description='address based radius search, if lat and lon are not given. '
+                            'Requires: house-number, street, distance field', ),
         ),
         coreapi.Field(
             "distance",
             required=False,
             location="query",
+            schema=coreschema.Number(
+                description='radius in km. Requires: lat and lon or house-number, street and city field', ),
+        ),
+        coreapi.Field(
+            "order",
+            required=False,
+            location="query",
+            schema=coreschema.String(
+                description='"distance" orders the result of a radius based search by distance', ),
+        ),
+        coreapi.Field(
+            "page-size",
+            required=False,
+            location="query",
+            schema=coreschema.Integer(
+                description='enables cursor based paging. number of items per page', ),
+        ),
+        coreapi.Field(
+            "cursor",
+            required=False,
+            location="query",
             schema=coreschema.String(
-                description='needed for radius based search. Requires: house-number, street, city field', ),
+                description='opaque cursor taken from the next link of the previous page. '
+                            'categories are only returned on the first page', ),
         ),
     ])
+    pagination_class = ItemCursorPagination
+
+    def get(self, request, *args, **kwargs):
+        """
+        Serves json responses from the response cache, keyed by the catalog version and the canonical query.
+        Other formats like the browsable api are rendered per request.
+        """
+        if request.accepted_renderer.format != 'json':
+            return super().get(request, *args, **kwargs)
+
+        # bodies contain absolute urls, so they depend on the host, and media type parameters like indent change them
+        key = (conditional.get_catalog_version(request).version, request.scheme, request.get_host(),
+               request.accepted_media_type, response_cache.canonical_params(request.query_params, ignored=('format',)))
+        entry = response_cache.cache.get(key)
+        cache_status = 'HIT'
+        if entry is None:
+            if fastpath.is_supported(request):
+                entry = response_cache.CachedResponse(request.accepted_renderer.media_type, self.render_fast(request))
+            else:
+                response = self.finalize_response(request, super().get(request, *args, **kwargs), *args, **kwargs)
+                if response.status_code != status.HTTP_200_OK:
+                    return response
+                response.render()
+                entry = response_cache.CachedResponse(response['Content-Type'], response.content)
+            response_cache.cache.set(key, entry)
+            cache_status = 'MISS'
+
+        encoding, body = entry.select(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        response = HttpResponse(body, content_type=entry.content_type)
+        if encoding != response_cache.IDENTITY:
+            response['Content-Encoding'] = encoding
+        patch_vary_headers(response, ('Accept-Encoding',))
+        response['X-Cache'] = cache_status
+        return response
 
     def get_serializer_class(self):
         type = self.request.query_params.get('data-type')
@@ -180,10 +274,10 @@ class ApiItems(generics.ListAPIView):
         return MinimalItemSerializer
 
     def get_queryset(self):
-        queryset = Item.objects.all()
+        queryset = plan_queryset(Item.objects.all(), self.request.query_params.get('data-type'))
         search_token = self.request.query_params.get('search-token')
         if search_token:
-            queryset = queryset.filter(title__icontains=search_token)
+            queryset = search.get_backend().search(queryset, search_token)
         type = self.request.query_params.get('type')
         if type:
             queryset = queryset.filter(type=type)
@@ -238,48 +332,287 @@ class ApiItems(generics.ListAPIView):
         end_date = self.request.query_params.get('end-date')
 
         if start_date and end_date:
-            start_date_obj = datetime.strptime(start_date, '%Y-%m-%d').replace(hour=23, minute=59)
-            end_date_obj = datetime.strptime(end_date, '%Y-%m-%d').replace(hour=23, minute=59)
-            queryset = queryset.filter((
-                                               Q(occupancies__start_time__gt=start_date_obj)
-                                               &
-                                               Q(occupancies__start_time__gt=end_date_obj))
-                                       | (
-                                               Q(occupancies__end_time__lt=start_date_obj)
-                                               &
-                                               Q(occupancies__end_time__lt=end_date_obj))).distinct()
+            queryset = availability.free_between(queryset, *availability.get_day_range(start_date, end_date))
+
+        # beyond half the circumference of the earth every position is within the distance
+        distance = self.get_number_param('distance', 0, math.pi * geocoding.EARTH_RADIUS_KM)
+        if distance is not None:
+            latitude, longitude = self.get_search_position()
+            if latitude is not None and longitude is not None:
+                queryset = self.filter_radius(queryset, latitude, longitude, distance)
+        return queryset
 
+    def get_number_param(self, name, minimum, maximum):
+        """
+        returns a numeric query parameter
+
+        :return: the parameter as float or None if it is missing
+        :raises ParseError: if the parameter is no number between minimum and maximum
+        """
+        value = self.request.query_params.get(name)
+        if not value:
+            return None
+        try:
+            number = float(value)
+        except ValueError:
+            raise ParseError("{} must be a number".format(name))
+        if not minimum <= number <= maximum:
+            raise ParseError("{} must be between {} and {}".format(name, minimum, maximum))
+        return number
+
+    def get_search_position(self):
+        """
+        returns the center of a radius search, either given directly by lat/lon or geocoded from the address
+
+        :return: latitude, longitude or None, None
+        """
+        latitude = self.get_number_param('lat', -90, 90)
+        longitude = self.get_number_param('lon', -180, 180)
+        if latitude is not None and longitude is not None:
+            return latitude, longitude
         house_number = self.request.query_params.get('house-number')
         street = self.request.query_params.get('street')
         city = self.request.query_params.get('city')
-        distance = self.request.query_params.get('distance')
-        if all([house_number, street, city, distance]):
-            latitude, longitude = geocoding.getGeoCode(house_number=house_number, street=street, city=city)
-            if latitude and longitude:
-                min_latitude, max_latitude, min_longitude, max_longitude = geocoding.getBoundingBox(latitude, longitude,
-                                                                                                    distance)
-                queryset = queryset.filter(location__latitude__gt=min_latitude, location__latitude__lt=max_latitude,
-                                           location__longitude__gt=min_longitude, location__longitude__lt=max_longitude)
+        if all([house_number, street, city]):
+            # the request does not wait for the throttled api, the position is only known if cached or indexed
+            return geocoding.getGeoCode(house_number=house_number, street=street, city=city, wait=False)
+        return None, None
+
+    def filter_radius(self, queryset, latitude, longitude, distance):
+        """
+        filters the items to those within distance km of the given position.
+        candidates are narrowed down by an indexed range scan over the geohash cells covering the circle,
+        then checked exactly with the haversine distance, which is annotated as 'distance'.
+
+        :return: filtered queryset, ordered by distance if requested by 'order=distance'
+        """
+        # locations which are not geocoded (yet) never match
+        queryset = queryset.filter(location__geocode_status=Location.GEOCODE_DONE)
+        cells = geohash.covering_cells(latitude, longitude, distance)
+        if cells:
+            cell_filter = Q()
+            for cell in cells:
+                cell_filter |= Q(location__geohash__gte=cell, location__geohash__lt=cell + geohash.UPPER_BOUND)
+            queryset = queryset.filter(cell_filter)
+
+        queryset = queryset.annotate(
+            distance=geocoding.Distance(F('location__latitude'), F('location__longitude'), latitude, longitude)
+        ).filter(distance__lte=distance)
+        if self.request.query_params.get('order') == 'distance':
+            queryset = queryset.order_by('distance', 'id')
         return queryset
 
     def list(self, request, *args, **kwargs):
+        return Response(self.get_data(lambda items: items,
+                                      lambda items: self.get_serializer(items, many=True).data))
+
+    def render_fast(self, request):
+        """
+        renders the json body of the item list from values rows, see fastpath
+
+        :return: json bytes, identical to the body rendered by list()
+        """
+        data_type = request.query_params.get('data-type')
+        data = self.get_data(lambda items: fastpath.item_rows(items, data_type),
+                             lambda rows: fastpath.serialize_items(rows, self.request, data_type))
+        return fastpath.render(data)
+
+    def get_data(self, prepare, serialize):
+        """
+        computes categories, facets and the (paged) items of the filtered queryset
+
+        :param prepare: function returning the queryset to serialize for the filtered queryset
+        :param serialize: function serializing the prepared queryset resp. a page of it
+        :return: response data
+        """
         items = self.get_queryset()
-        categories = Category.objects.filter(item__in=items).distinct()
-        item_serializer = self.get_serializer(items, many=True)
-        category_serializer = CategorySerializer(categories, many=True)
+        if not self.paginator.is_requested(self.request):
+            facets = compute_facets(items)
+            return {
+                "categories": self.get_categories(facets),
+                "facets": facets,
+                "items": serialize(prepare(items)),
+            }
+
+        # categories and facets belong to the whole query, so they are only computed for its first page
+        data = {}
+        if self.paginator.is_first_page(self.request):
+            facets = compute_facets(items)
+            data["categories"] = self.get_categories(facets)
+            data["facets"] = facets
+        page = self.paginate_queryset(prepare(items))
+        data["items"] = serialize(page)
+        data["next"] = self.paginator.get_next_link()
+        return data
+
+    def get_categories(self, facets):
+        """
+        returns the categories occurring in the result, derived from the category facet
+
+        :param facets: facets computed for the result
+        :return: list of serialized categories (id, title)
+        """
+        return CategorySerializer([Category(id=category['id'], title=category['title'])
+                                   for category in facets[CATEGORY_FACET]], many=True).data
+
+
+@permission_classes((AllowAny,))
+@method_decorator(condition(etag_func=conditional.catalog_etag, last_modified_func=conditional.catalog_last_modified),
+                  name='get')
+class ApiItemClusters(views.APIView):
+    """
+        Returns the item clusters of the map viewport given by bbox and zoom.
+        From the zoom level RESPOOL_CLUSTER_ITEM_ZOOM on the single items of the viewport are returned instead.
+    """
+    schema = schemas.AutoSchema(manual_fields=[
+        coreapi.Field(
+            "bbox",
+            required=True,
+            location="query",
+            schema=coreschema.String(description='visible viewport as west,south,east,north in degrees', ),
+        ),
+        coreapi.Field(
+            "zoom",
+            required=True,
+            location="query",
+            schema=coreschema.Integer(description='zoom level of the map', ),
+        ),
+    ])
+
+    def get(self, request):
+        try:
+            bbox = [float(value) for value in request.query_params.get('bbox', '').split(',')]
+            zoom = int(request.query_params.get('zoom', ''))
+        except ValueError:
+            return Response("bbox and zoom are required", status=status.HTTP_400_BAD_REQUEST)
+        if len(bbox) != 4:
+            return Response("bbox requires west,south,east,north", status=status.HTTP_400_BAD_REQUEST)
+        zoom = max(min(zoom, clustering.MAX_ZOOM), 0)
+
+        if zoom >= clustering.get_item_zoom():
+            west, south, east, north = bbox
+            items = plan_queryset(Item.objects.all(), 'map').filter(
+                location__geocode_status=Location.GEOCODE_DONE,
+                location__latitude__gte=south, location__latitude__lte=north)
+            if west <= east:
+                items = items.filter(location__longitude__gte=west, location__longitude__lte=east)
+            else:
+                items = items.filter(Q(location__longitude__gte=west) | Q(location__longitude__lte=east))
+            return Response({
+                "zoom": zoom,
+                "clusters": [],
+                "items": ExtendedItemSerializer(items, many=True, context={'request': request}).data,
+            })
+
+        clusters = [cluster for cluster in clustering.get_clusters(zoom)
+                    if clustering.in_bbox(cluster['latitude'], cluster['longitude'], bbox)]
         return Response({
-            "categories": category_serializer.data,
-            "items": item_serializer.data,
+            "zoom": zoom,
+            "clusters": clusters,
+            "items": [],
+        })
+
+
+@permission_classes((AllowAny,))
+class ApiItemTile(views.APIView):
+    """
+        Returns id, type and coordinates of the items located in a slippy map tile.
+        Every tile carries its own ETag, which only changes when items or locations within the tile change.
+    """
+
+    @method_decorator(condition(etag_func=conditional.tile_etag))
+    def get(self, request, z, x, y):
+        if not tiles.is_valid(z, x, y):
+            raise Http404
+        west, south, east, north = tiles.tile_bounds(z, x, y)
+        rows = Item.objects.filter(location__geocode_status=Location.GEOCODE_DONE,
+                                   location__latitude__gte=south, location__latitude__lt=north,
+                                   location__longitude__gte=west, location__longitude__lt=east) \
+            .order_by('id').values_list('id', 'type', 'location__latitude', 'location__longitude')
+        response = Response({
+            "items": [{'id': item_id, 'type': type, 'lat': latitude, 'lon': longitude}
+                      for item_id, type, latitude, longitude in rows],
         })
+        # caches may keep the tile, but have to revalidate it by its ETag
+        patch_cache_control(response, public=True, no_cache=True)
+        return response
 
 
 @permission_classes((AllowAny,))
+@method_decorator(condition(etag_func=conditional.item_etag, last_modified_func=conditional.item_last_modified),
+                  name='get')
 class ApiItem(generics.RetrieveAPIView):
     """
         Returns id, title, description, dimension, weight, amount, type, loan_agreement, images, location, lender, occupancies
     """
     serializer_class = ItemSerializer
-    queryset = Item.objects.all()
+    queryset = plan_queryset(Item.objects.all(), 'detail')
+
+
+@permission_classes((AllowAny,))
+@method_decorator(condition(etag_func=conditional.catalog_etag, last_modified_func=conditional.catalog_last_modified),
+                  name='get')
+class ApiItemBatch(views.APIView):
+    """
+        Returns the items of the given ids like ApiItem, in the requested order, and the ids which do not exist.
+        At most RESPOOL_ITEM_BATCH_SIZE ids can be requested at once.
+    """
+    schema = schemas.AutoSchema(manual_fields=[
+        coreapi.Field(
+            "ids",
+            required=True,
+            location="query",
+            schema=coreschema.String(description='comma separated item ids', ),
+        ),
+    ])
+
+    def get(self, request):
+        try:
+            ids = [int(item_id) for value in request.query_params.getlist('ids')
+                   for item_id in value.split(',') if item_id.strip()]
+        except ValueError:
+            return Response("ids must be comma separated integers", status=status.HTTP_400_BAD_REQUEST)
+        # keeps the first occurrence of every id
+        ids = list(dict.fromkeys(ids))
+        if not ids:
+            return Response("ids are required", status=status.HTTP_400_BAD_REQUEST)
+        max_ids = getattr(settings, 'RESPOOL_ITEM_BATCH_SIZE', DEFAULT_ITEM_BATCH_SIZE)
+        if len(ids) > max_ids:
+            return Response("at most {} ids can be requested at once".format(max_ids),
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        items = {item.id: item for item in plan_queryset(Item.objects.filter(id__in=ids), 'detail')}
+        return Response({
+            "items": ItemSerializer([items[item_id] for item_id in ids if item_id in items], many=True,
+                                    context={'request': request}).data,
+            "missing": [item_id for item_id in ids if item_id not in items],
+        }, status=status.HTTP_200_OK)
+
+
+@permission_classes((IsAuthenticated,))
+class ApiItemsBulk(views.APIView):
+    """
+    Creates and updates many items of the requesting lender in one transaction.
+    Expects {"items": [rows]}, rows with an id replace that item. Returns the ids of the written rows or,
+    if any row is invalid, the errors per row without writing anything.
+    """
+
+    def post(self, request):
+        lender = Lender.objects.filter(user=request.user).first()
+        if not lender:
+            return Response("only lenders can add items", status=status.HTTP_403_FORBIDDEN)
+        rows = request.data.get('items') if isinstance(request.data, dict) else None
+        if not isinstance(rows, list):
+            return Response("items must be a list of item rows", status=status.HTTP_400_BAD_REQUEST)
+        max_rows = getattr(settings, 'RESPOOL_BULK_MAX_ITEMS', DEFAULT_BULK_MAX_ITEMS)
+        if len(rows) > max_rows:
+            return Response("at most {} items can be written at once".format(max_rows),
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        writer = BulkItemWriter(lender, rows)
+        if not writer.is_valid():
+            return Response({"errors": writer.errors}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({"items": writer.save()}, status=status.HTTP_200_OK)
 
 
 @permission_classes((AllowAny,))
@@ -302,14 +635,130 @@ class ApiItemImageOrdering(views.APIView):
     def post(self, request, pk):
         item = Item.objects.get(id=pk)
         # TODO: fix getlist for api webinterface "'dict' object has no attribute 'getlist'"
-        ordered_image_ids = request.data.getlist('image_ids')
-        int_ordered_image_ids = list(map(int, ordered_image_ids))
-        for image in item.images.all():
-            image.order_id = int(int_ordered_image_ids.index(image.id)) + 1
-            image.save()
+        try:
+            ordered_image_ids = [int(image_id) for image_id in request.data.getlist('image_ids')]
+        except ValueError:
+            return Response("image_ids must be integers", status=status.HTTP_400_BAD_REQUEST)
+        try:
+            set_image_order(item, ordered_image_ids)
+        except ValidationError as err:
+            return Response(" ".join(err.messages), status=status.HTTP_400_BAD_REQUEST)
         return Response("", status=status.HTTP_200_OK)
 
 
+@permission_classes((AllowAny,))
+class ApiUploads(views.APIView):
+    """
+    Starts a chunked upload of an image or a loan agreement, expects 'purpose', 'filename' and 'size'.
+    The chunks are sent to the returned upload, see ApiUpload.
+    Anonymous users may only upload the loan agreement of their registration. The pending uploads of a user
+    resp. an anonymous session and of all anonymous sessions together are limited.
+    """
+
+    def post(self, request):
+        serializer = UploadSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        if request.user.is_authenticated:
+            owner = {'user': request.user}
+        else:
+            if serializer.validated_data['purpose'] != Upload.LOAN_AGREEMENT:
+                return Response("images can only be uploaded after logging in", status=status.HTTP_403_FORBIDDEN)
+            if Upload.objects.filter(user=None).count() >= uploads.get_max_anonymous_pending():
+                return Response("too many pending uploads, please try again later",
+                                status=status.HTTP_429_TOO_MANY_REQUESTS)
+            if not request.session.session_key:
+                request.session.save()
+            owner = {'user': None, 'session_key': request.session.session_key}
+        max_pending = uploads.get_max_pending()
+        if Upload.objects.filter(**owner).count() >= max_pending:
+            return Response("at most {} uploads may be pending".format(max_pending),
+                            status=status.HTTP_429_TOO_MANY_REQUESTS)
+
+        upload = serializer.save(**owner)
+        uploads.create_partial_file(upload.path)
+        return Response(UploadSerializer(upload).data, status=status.HTTP_201_CREATED)
+
+
+@permission_classes((AllowAny,))
+class ApiUpload(views.APIView):
+    """
+    Returns the state of a chunked upload, receives its next chunk or cancels it.
+    A chunk is the raw body of a PATCH request with the headers 'Upload-Offset', the offset of the chunk,
+    and 'Upload-Checksum', e.g. 'sha256 <base64 digest of the chunk>'.
+    A failed upload is resumed by sending the chunks from the offset returned by GET.
+    """
+
+    def get_upload(self, request, pk):
+        upload = Upload.objects.filter(id=pk).first()
+        if not upload or not upload.is_usable_by(request.user):
+            raise Http404
+        return upload
+
+    def get(self, request, pk):
+        return Response(UploadSerializer(self.get_upload(request, pk)).data, status=status.HTTP_200_OK)
+
+    def patch(self, request, pk):
+        upload = self.get_upload(request, pk)
+        try:
+            offset = int(request.META.get('HTTP_UPLOAD_OFFSET', ''))
+            length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            return Response("Upload-Offset and Content-Length are required", status=status.HTTP_400_BAD_REQUEST)
+        if length <= 0:
+            return Response("chunks must not be empty", status=status.HTTP_400_BAD_REQUEST)
+        max_length = uploads.get_max_chunk_size()
+        if length > max_length:
+            return Response("chunks may have at most {} bytes".format(max_length),
+                            status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+        try:
+            with uploads.locked(upload.path):
+                # the state may have been changed by a chunk written while waiting for the lock
+                try:
+                    upload.refresh_from_db()
+                except Upload.DoesNotExist:
+                    raise Http404
+                if upload.completed or offset != upload.offset:
+                    return Response(UploadSerializer(upload).data, status=status.HTTP_409_CONFLICT)
+                if offset + length > upload.size:
+                    return Response("the chunk exceeds the size of the upload", status=status.HTTP_400_BAD_REQUEST)
+                try:
+                    uploads.write_chunk(upload.path, offset, request.stream, length,
+                                        request.META.get('HTTP_UPLOAD_CHECKSUM'))
+                except uploads.ChunkError as err:
+                    return Response(str(err), status=status.HTTP_400_BAD_REQUEST)
+
+                upload.offset += length
+                upload.completed = upload.offset == upload.size
+                if upload.completed and upload.purpose == Upload.IMAGE and not uploads.is_image(upload.path):
+                    upload.delete()
+                    return Response("the uploaded file is not an image", status=status.HTTP_400_BAD_REQUEST)
+                upload.save(update_fields=['offset', 'completed', 'updated'])
+        except FileNotFoundError:
+            # the upload was cancelled or expired while the chunk arrived
+            raise Http404
+        return Response(UploadSerializer(upload).data, status=status.HTTP_200_OK)
+
+    def delete(self, request, pk):
+        self.get_upload(request, pk).delete()
+        return Response("", status=status.HTTP_204_NO_CONTENT)
+
+
+@permission_classes((IsAdminUser,))
+class ApiCacheStats(views.APIView):
+    """
+    Returns the counters of the response cache and the geocode cache of this process
+    """
+
+    def get(self, request):
+        return Response({
+            "responses": response_cache.cache.get_stats(),
+            "geocoding": geocoding.getCacheStats(),
+        }, status=status.HTTP_200_OK)
+
+
 @permission_classes((AllowAny,))
 class ApiRentalFeeIntervallOptions(views.APIView):
     """
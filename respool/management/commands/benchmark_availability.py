@@ -0,0 +1,86 @@
+import datetime
+import random
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q, Max
+from django.utils import timezone
+
+from accounts.models import Lender
+from respool.models import Item, ItemOccupancy, Location, TimeInterval
+from respool.utils import availability
+
+
+def legacy_filter(queryset, start, end):
+    """The occupancy filter ApiItems used before the availability engine."""
+    return queryset.filter((Q(occupancies__start_time__gt=start) & Q(occupancies__start_time__gt=end)) |
+                           (Q(occupancies__end_time__lt=start) & Q(occupancies__end_time__lt=end))).distinct()
+
+
+def max_id(model):
+    return model.objects.aggregate(Max('id')).get('id__max') or 0
+
+
+class Command(BaseCommand):
+    """
+    Command for comparing the former occupancy join filter with the availability engine.
+    Runs on a synthetic catalog inside a transaction which is rolled back afterwards.
+    """
+    help = "Benchmarks the start-date/end-date availability filter"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=5000, help='number of synthetic items')
+        parser.add_argument('--occupancies', type=int, default=10, help='max number of occupancies per item')
+        parser.add_argument('--repeat', type=int, default=5, help='number of timed runs per filter')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.create_catalog(options['items'], options['occupancies'])
+            start, end = availability.get_day_range(
+                (timezone.now() + datetime.timedelta(days=10)).strftime(availability.DATE_FORMAT),
+                (timezone.now() + datetime.timedelta(days=12)).strftime(availability.DATE_FORMAT))
+            items = Item.objects.all()
+
+            for name, run in (('legacy join filter', lambda: legacy_filter(items, start, end)),
+                              ('availability engine', lambda: availability.free_between(items, start, end))):
+                durations = []
+                for _ in range(options['repeat']):
+                    started = time.perf_counter()
+                    count = len(run().values_list('id', flat=True))
+                    durations.append(time.perf_counter() - started)
+                print("{:<20} {:>8} items  best {:8.2f} ms  mean {:8.2f} ms".format(
+                    name, count, min(durations) * 1000, sum(durations) / len(durations) * 1000))
+            transaction.set_rollback(True)
+
+    def create_catalog(self, item_count, max_occupancies):
+        print("creating {} items".format(item_count))
+        user = User.objects.create(username='benchmark-availability')
+        lender = Lender.objects.create(user=user, type=Lender.PRIVATE)
+        location = Location.objects.create(house_number=1, street='Lange Straße', city='Bamberg',
+                                           latitude=49.8917, longitude=10.8875)
+
+        first_item_id = max_id(Item)
+        Item.objects.bulk_create([Item(title='Benchmark {}'.format(index), description='Benchmark', type=Item.SERVICE,
+                                       lender=lender, location=location) for index in range(item_count)],
+                                 batch_size=500)
+        item_ids = Item.objects.filter(id__gt=first_item_id).values_list('id', flat=True)
+
+        now = timezone.now()
+        first_interval_id = max_id(TimeInterval)
+        occupancies = []
+        for item_id in item_ids:
+            for _ in range(random.randint(0, max_occupancies)):
+                start_time = now + datetime.timedelta(days=random.randint(0, 30))
+                occupancies.append((item_id, start_time, start_time + datetime.timedelta(days=random.randint(1, 5))))
+        TimeInterval.objects.bulk_create([TimeInterval(start_time=start_time, end_time=end_time)
+                                          for _, start_time, end_time in occupancies], batch_size=500)
+        interval_ids = TimeInterval.objects.filter(id__gt=first_interval_id).order_by('id').values_list('id', flat=True)
+
+        Item.occupancies.through.objects.bulk_create(
+            [Item.occupancies.through(item_id=item_id, timeinterval_id=interval_id)
+             for (item_id, _, _), interval_id in zip(occupancies, interval_ids)], batch_size=500)
+        ItemOccupancy.objects.bulk_create(
+            [ItemOccupancy(item_id=item_id, time_interval_id=interval_id, start_time=start_time, end_time=end_time)
+             for (item_id, start_time, end_time), interval_id in zip(occupancies, interval_ids)], batch_size=500)
@@ -0,0 +1,80 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import RequestFactory
+from rest_framework.renderers import JSONRenderer
+
+from accounts.models import Lender
+from respool.api.v1 import fastpath
+from respool.api.v1.prefetch import plan_queryset
+from respool.api.v1.serializers import MinimalItemSerializer, ExtendedItemSerializer
+from respool.management.commands.benchmark_availability import max_id
+from respool.models import Item, Image, Location
+
+SERIALIZERS = {None: MinimalItemSerializer, 'map': ExtendedItemSerializer}
+
+
+class Command(BaseCommand):
+    """
+    Command for comparing the DRF serializers of the item list with the values based fast path.
+    Runs on a synthetic catalog inside a transaction which is rolled back afterwards.
+    """
+    help = "Benchmarks the serialization of the item list"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=5000, help='number of synthetic items')
+        parser.add_argument('--repeat', type=int, default=5, help='number of timed runs per path')
+
+    def handle(self, *args, **options):
+        request = RequestFactory().get('/api/v1/respool/items/')
+        with transaction.atomic():
+            item_ids = self.create_catalog(options['items'])
+            items = Item.objects.filter(id__in=item_ids).order_by('id')
+
+            for data_type in SERIALIZERS:
+                def drf():
+                    serializer = SERIALIZERS[data_type](plan_queryset(items, data_type), many=True,
+                                                        context={'request': request})
+                    return JSONRenderer().render(serializer.data)
+
+                def fast():
+                    return fastpath.render(fastpath.serialize_items(fastpath.item_rows(items, data_type), request,
+                                                                    data_type))
+
+                assert drf() == fast(), 'fast path output differs'
+                for name, run in (('drf serializer', drf), ('fast path', fast)):
+                    durations = []
+                    for _ in range(options['repeat']):
+                        started = time.perf_counter()
+                        run()
+                        durations.append(time.perf_counter() - started)
+                    print("{:<5} {:<15} best {:8.2f} ms  {:6.2f} us/item  mean {:8.2f} ms".format(
+                        data_type or 'list', name, min(durations) * 1000, min(durations) / len(item_ids) * 1e6,
+                        sum(durations) / len(durations) * 1000))
+            transaction.set_rollback(True)
+
+    def create_catalog(self, item_count):
+        print("creating {} items".format(item_count))
+        user = User.objects.create(username='benchmark-item-list')
+        lender = Lender.objects.create(user=user, type=Lender.PRIVATE)
+        location = Location.objects.create(house_number=1, street='Lange Straße', city='Bamberg',
+                                           latitude=49.8917, longitude=10.8875)
+
+        first_item_id = max_id(Item)
+        Item.objects.bulk_create([Item(title='Benchmark {}'.format(index), description='Benchmark', type=Item.OBJECT,
+                                       lender=lender, location=location) for index in range(item_count)],
+                                 batch_size=500)
+        item_ids = list(Item.objects.filter(id__gt=first_item_id).values_list('id', flat=True))
+
+        # images are referenced by name only, bulk_create skips the thumbnail generation of Image.save
+        first_image_id = max_id(Image)
+        Image.objects.bulk_create([Image(file='item/images/benchmark-{}.png'.format(item_id),
+                                         thumb='item/thumbs/benchmark-{}.png'.format(item_id), order_id=1)
+                                   for item_id in item_ids], batch_size=500)
+        image_ids = Image.objects.filter(id__gt=first_image_id).order_by('id').values_list('id', flat=True)
+        Item.images.through.objects.bulk_create(
+            [Item.images.through(item_id=item_id, image_id=image_id) for item_id, image_id in zip(item_ids, image_ids)],
+            batch_size=500)
+        return item_ids
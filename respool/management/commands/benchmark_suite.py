@@ -0,0 +1,282 @@
+import datetime
+import json
+import math
+import platform
+import random
+import time
+import tracemalloc
+
+import django
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from accounts.models import Lender
+from respool.management.commands.benchmark_availability import max_id
+from respool.models import Item, Image, ImageVariant, Category, Dimension, Loan, Location, RentalFee, TimeInterval, \
+    ItemOccupancy, add_geocode
+from respool.utils import availability, query_profile, search
+
+DEFAULT_SIZES = (1000, 10000, 100000)
+BATCH_SIZE = 500
+LENDER_COUNT = 20
+CATEGORY_COUNT = 20
+CART_SIZE = 20
+# items are spread over this area around the center of Bamberg
+CENTER = (49.8917, 10.8875)
+SPREAD = 0.1
+NOUNS = ('Stuhl', 'Tisch', 'Beamer', 'Zelt', 'Bierbank', 'Lautsprecher', 'Saal', 'Bühne', 'Werkzeug', 'Fahrrad',
+         'Leinwand', 'Kaffeemaschine', 'Pavillon', 'Mikrofon', 'Anhänger', 'Raum')
+ADJECTIVES = ('großer', 'kleiner', 'gepolsterter', 'mobiler', 'alter', 'neuer', 'roter', 'leiser')
+
+
+def percentile(values, percent):
+    """
+    :return: the nearest rank percentile of the values
+    """
+    values = sorted(values)
+    return values[max(0, math.ceil(percent / 100 * len(values)) - 1)]
+
+
+class Command(BaseCommand):
+    """
+    Command for measuring the main pages and api endpoints on synthetic catalogs of several sizes.
+    Runs on a new test database and a separate local memory cache, each catalog is generated from the seed inside a
+    transaction which is rolled back afterwards. Requests go through the test client, i.e. the whole middleware and
+    url stack, with the response cache disabled so every request computes its response.
+    The report is written as json, progress messages go to stderr.
+    """
+    help = "Benchmarks the item api and pages on synthetic catalogs and reports latency, queries and memory as json"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, nargs='+', default=list(DEFAULT_SIZES),
+                            help='catalog sizes, one benchmark run per size')
+        parser.add_argument('--repeat', type=int, default=20, help='number of timed requests per scenario')
+        parser.add_argument('--warmup', type=int, default=2, help='number of untimed requests per scenario')
+        parser.add_argument('--seed', type=int, default=0, help='seed of the synthetic catalogs')
+        parser.add_argument('--output', help='file the json report is written to, default stdout')
+
+    def handle(self, *args, **options):
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            with override_settings(ALLOWED_HOSTS=['testserver'], RESPOOL_RESPONSE_CACHE_BYTES=0,
+                                   CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                                       'LOCATION': 'respool-benchmark'}}):
+                report = {
+                    'seed': options['seed'],
+                    'repeat': options['repeat'],
+                    'database': connection.vendor,
+                    'python': platform.python_version(),
+                    'django': django.get_version(),
+                    'catalogs': [self.run_catalog(size, options) for size in options['items']],
+                }
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        content = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                output.write(content)
+            self.stderr.write("report written to {}".format(options['output']))
+        else:
+            self.stdout.write(content)
+
+    def run_catalog(self, size, options):
+        with transaction.atomic():
+            self.stderr.write("creating {} items".format(size))
+            started = time.perf_counter()
+            catalog = CatalogBuilder(random.Random(options['seed'])).build(size)
+            build_seconds = time.perf_counter() - started
+
+            client = Client()
+            for item_id in catalog['cart_item_ids']:
+                client.get('/items/{}/addToCart'.format(item_id))
+            scenarios = []
+            for name, url in self.get_scenarios(catalog):
+                self.stderr.write("{:>7} items  {}".format(size, name))
+                scenarios.append(dict(name=name, url=url, **self.measure(client, url, options['repeat'],
+                                                                          options['warmup'])))
+            transaction.set_rollback(True)
+        return {'items': size, 'build_seconds': round(build_seconds, 2), 'scenarios': scenarios}
+
+    @staticmethod
+    def get_scenarios(catalog):
+        """
+        :return: list of (name, url) covering the filter families of the item list, single items, pages and the map
+        """
+        start = timezone.now().date() + datetime.timedelta(days=10)
+        dates = 'start-date={}&end-date={}'.format(start.strftime(availability.DATE_FORMAT),
+                                                   (start + datetime.timedelta(days=2)).strftime(
+                                                       availability.DATE_FORMAT))
+        items = '/api/v1/respool/items/'
+        item_id = catalog['item_id']
+        return [
+            ('items', items),
+            ('items page', items + '?page-size=50'),
+            ('items token', items + '?search-token=Stuhl'),
+            ('items dimensions', items + '?min-height=1&max-height=3&max-width=2'),
+            ('items prices', items + '?max-caution=50&max-rental-fee-costs=20&rental-fee-interval={}'.format(
+                RentalFee.DAILY)),
+            ('items categories', items + '?categories={}&categories={}'.format(*catalog['category_ids'][:2])),
+            ('items dates', items + '?' + dates),
+            ('items radius', items + '?lat={}&lon={}&distance=2&order=distance'.format(*CENTER)),
+            ('map items', items + '?data-type=map'),
+            ('map clusters', '/api/v1/respool/items/clusters?bbox={},{},{},{}&zoom=10'.format(
+                CENTER[1] - SPREAD, CENTER[0] - SPREAD, CENTER[1] + SPREAD, CENTER[0] + SPREAD)),
+            ('item', '/api/v1/respool/items/{}/'.format(item_id)),
+            ('item detail page', '/items/{}/'.format(item_id)),
+            ('shopping cart', '/shoppingcart'),
+        ]
+
+    @staticmethod
+    def measure(client, url, repeat, warmup):
+        """
+        Requests the url repeatedly, the peak memory is traced in an extra request as tracing slows requests down.
+
+        :return: dict with status, response bytes, p50/p95/mean latency, queries, repeated queries,
+            p50 database time and peak memory
+        """
+        for _ in range(warmup):
+            client.get(url)
+        durations = []
+        db_durations = []
+        for _ in range(repeat):
+            recorder = query_profile.QueryRecorder()
+            with connection.execute_wrapper(recorder):
+                started = time.perf_counter()
+                response = client.get(url)
+                durations.append(time.perf_counter() - started)
+            db_durations.append(recorder.duration)
+
+        tracemalloc.start()
+        try:
+            client.get(url)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        return {
+            'status': response.status_code,
+            'bytes': len(response.content),
+            'p50_ms': round(percentile(durations, 50) * 1000, 3),
+            'p95_ms': round(percentile(durations, 95) * 1000, 3),
+            'mean_ms': round(sum(durations) / len(durations) * 1000, 3),
+            'queries': recorder.count,
+            'repeated_queries': recorder.repeated_count,
+            'db_p50_ms': round(percentile(db_durations, 50) * 1000, 3),
+            'peak_memory_kb': round(peak / 1024, 1),
+        }
+
+
+class CatalogBuilder:
+    """
+    Creates a synthetic catalog with bulk inserts, which skip the signals of the models.
+    The values are drawn from the given random generator, so a seed always produces the same catalog.
+    """
+
+    def __init__(self, rng):
+        self.rng = rng
+
+    def build(self, item_count):
+        """
+        Creates lenders, categories, geocoded locations, loans, dimensions, items with one to three categories and
+        images, image variants, occupancies and the search index.
+
+        :return: dict with the 'category_ids', the 'item_id' of a single item benchmark and the 'cart_item_ids'
+        """
+        rng = self.rng
+        lenders = []
+        for index in range(LENDER_COUNT):
+            user = User.objects.create(username='benchmark-suite-{}'.format(index))
+            lenders.append(Lender.objects.create(user=user, type=index % 2))
+        category_ids = self.create(Category, [Category(title='Kategorie {}'.format(index))
+                                              for index in range(CATEGORY_COUNT)])
+
+        locations = []
+        for index in range(max(1, item_count // 10)):
+            location = Location(house_number=index % 100 + 1, street='Straße {}'.format(index // 100),
+                                city='Bamberg', latitude=CENTER[0] + rng.uniform(-SPREAD, SPREAD),
+                                longitude=CENTER[1] + rng.uniform(-SPREAD, SPREAD))
+            # bulk inserts skip the pre_save signal, which sets geohash and geocode status
+            add_geocode(Location, location)
+            locations.append(location)
+        location_ids = self.create(Location, locations)
+        rental_fee_ids = self.create(RentalFee, [RentalFee(interval_unit=interval_unit, costs=costs)
+                                                 for interval_unit, _ in RentalFee.INTERVAL_UNIT_CHOICES
+                                                 for costs in (5, 10, 20, 50)])
+        loan_ids = self.create(Loan, [Loan(caution=rng.choice((None, 20, 50, 100)),
+                                           single_rent=rng.choice((None, 5, 10, 30)),
+                                           rental_fee_id=rng.choice([None] + rental_fee_ids)) for _ in range(100)])
+        dimension_ids = self.create(Dimension, [Dimension(width=rng.randint(1, 5), height=rng.randint(1, 5),
+                                                          depth=rng.randint(1, 5)) for _ in range(100)])
+
+        items = []
+        for index in range(item_count):
+            type = rng.choice((Item.VENUE, Item.SERVICE, Item.OBJECT))
+            noun = rng.choice(NOUNS)
+            items.append(Item(
+                title='{} {} {}'.format(rng.choice(ADJECTIVES).capitalize(), noun, index),
+                description='Ein {} {} zum Ausleihen'.format(rng.choice(ADJECTIVES), noun),
+                type=type, lender=rng.choice(lenders), location_id=rng.choice(location_ids),
+                loan_id=rng.choice(loan_ids),
+                dimension_id=rng.choice(dimension_ids) if type != Item.SERVICE else None,
+                weight=rng.randint(1, 100) if type == Item.OBJECT else None,
+                amount=rng.randint(1, 10) if type == Item.OBJECT else None))
+        item_ids = self.create(Item, items)
+        search.get_backend().index_many((item_id, item.title, item.description)
+                                        for item_id, item in zip(item_ids, items))
+
+        Item.categories.through.objects.bulk_create(
+            [Item.categories.through(item_id=item_id, category_id=category_id)
+             for item_id in item_ids for category_id in rng.sample(category_ids, rng.randint(1, 3))],
+            batch_size=BATCH_SIZE)
+
+        # images are referenced by name only, bulk_create skips the thumbnail and variant generation
+        image_items = [(item_id, order_id) for item_id in item_ids for order_id in range(1, rng.randint(1, 3) + 1)]
+        image_ids = self.create(Image, [Image(file='item/images/benchmark-{}-{}.png'.format(item_id, order_id),
+                                              thumb='item/thumbs/benchmark-{}-{}.jpg'.format(item_id, order_id),
+                                              order_id=order_id) for item_id, order_id in image_items])
+        Item.images.through.objects.bulk_create(
+            [Item.images.through(item_id=item_id, image_id=image_id)
+             for (item_id, _), image_id in zip(image_items, image_ids)], batch_size=BATCH_SIZE)
+        ImageVariant.objects.bulk_create(
+            [ImageVariant(image_id=image_id, width=width, format=format,
+                          file='item/variants/benchmark-{}-{}.{}'.format(image_id, width, format))
+             for image_id in image_ids for width in (320, 640) for format in (ImageVariant.WEBP, ImageVariant.JPEG)],
+            batch_size=BATCH_SIZE)
+
+        now = timezone.now()
+        occupancies = []
+        for item_id in item_ids:
+            for _ in range(rng.randint(0, 3)):
+                start_time = now + datetime.timedelta(days=rng.randint(0, 30))
+                occupancies.append((item_id, start_time, start_time + datetime.timedelta(days=rng.randint(1, 5))))
+        interval_ids = self.create(TimeInterval, [TimeInterval(start_time=start_time, end_time=end_time)
+                                                  for _, start_time, end_time in occupancies])
+        Item.occupancies.through.objects.bulk_create(
+            [Item.occupancies.through(item_id=item_id, timeinterval_id=interval_id)
+             for (item_id, _, _), interval_id in zip(occupancies, interval_ids)], batch_size=BATCH_SIZE)
+        ItemOccupancy.objects.bulk_create(
+            [ItemOccupancy(item_id=item_id, time_interval_id=interval_id, start_time=start_time, end_time=end_time)
+             for (item_id, start_time, end_time), interval_id in zip(occupancies, interval_ids)],
+            batch_size=BATCH_SIZE)
+
+        return {
+            'category_ids': category_ids,
+            'item_id': item_ids[len(item_ids) // 2],
+            'cart_item_ids': rng.sample(item_ids, min(CART_SIZE, len(item_ids))),
+        }
+
+    @staticmethod
+    def create(model, objects):
+        """
+        Inserts the instances in batches.
+
+        :return: the ids of the inserted rows in the order of the instances
+        """
+        first_id = max_id(model)
+        model.objects.bulk_create(objects, batch_size=BATCH_SIZE)
+        return list(model.objects.filter(id__gt=first_id).order_by('id').values_list('id', flat=True))
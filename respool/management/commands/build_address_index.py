@@ -0,0 +1,58 @@
+import csv
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from respool.utils import address_index, geocoding
+
+# accepted column names for each value, plain names or OSM address tags
+COLUMNS = {
+    'house_number': ('house_number', 'housenumber', 'addr:housenumber'),
+    'street': ('street', 'addr:street'),
+    'city': ('city', 'addr:city'),
+    'latitude': ('latitude', 'lat'),
+    'longitude': ('longitude', 'lon'),
+}
+
+
+class Command(BaseCommand):
+    """
+    Command for building the local address index used by the offline geocoder from a csv address extract,
+    e.g. an OSM extract of the service region exported with the columns addr:housenumber, addr:street, addr:city,
+    lat, lon.
+    """
+    help = "Builds the offline geocoder address index from a csv file"
+
+    def add_arguments(self, parser):
+        parser.add_argument('csv_file', help='csv file with a header row')
+        parser.add_argument('--output', default=None,
+                            help='path of the index file, defaults to the setting RESPOOL_GEOCODER_INDEX')
+        parser.add_argument('--delimiter', default=',', help='csv delimiter')
+
+    def handle(self, *args, **options):
+        output = options['output'] or getattr(settings, 'RESPOOL_GEOCODER_INDEX', None)
+        if not output:
+            raise CommandError('no output path given and RESPOOL_GEOCODER_INDEX is not set')
+
+        with open(options['csv_file'], newline='', encoding='utf-8') as csv_file:
+            reader = csv.DictReader(csv_file, delimiter=options['delimiter'])
+            columns = {}
+            for name, candidates in COLUMNS.items():
+                column = next((candidate for candidate in candidates if candidate in reader.fieldnames), None)
+                if column is None:
+                    raise CommandError('missing column for {}, expected one of {}'.format(name, candidates))
+                columns[name] = column
+            count = address_index.build(self.read_rows(reader, columns), output)
+        print("indexed {} addresses in {}".format(count, output))
+
+    @staticmethod
+    def read_rows(reader, columns):
+        for row in reader:
+            try:
+                latitude = float(row[columns['latitude']])
+                longitude = float(row[columns['longitude']])
+            except (TypeError, ValueError):
+                continue
+            key = geocoding.normalizeAddress(row[columns['house_number']], row[columns['street']],
+                                             row[columns['city']])
+            yield key, latitude, longitude
@@ -0,0 +1,41 @@
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from respool.models import Upload
+from respool.utils import uploads
+
+
+class Command(BaseCommand):
+    """
+    Command for deleting chunked uploads which were not completed or not used by a form in time,
+    and partial files without an upload, e.g. left by a crashed process.
+    """
+    help = "Deletes expired chunked uploads"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=float,
+                            default=getattr(settings, 'RESPOOL_UPLOAD_EXPIRY_HOURS', uploads.DEFAULT_EXPIRY_HOURS),
+                            help='age in hours since the last chunk after which an upload expires')
+
+    def handle(self, *args, **options):
+        expired = Upload.objects.filter(updated__lt=timezone.now() - timedelta(hours=options['hours']))
+        deleted = 0
+        for upload in expired:
+            upload.delete()
+            deleted += 1
+        print("deleted {} expired uploads".format(deleted))
+
+        upload_dir = uploads.get_upload_dir()
+        if not os.path.isdir(upload_dir):
+            return
+        # listed before the uploads, so files of uploads started meanwhile are not taken for orphans
+        names = os.listdir(upload_dir)
+        upload_ids = {str(upload_id) for upload_id in Upload.objects.values_list('id', flat=True)}
+        orphans = [name for name in names if name not in upload_ids]
+        for name in orphans:
+            uploads.delete_partial_file(os.path.join(upload_dir, name))
+        print("deleted {} partial files without an upload".format(len(orphans)))
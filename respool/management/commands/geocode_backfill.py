@@ -0,0 +1,49 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from respool.models import Location, geocode_location
+
+
+class Command(BaseCommand):
+    """
+    Command for geocoding all locations which are still pending, e.g. after the geocode service was unreachable.
+    Requests to the geocode service are rate limited (see RESPOOL_GEOCODE_MIN_INTERVAL).
+    """
+    help = "Fills in the coordinates of pending locations"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50, help='number of locations per batch')
+        parser.add_argument('--pause', type=float, default=0.0, help='seconds to wait between two batches')
+        parser.add_argument('--limit', type=int, default=None, help='maximum number of locations to process')
+        parser.add_argument('--retry-failed', action='store_true',
+                            help='also retry locations whose address was not found before')
+
+    def handle(self, *args, **options):
+        if options['retry_failed']:
+            Location.objects.filter(geocode_status=Location.GEOCODE_FAILED).update(
+                geocode_status=Location.GEOCODE_PENDING)
+
+        results = {status: 0 for status, _ in Location.GEOCODE_STATUS_CHOICES}
+        processed = 0
+        last_id = 0
+        while options['limit'] is None or processed < options['limit']:
+            batch_size = options['batch_size']
+            if options['limit'] is not None:
+                batch_size = min(batch_size, options['limit'] - processed)
+            location_ids = list(Location.objects.filter(geocode_status=Location.GEOCODE_PENDING, id__gt=last_id)
+                                .order_by('id').values_list('id', flat=True)[:batch_size])
+            if not location_ids:
+                break
+            for location_id in location_ids:
+                status = geocode_location(location_id)
+                if status is not None:
+                    results[status] += 1
+            processed += len(location_ids)
+            last_id = location_ids[-1]
+            print("processed {} locations".format(processed))
+            if options['pause']:
+                time.sleep(options['pause'])
+
+        print("geocoded: {}, not found: {}, still pending: {}".format(
+            results[Location.GEOCODE_DONE], results[Location.GEOCODE_FAILED], results[Location.GEOCODE_PENDING]))
@@ -1,6 +1,7 @@
 from django.core.management.base import BaseCommand
 
 from respool.management.sample_data_creation import data_creator
+from respool.utils import tasks
 
 
 class Command(BaseCommand):
@@ -12,4 +13,6 @@ class Command(BaseCommand):
     def handle(self, *args, **options):
         print("start importing data")
         data_creator.create()
+        # thumbnails and geocodes are created by the background worker, which ends with the command
+        tasks.wait()
         print("done importing data")
@@ -0,0 +1,53 @@
+import json
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+
+from respool.utils import query_profile
+
+SORT_KEYS = {
+    'queries': lambda view: view['queries']['mean'],
+    'db': lambda view: view['db_ms']['mean'],
+    'repeated': lambda view: view['repeated']['mean'],
+    'requests': lambda view: view['requests'],
+}
+
+
+class Command(BaseCommand):
+    """
+    Command for dumping the per view query summary recorded by the QueryProfileMiddleware of all processes.
+    Processes write their samples to the cache every few seconds, see setting 'RESPOOL_QUERY_PROFILE_FLUSH_SECONDS'.
+    The cache has to be shared by the processes, see setting 'RESPOOL_QUERY_PROFILE_CACHE'.
+    """
+    help = "Dumps the queries per view recorded by the QueryProfileMiddleware"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sort', choices=sorted(SORT_KEYS), default='db',
+                            help='order of the views, by the mean per request, descending')
+        parser.add_argument('--json', action='store_true', help='print the summary as json')
+        parser.add_argument('--clear', action='store_true', help='drop the recorded samples after dumping them')
+
+    def handle(self, *args, **options):
+        try:
+            samples = query_profile.load_samples()
+        except ImproperlyConfigured as err:
+            raise CommandError(err)
+        summary = sorted(query_profile.summarize(samples), key=SORT_KEYS[options['sort']], reverse=True)
+        if options['json']:
+            print(json.dumps(summary, indent=2))
+        elif not summary:
+            print("no requests recorded")
+        else:
+            print("{:<50} {:>8} {:>16} {:>18} {:>14}".format('view', 'requests', 'queries mean/max',
+                                                             'db ms mean/max', 'repeated mean'))
+            for view in summary:
+                print("{:<50} {:>8} {:>9.1f}/{:<6} {:>10.2f}/{:<7.2f} {:>14.1f}".format(
+                    view['view'], view['requests'], view['queries']['mean'], view['queries']['max'],
+                    view['db_ms']['mean'], view['db_ms']['max'], view['repeated']['mean']))
+                for query in view['repeated_queries']:
+                    print("    {} requests, up to {}x: {}".format(query['requests'], query['max_executions'],
+                                                                  query['fingerprint']))
+        if options['clear']:
+            query_profile.clear()
+            if not options['json']:
+                print("cleared the recorded samples")
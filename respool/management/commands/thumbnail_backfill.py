@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from respool.models import Image, create_thumbnail
+
+
+class Command(BaseCommand):
+    """
+    Command for generating all missing thumbnails, e.g. when the background worker was stopped before it was done.
+    """
+    help = "Generates the thumbnails of images without one"
+
+    def handle(self, *args, **options):
+        image_ids = list(Image.objects.filter(Q(thumb='') | Q(thumb__isnull=True)).order_by('id')
+                         .values_list('id', flat=True))
+        created = 0
+        for image_id in image_ids:
+            try:
+                created += create_thumbnail(image_id)
+            except (IOError, OSError) as err:
+                print("image {} could not be read: {}".format(image_id, err))
+        print("created {} of {} missing thumbnails".format(created, len(image_ids)))
@@ -0,0 +1,48 @@
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+from respool.utils import query_profile
+
+'''
+Author: Marius Hofmann
+'''
+
+
+class QueryProfileMiddleware:
+    """
+    Opt-in profiling of the sql queries of each request, enabled by adding
+    'respool.middleware.QueryProfileMiddleware' to MIDDLEWARE. Listed first, it also sees the queries of the other
+    middleware. Setting 'RESPOOL_QUERY_PROFILE' to False disables it again, e.g. in production settings.
+
+    Each response gets a Server-Timing header with the database time, the number of queries and the number of
+    repeated queries, i.e. queries of the same shape executed more than once, the signature of N+1 patterns.
+    The requests are summarized per view (see respool.utils.query_profile and the command 'query_profile'),
+    which requires a cache shared by the processes. Starting fails with ImproperlyConfigured without one.
+    Queries of streaming responses which run while the content is streamed are not recorded.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'RESPOOL_QUERY_PROFILE', True):
+            raise MiddlewareNotUsed
+        query_profile.get_cache()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = query_profile.QueryRecorder()
+        started = time.perf_counter()
+        with ExitStack() as wrappers:
+            for connection in connections.all():
+                wrappers.enter_context(connection.execute_wrapper(recorder))
+            response = self.get_response(request)
+        duration = time.perf_counter() - started
+
+        query_profile.profile.add(query_profile.get_view_name(request), recorder)
+        timing = recorder.server_timing(duration)
+        if response.has_header('Server-Timing'):
+            timing = '{}, {}'.format(response['Server-Timing'], timing)
+        response['Server-Timing'] = timing
+        return response
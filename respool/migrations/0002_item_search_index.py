@@ -0,0 +1,26 @@
+from django.db import migrations
+
+from respool.utils import search
+
+
+def create_search_index(apps, schema_editor):
+    backend = search.get_backend()
+    backend.create_index(schema_editor)
+    Item = apps.get_model('respool', 'Item')
+    for item_id, title, description in Item.objects.values_list('id', 'title', 'description'):
+        backend.index(item_id, title, description)
+
+
+def drop_search_index(apps, schema_editor):
+    search.get_backend().drop_index(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('respool', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
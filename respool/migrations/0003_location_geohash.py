@@ -0,0 +1,26 @@
+from django.db import migrations, models
+
+from respool.utils import geohash
+
+
+def add_geohashes(apps, schema_editor):
+    Location = apps.get_model('respool', 'Location')
+    for location in Location.objects.filter(latitude__isnull=False, longitude__isnull=False):
+        location.geohash = geohash.encode(location.latitude, location.longitude)
+        location.save(update_fields=['geohash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('respool', '0002_item_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='location',
+            name='geohash',
+            field=models.CharField(blank=True, db_index=True, max_length=9, null=True),
+        ),
+        migrations.RunPython(add_geohashes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 2.0.13 on 2026-10-17 21:15
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def copy_occupancies(apps, schema_editor):
+    Item = apps.get_model('respool', 'Item')
+    ItemOccupancy = apps.get_model('respool', 'ItemOccupancy')
+    occupancies = Item.occupancies.through.objects.values_list('item_id', 'timeinterval_id',
+                                                               'timeinterval__start_time', 'timeinterval__end_time')
+    ItemOccupancy.objects.bulk_create([ItemOccupancy(item_id=item_id, time_interval_id=interval_id,
+                                                     start_time=start_time, end_time=end_time)
+                                       for item_id, interval_id, start_time, end_time in occupancies.iterator()],
+                                      batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('respool', '0003_location_geohash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ItemOccupancy',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start_time', models.DateTimeField()),
+                ('end_time', models.DateTimeField()),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='occupancy_slots', to='respool.Item')),
+                ('time_interval', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='occupancy_slots', to='respool.TimeInterval')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='itemoccupancy',
+            index=models.Index(fields=['item', 'start_time', 'end_time'], name='respool_occupancy_item_time'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='itemoccupancy',
+            unique_together={('item', 'time_interval')},
+        ),
+        migrations.RunPython(copy_occupancies, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 2.0.13 on 2026-10-17 21:18
+
+from django.db import migrations, models
+
+GEOCODE_DONE = 1
+
+
+def mark_geocoded_locations(apps, schema_editor):
+    Location = apps.get_model('respool', 'Location')
+    Location.objects.filter(latitude__isnull=False, longitude__isnull=False).update(geocode_status=GEOCODE_DONE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('respool', '0005_geocode_cache'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='location',
+            name='geocode_status',
+            field=models.PositiveSmallIntegerField(choices=[(0, 'Ausstehend'), (1, 'Erledigt'), (2, 'Adresse nicht gefunden')], db_index=True, default=0),
+        ),
+        migrations.RunPython(mark_geocoded_locations, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 2.0.13 on 2026-10-17 21:33
+
+from django.db import migrations, models
+import django.db.models.deletion
+import respool.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('respool', '0007_catalog_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageVariant',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('width', models.PositiveSmallIntegerField()),
+                ('format', models.CharField(choices=[('webp', 'WebP'), ('jpeg', 'JPEG')], max_length=4)),
+                ('file', models.ImageField(upload_to=respool.models.variant_path)),
+                ('image', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='variants', to='respool.Image')),
+            ],
+            options={
+                'ordering': ['width'],
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='imagevariant',
+            unique_together={('image', 'width', 'format')},
+        ),
+    ]
@@ -0,0 +1,76 @@
+# Generated by Django 2.0.13 on 2026-10-17 21:40
+
+import hashlib
+
+from django.db import migrations, models
+import respool.models
+
+
+def collapse_loan_agreements(apps, schema_editor):
+    """
+    Drops agreements without a file, merges agreements with equal content into the oldest one and deletes
+    agreements which neither an item nor a lender references, as each form submit created a new agreement before.
+    Agreements whose file is missing are kept without a content hash.
+    """
+    # accounts has no migrations, so its historical models lack relations to respool but its real models
+    # always match its tables
+    from accounts.models import Lender
+    LoanAgreement = apps.get_model('respool', 'LoanAgreement')
+    Item = apps.get_model('respool', 'Item')
+
+    empty_ids = list(LoanAgreement.objects.filter(models.Q(file='') | models.Q(file__isnull=True))
+                     .values_list('id', flat=True))
+    Item.objects.filter(loan_agreement_id__in=empty_ids).update(loan_agreement=None)
+    Lender.objects.filter(default_loan_agreement_id__in=empty_ids).update(default_loan_agreement=None)
+    LoanAgreement.objects.filter(id__in=empty_ids).delete()
+
+    kept = {}
+    for agreement in LoanAgreement.objects.order_by('id'):
+        storage = agreement.file.storage
+        content_hash = hashlib.sha256()
+        try:
+            with storage.open(agreement.file.name, 'rb') as file:
+                for chunk in file.chunks():
+                    content_hash.update(chunk)
+        except (IOError, OSError):
+            continue
+        content_hash = content_hash.hexdigest()
+        original = kept.get(content_hash)
+        if original is None:
+            agreement.content_hash = content_hash
+            agreement.save(update_fields=['content_hash'])
+            kept[content_hash] = agreement
+            continue
+        Item.objects.filter(loan_agreement_id=agreement.id).update(loan_agreement_id=original.id)
+        Lender.objects.filter(default_loan_agreement_id=agreement.id).update(default_loan_agreement_id=original.id)
+        if agreement.file.name != original.file.name:
+            storage.delete(agreement.file.name)
+        agreement.delete()
+
+    referenced_ids = set(Item.objects.filter(loan_agreement__isnull=False).values_list('loan_agreement_id', flat=True))
+    referenced_ids.update(Lender.objects.filter(default_loan_agreement__isnull=False)
+                          .values_list('default_loan_agreement_id', flat=True))
+    for agreement in LoanAgreement.objects.exclude(id__in=referenced_ids):
+        agreement.file.storage.delete(agreement.file.name)
+        agreement.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('respool', '0010_upload'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='loanagreement',
+            name='content_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='loanagreement',
+            name='file',
+            field=models.FileField(upload_to=respool.models.agreement_path),
+        ),
+        migrations.RunPython(collapse_loan_agreements, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 2.0.13 on 2026-10-17 21:59
+
+from django.db import migrations, models
+import django.db.models.deletion
+import respool.utils.search
+from respool.utils import search
+
+
+def update_search_index(apps, schema_editor):
+    """
+    Configures the rank of existing search indexes, which the search now joins instead of querying per item.
+    """
+    search.get_backend().create_index(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('respool', '0011_loan_agreement_content_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PostgresItemSearch',
+            fields=[
+                ('item', models.OneToOneField(on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='postgres_search', serialize=False, to='respool.Item')),
+                ('document', respool.utils.search.PostgresDocumentField()),
+            ],
+            options={
+                'db_table': 'respool_item_search',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='SqliteItemSearch',
+            fields=[
+                ('item', models.OneToOneField(db_column='rowid', on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='sqlite_search', serialize=False, to='respool.Item')),
+                ('document', respool.utils.search.SqliteDocumentField(db_column='respool_item_fts')),
+                ('rank', models.FloatField()),
+            ],
+            options={
+                'db_table': 'respool_item_fts',
+                'managed': False,
+            },
+        ),
+        migrations.RunPython(update_search_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 2.0.13 on 2026-10-17 22:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('respool', '0012_item_search_models'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TileVersion',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tile', models.CharField(max_length=32, unique=True)),
+                ('version', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.0.13 on 2026-10-17 22:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('respool', '0013_tile_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='upload',
+            name='session_key',
+            field=models.CharField(blank=True, max_length=40, null=True),
+        ),
+    ]
@@ -1,17 +1,24 @@
+import hashlib
 import logging
 import os
 import uuid
 from datetime import datetime
 from io import BytesIO
 
-from PIL import Image as pil_image
+from PIL import Image as pil_image, features as pil_features
+from django.conf import settings
 from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile, File
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.db import models
-from django.db.models import Max
-from django.dispatch import receiver
+from django.db import models, transaction
+from django.db.backends.signals import connection_created
+from django.db.models import F, Max, Q
+from django.db.models.signals import m2m_changed
+from django.dispatch import receiver, Signal
+from django.templatetags.static import static
+from django.utils import timezone
 
-from respool.utils import geocoding
+from respool.utils import bulk, geocoding, geohash, response_cache, search, tasks, tiles, uploads
 
 logger = logging.getLogger(__name__)
 
@@ -26,6 +33,11 @@ MAX_LOCATION_TITLE_LENGTH = 32
 MAX_LOCATION_ADDRESS_LENGTH = 32
 
 THUMB_SIZE = (320, 320)
+# static image shown until the thumbnail of an image is generated
+THUMB_PLACEHOLDER = 'images/placeholder.jpg'
+# widths of the downscaled image variants for srcset attributes, see create_image_variants
+DEFAULT_IMAGE_VARIANT_WIDTHS = (160, 320, 640, 1280)
+IMAGE_VARIANT_QUALITY = 80
 
 
 class Item(models.Model):
@@ -54,6 +66,8 @@ class Item(models.Model):
     dimension = models.ForeignKey('Dimension', on_delete=models.CASCADE, null=True, blank=True)
     weight = models.FloatField(null=True, blank=True)
     amount = models.PositiveIntegerField(null=True, blank=True)
+    # also touched on changes of related objects shown with the item, see catalog_changed
+    updated_at = models.DateTimeField(auto_now=True)
 
     def clean(self):
         """
@@ -82,6 +96,7 @@ class Item(models.Model):
 def delete_referenced_files(sender, instance, *args, **kwargs):
     """
     Deletes Image instances when a Item is deleted.
+    The loan agreement may be shared, it is released after the delete (see release_deleted_loan_agreement).
     Called via receiver/signal on Item pre_delete
 
     :param sender: The Item model class that just had an instance created. Unused in this case.
@@ -93,23 +108,147 @@ def delete_referenced_files(sender, instance, *args, **kwargs):
     for image in instance.images.all():
         image.delete()
 
-    if instance.loan_agreement:
-        try:
-            instance.loan_agreement.delete()
-        except models.ProtectedError:
-            pass
+
+@receiver(models.signals.post_save, sender=Item)
+def index_item(sender, instance, *args, **kwargs):
+    """
+    Adds or updates the full text search index entry of an Item.
+    Called via receiver/signal on Item `post_save`
+    """
+    search.get_backend().index(instance.id, instance.title, instance.description)
+
+
+@receiver(models.signals.post_delete, sender=Item)
+def unindex_item(sender, instance, *args, **kwargs):
+    """
+    Removes the full text search index entry of an Item.
+    Called via receiver/signal on Item `post_delete`
+    """
+    search.get_backend().remove(instance.id)
+
+
+class SqliteItemSearch(models.Model):
+    """
+    Entry of an Item in the SQLite full text search table, maintained by search.SqliteSearchBackend.
+    Only used for joining the table to items, e.g. Item.objects.filter(sqlite_search__document__match=...).
+    """
+    item = models.OneToOneField(Item, on_delete=models.DO_NOTHING, primary_key=True, db_column='rowid',
+                                related_name='sqlite_search')
+    document = search.SqliteDocumentField(db_column=search.SqliteSearchBackend.table)
+    # bm25 of the entry for the matched query, lower is better
+    rank = models.FloatField()
+
+    class Meta:
+        managed = False
+        db_table = search.SqliteSearchBackend.table
+
+
+class PostgresItemSearch(models.Model):
+    """
+    Entry of an Item in the PostgreSQL full text search table, maintained by search.PostgresSearchBackend.
+    Only used for joining the table to items, e.g. Item.objects.filter(postgres_search__document__match=...).
+    """
+    item = models.OneToOneField(Item, on_delete=models.DO_NOTHING, primary_key=True, related_name='postgres_search')
+    document = search.PostgresDocumentField()
+
+    class Meta:
+        managed = False
+        db_table = search.PostgresSearchBackend.table
+
+
+@receiver(models.signals.pre_save, sender=Item)
+def remember_item_relations(sender, instance, *args, **kwargs):
+    """
+    Remembers the stored location and loan agreement of an Item. The map tile of the location changes as well if
+    the location is replaced, a replaced loan agreement is released (see release_item_loan_agreement).
+    Called via receiver/signal on Item `pre_save`
+    """
+    if instance.pk:
+        instance._previous_location_id, instance._previous_loan_agreement_id = Item.objects.filter(
+            pk=instance.pk).values_list('location_id', 'loan_agreement_id').first() or (None, None)
+
+
+@receiver(models.signals.post_save, sender=Item)
+@receiver(models.signals.post_delete, sender=Item)
+def invalidate_item_map(sender, instance, *args, **kwargs):
+    """
+    Invalidates the map tiles of the previous and current location of an Item.
+    Called via receiver/signal on Item `post_save` and `post_delete`
+    """
+    location_ids = {instance.location_id, getattr(instance, '_previous_location_id', None)} - {None}
+    if location_ids:
+        tiles.invalidate(Location.objects.filter(id__in=location_ids).values_list('latitude', 'longitude'))
+
+
+def agreement_path(instance, filename):
+    """
+    Returns the path for saving the file of a LoanAgreement
+
+    :param instance: LoanAgreement, its content hash names the file
+    :param filename: filename of the file to be saved
+    :return: Path containing a subfolder 'agreements' and the content hash as the filename.
+        Agreements without a content hash keep the filename.
+    """
+    name, extension = os.path.splitext(filename)
+    if instance.content_hash:
+        return 'agreements/{}/{}{}'.format(instance.content_hash[:2], instance.content_hash, extension)
+    return 'agreements/{}'.format(filename)
 
 
 class LoanAgreement(models.Model):
     """
     Holds a single file used as a loan agreement.
-    Files are saved to an separate 'agreements' folder
+    Files are saved to an separate 'agreements' folder, each content once. Items and lenders with the same
+    agreement share its row, which is deleted with the last reference (see release_loan_agreement).
     """
-    file = models.FileField(upload_to='agreements/')
+    file = models.FileField(upload_to=agreement_path)
+    # sha256 of the file content
+    content_hash = models.CharField(max_length=64, unique=True, null=True, blank=True, editable=False)
 
     def __str__(self):
         return '{}'.format(self.file.name)
 
+    @classmethod
+    def get_or_create_for_file(cls, file):
+        """
+        Returns the agreement with the content of the given file, a new one is only created for new content.
+
+        :param file: File, e.g. an uploaded file
+        :return: LoanAgreement
+        """
+        agreement, _ = cls.objects.get_or_create(content_hash=get_content_hash(file), defaults={'file': file})
+        return agreement
+
+
+def release_loan_agreement(loan_agreement_id):
+    """
+    Deletes a LoanAgreement and its file, unless an item or a lender still references it.
+
+    :param loan_agreement_id: id of the LoanAgreement, None is ignored
+    """
+    if loan_agreement_id is not None:
+        LoanAgreement.objects.filter(id=loan_agreement_id, item__isnull=True, lender__isnull=True).delete()
+
+
+@receiver(models.signals.post_save, sender=Item)
+def release_replaced_loan_agreement(sender, instance, *args, **kwargs):
+    """
+    Releases the previous loan agreement of an Item whose loan agreement was replaced.
+    Called via receiver/signal on Item `post_save`
+    """
+    previous_loan_agreement_id = getattr(instance, '_previous_loan_agreement_id', None)
+    if previous_loan_agreement_id != instance.loan_agreement_id:
+        release_loan_agreement(previous_loan_agreement_id)
+
+
+@receiver(models.signals.post_delete, sender=Item)
+def release_deleted_loan_agreement(sender, instance, *args, **kwargs):
+    """
+    Releases the loan agreement of a deleted Item.
+    Called via receiver/signal on Item `post_delete`
+    """
+    release_loan_agreement(instance.loan_agreement_id)
+
 
 @receiver(models.signals.post_delete, sender=LoanAgreement)
 def delete_LoanAgreement(sender, instance, *args, **kwargs):
@@ -151,15 +290,26 @@ class Dimension(models.Model):
         return 'W {:10.3f} - H {:10.3f} - D {:10.3f}'.format(self.width, self.height, self.depth)
 
 
+def content_path(folder, content_hash, extension):
+    """
+    Returns the path for saving a file under the content hash of its Image, spread over subfolders by the first
+    two hash digits like git objects.
+    """
+    return 'item/{}/{}/{}{}'.format(folder, content_hash[:2], content_hash, extension)
+
+
 def image_path(instance, filename):
     """
     Returns the path for saving the file of an Image
 
-    :param instance: Unused.
+    :param instance: Image, its content hash names the file
     :param filename: filename of the file to be saved
-    :return: Path containing a subfolder 'images', the current date as a folder and an uuid as the image filename.
+    :return: Path containing a subfolder 'images' and the content hash as the image filename.
+        Images without a content hash use the current date as a folder and an uuid as the image filename.
     """
     name, extension = os.path.splitext(filename)
+    if instance.content_hash:
+        return content_path('images', instance.content_hash, extension)
     date = datetime.now().strftime('%Y/%m/%d')
     return 'item/images/{}/{}{}'.format(date, uuid.uuid4(), extension)
 
@@ -168,38 +318,189 @@ def thumb_path(instance, filename):
     """
     Returns the path for saving the thumb file of an Image
 
-    :param instance: Unused.
+    :param instance: Image, its content hash names the file
     :param filename: filename of the file to be saved
-    :return: Path containing a subfolder 'thumbs', the current date as a folder and an uuid as the image filename.
+    :return: Path containing a subfolder 'thumbs' and the content hash as the image filename.
+        Images without a content hash use the current date as a folder and an uuid as the image filename.
     """
     name, extension = os.path.splitext(filename)
+    if instance.content_hash:
+        return content_path('thumbs', instance.content_hash, extension)
     date = datetime.now().strftime('%Y/%m/%d')
     return 'item/thumbs/{}/{}{}'.format(date, uuid.uuid4(), extension)
 
 
+def variant_path(instance, filename):
+    """
+    Returns the path for saving the file of an ImageVariant
+
+    :param instance: ImageVariant, the content hash of its Image and its width name the file
+    :param filename: filename of the file to be saved
+    :return: Path containing a subfolder 'variants' and the content hash with the width as the image filename.
+        Images without a content hash use the current date as a folder and an uuid as the image filename.
+    """
+    name, extension = os.path.splitext(filename)
+    if instance.image.content_hash:
+        return content_path('variants', '{}-{}'.format(instance.image.content_hash, instance.width), extension)
+    date = datetime.now().strftime('%Y/%m/%d')
+    return 'item/variants/{}/{}{}'.format(date, uuid.uuid4(), extension)
+
+
+def get_content_hash(file):
+    """
+    :param file: File, e.g. an uploaded file
+    :return: hex sha256 digest of the file content
+    """
+    content_hash = hashlib.sha256()
+    for chunk in file.chunks():
+        content_hash.update(chunk)
+    file.seek(0)
+    return content_hash.hexdigest()
+
+
+def delete_unreferenced_file(model, field_name, name):
+    """
+    Deletes a stored file once the current transaction is committed, unless rows of the model still reference it.
+    Images with the same content share their files, so a file is only deleted with its last reference.
+
+    :param model: model class holding the file field
+    :param field_name: name of the file field
+    :param name: name of the file in the storage of the field
+    """
+    if not name:
+        return
+    storage = model._meta.get_field(field_name).storage
+
+    def delete():
+        if not model.objects.filter(**{field_name: name}).exists():
+            storage.delete(name)
+
+    transaction.on_commit(delete)
+
+
 class Image(models.Model):
     """
     Holds a single image, a thumbnail and an order id.
+    Images with equal content share their files, which are named by the content hash.
     """
     file = models.ImageField(upload_to=image_path)
     thumb = models.ImageField(upload_to=thumb_path, null=True, blank=True)
     order_id = models.PositiveSmallIntegerField()
+    # sha256 of the file content, set on upload (see save_image)
+    content_hash = models.CharField(max_length=64, null=True, blank=True, editable=False, db_index=True)
 
     def __str__(self):
         return '{} - {}'.format(self.order_id, self.file.name)
 
+    @property
+    def thumb_url(self):
+        """
+        :return: url of the thumbnail or of the placeholder image while the thumbnail is generated
+        """
+        if self.thumb:
+            return self.thumb.url
+        return static(THUMB_PLACEHOLDER)
+
+    def get_srcset(self, format, build_url=None):
+        """
+        Uses the prefetched variants if the image was loaded with them.
+
+        :param format: ImageVariant.WEBP or ImageVariant.JPEG
+        :param build_url: optional function applied to the variant urls, e.g. request.build_absolute_uri
+        :return: value of a srcset attribute listing the variants of the format by width,
+            empty while the variants are generated
+        """
+        return ', '.join('{} {}w'.format(build_url(variant.file.url) if build_url else variant.file.url, variant.width)
+                         for variant in self.variants.all() if variant.format == format)
+
     class Meta:
         # explicitly sort by order_id as it used for image ordering
         ordering = ['order_id']
 
 
+class ImageVariant(models.Model):
+    """
+    Holds a downscaled copy of an Image in one width and format, used for responsive srcset attributes.
+    """
+    WEBP = 'webp'
+    JPEG = 'jpeg'
+
+    FORMAT_CHOICES = ((WEBP, 'WebP'), (JPEG, 'JPEG'))
+
+    image = models.ForeignKey('Image', on_delete=models.CASCADE, related_name='variants')
+    width = models.PositiveSmallIntegerField()
+    format = models.CharField(max_length=4, choices=FORMAT_CHOICES)
+    file = models.ImageField(upload_to=variant_path)
+
+    def __str__(self):
+        return '{} - {}w {}'.format(self.image_id, self.width, self.format)
+
+    class Meta:
+        ordering = ['width']
+        unique_together = ('image', 'width', 'format')
+
+
 @receiver(models.signals.pre_save, sender=Image)
 def save_image(sender, instance, *args, **kwargs):
     """
-    Creates a thumbnail for the image and saves it to the Image instance.
+    Hashes a newly uploaded file of an Image. If an Image with the same content exists, the upload is dropped
+    and the files of that image are shared. Otherwise the file is stored under its hash and the thumbnail and the
+    variants are generated in the background (see create_thumbnail and create_image_variants).
+    The previous files of a replaced upload are deleted unless other images share them.
+    Saves which keep the file, e.g. of the order id, do not touch the files.
     Called via receiver/signal on Image `pre_save`
     """
-    image = pil_image.open(instance.file)
+    if not instance.file or instance.file._committed:
+        return
+    previous = Image.objects.filter(pk=instance.pk).values('file', 'thumb').first() if instance.pk else None
+    instance.content_hash = get_content_hash(instance.file)
+    original = Image.objects.filter(content_hash=instance.content_hash).order_by('pk').first()
+    if original:
+        instance.file = original.file.name
+        instance.thumb = original.thumb.name or None
+    else:
+        instance.thumb = None
+    if previous and previous['file'] == instance.file.name:
+        return
+
+    instance._thumb_outdated = True
+    if previous:
+        instance.variants.all().delete()
+        delete_unreferenced_file(Image, 'file', previous['file'])
+        delete_unreferenced_file(Image, 'thumb', previous['thumb'])
+
+
+@receiver(models.signals.post_save, sender=Image)
+def schedule_thumbnail(sender, instance, *args, **kwargs):
+    """
+    Schedules the generation of the thumbnail and the variants of a newly uploaded image in the background worker.
+    Called via receiver/signal on Image `post_save`
+    """
+    if getattr(instance, '_thumb_outdated', False):
+        instance._thumb_outdated = False
+        tasks.run_on_commit(create_thumbnail, instance.id)
+        tasks.run_on_commit(create_image_variants, instance.id)
+
+
+def create_thumbnail(image_id):
+    """
+    Creates the thumbnail of an Image and saves it to the Image instance.
+    Images with the same content share one thumbnail, it is only created for the first of them.
+
+    :param image_id: id of the Image
+    :return: True if a thumbnail was created, False if the image has one already, shares one or does not exist
+        (anymore)
+    """
+    image_model = Image.objects.filter(id=image_id).first()
+    if not image_model or image_model.thumb:
+        return False
+    shared_thumb = Image.objects.filter(content_hash=image_model.content_hash).exclude(thumb='') \
+        .exclude(thumb__isnull=True).values_list('thumb', flat=True).first() if image_model.content_hash else None
+    if shared_thumb:
+        image_model.thumb = shared_thumb
+        image_model.save(update_fields=['thumb'])
+        return False
+    image = pil_image.open(image_model.file)
     if image.mode not in ('L', 'RGB'):
         image = image.convert('RGB')
     image.thumbnail(THUMB_SIZE, pil_image.ANTIALIAS)
@@ -210,21 +511,116 @@ def save_image(sender, instance, *args, **kwargs):
     temp_handle.seek(0)  # rewind the file
 
     # save to the thumbnail field
-    instance.thumb = SimpleUploadedFile(os.path.split(instance.file.name)[-1],
-                                        temp_handle.read(),
-                                        content_type='image/jpg')
+    image_model.thumb = SimpleUploadedFile(os.path.split(image_model.file.name)[-1],
+                                           temp_handle.read(),
+                                           content_type='image/jpg')
+    image_model.save(update_fields=['thumb'])
+    return True
+
+
+def get_image_variant_widths(original_width):
+    """
+    Returns the variant widths for an image, see setting 'RESPOOL_IMAGE_VARIANT_WIDTHS'.
+    Images are not upscaled, widths above the original width are replaced by the original width.
+
+    :param original_width: width of the original image in pixels
+    :return: sorted list of widths
+    """
+    widths = getattr(settings, 'RESPOOL_IMAGE_VARIANT_WIDTHS', DEFAULT_IMAGE_VARIANT_WIDTHS)
+    return sorted({min(width, original_width) for width in widths})
+
+
+def get_image_variant_formats():
+    """
+    :return: the variant formats supported by the installed Pillow, WebP is skipped if Pillow lacks libwebp
+    """
+    if pil_features.check('webp'):
+        return [ImageVariant.WEBP, ImageVariant.JPEG]
+    return [ImageVariant.JPEG]
+
+
+def create_image_variants(image_id):
+    """
+    Creates the variants of an Image in all widths and formats.
+    Images with the same content share the variant files, they are only generated for the first of them.
+    Like other bulk writes this skips the post_save signals, the catalog is changed once for the image instead.
+
+    :param image_id: id of the Image
+    :return: number of generated variant files, 0 if the image has variants already, shares them or does not exist
+        (anymore)
+    """
+    image_model = Image.objects.filter(id=image_id).first()
+    if not image_model or image_model.variants.exists():
+        return 0
+    shared_image_id = ImageVariant.objects.filter(image__content_hash=image_model.content_hash) \
+        .values_list('image_id', flat=True).first() if image_model.content_hash else None
+    if shared_image_id:
+        ImageVariant.objects.bulk_create([
+            ImageVariant(image=image_model, width=variant.width, format=variant.format, file=variant.file.name)
+            for variant in ImageVariant.objects.filter(image_id=shared_image_id)])
+        change_catalog(Q(images=image_model.pk))
+        return 0
+    original = pil_image.open(image_model.file)
+    if original.mode not in ('L', 'RGB'):
+        original = original.convert('RGB')
+    name = os.path.splitext(os.path.split(image_model.file.name)[-1])[0]
+
+    variants = []
+    for width in get_image_variant_widths(original.width):
+        height = max(1, round(original.height * width / original.width))
+        image = original.resize((width, height), pil_image.ANTIALIAS) if width < original.width else original
+        for format in get_image_variant_formats():
+            temp_handle = BytesIO()
+            image.save(temp_handle, format, quality=IMAGE_VARIANT_QUALITY)
+            variant = ImageVariant(image=image_model, width=width, format=format)
+            variant.file.save('{}.{}'.format(name, format), ContentFile(temp_handle.getvalue()), save=False)
+            variants.append(variant)
+    ImageVariant.objects.bulk_create(variants)
+    change_catalog(Q(images=image_model.pk))
+    return len(variants)
 
 
 @receiver(models.signals.post_delete, sender=Image)
 def delete_image(sender, instance, *args, **kwargs):
     """
-    Deletes image files from the file system on Image `post_delete`
+    Deletes image files from the file system on Image `post_delete`, unless other images share them
     Idea: https://stackoverflow.com/questions/33080360/how-to-delete-files-from-filesystem-using-post-delete-django-1-8
     """
-    if instance.file and os.path.exists(instance.file.path):
-        os.remove(instance.file.path)
-    if instance.thumb and os.path.exists(instance.thumb.path):
-        os.remove(instance.thumb.path)
+    delete_unreferenced_file(Image, 'file', instance.file.name)
+    delete_unreferenced_file(Image, 'thumb', instance.thumb.name)
+
+
+@receiver(models.signals.post_delete, sender=ImageVariant)
+def delete_image_variant(sender, instance, *args, **kwargs):
+    """
+    Deletes the file of an ImageVariant once the deletion is committed, unless other variants share it.
+    Called via receiver/signal on ImageVariant `post_delete`
+    """
+    delete_unreferenced_file(ImageVariant, 'file', instance.file.name)
+
+
+def set_image_order(item, image_ids):
+    """
+    Sets the order ids of the images of an item from 1 to n in the order of the given image ids.
+    The order ids are written with one update, which bypasses the save signals of the images,
+    the catalog is changed once for the item instead.
+
+    :param item: Item whose images are ordered
+    :param image_ids: ids of all images of the item in the new order
+    :raises ValidationError: if the ids are not exactly the ids of the images of the item
+    """
+    with transaction.atomic():
+        order_ids = dict(item.images.values_list('id', 'order_id'))
+        if len(set(image_ids)) != len(image_ids):
+            raise ValidationError('Image ids must not repeat.')
+        if set(image_ids) != set(order_ids):
+            raise ValidationError('Image ids must be the ids of all images of the item.')
+        images = [Image(id=image_id, order_id=index + 1) for index, image_id in enumerate(image_ids)
+                  if order_ids[image_id] != index + 1]
+        if not images:
+            return
+        bulk.bulk_update(Image, images, ['order_id'])
+        change_catalog(Q(id=item.pk))
 
 
 def reset_image_order_ids(item):
@@ -235,9 +631,7 @@ def reset_image_order_ids(item):
     :param item: Item for which the order ids of the images should be reset.
     :return:
     """
-    for index, image in enumerate(item.images.all()):
-        image.order_id = index + 1
-        image.save()
+    set_image_order(item, list(item.images.values_list('id', flat=True)))
 
 
 def get_next_order_id(item):
@@ -247,22 +641,31 @@ def get_next_order_id(item):
     :param item: Item which a new image shall be added to.
     :return: The next order id to be used (current maximum order id + 1)
     """
-    images = item.images.all()
-    if not images:
-        return 1
-    return images.aggregate(Max('order_id')).get('order_id__max') + 1
+    return (item.images.aggregate(Max('order_id')).get('order_id__max') or 0) + 1
 
 
 class Location(models.Model):
     """
     Wrapper class for holding a single address and its coordinates.
+    Locations without coordinates are saved as 'pending' and geocoded in the background.
     """
+    GEOCODE_PENDING = 0
+    GEOCODE_DONE = 1
+    GEOCODE_FAILED = 2
+
+    GEOCODE_STATUS_CHOICES = ((GEOCODE_PENDING, 'Ausstehend'), (GEOCODE_DONE, 'Erledigt'),
+                              (GEOCODE_FAILED, 'Adresse nicht gefunden'))
+
     title = models.CharField(max_length=MAX_LOCATION_TITLE_LENGTH, null=True, blank=True)
     house_number = models.PositiveIntegerField()
     street = models.CharField(max_length=MAX_LOCATION_ADDRESS_LENGTH)
     city = models.CharField(max_length=MAX_LOCATION_ADDRESS_LENGTH, default='Bamberg')
     longitude = models.FloatField(blank=True, null=True)
     latitude = models.FloatField(blank=True, null=True)
+    # geohash of the coordinates, used to narrow radius searches by cell prefix
+    geohash = models.CharField(max_length=geohash.MAX_PRECISION, blank=True, null=True, db_index=True)
+    geocode_status = models.PositiveSmallIntegerField(choices=GEOCODE_STATUS_CHOICES, default=GEOCODE_PENDING,
+                                                      db_index=True)
 
     def __str__(self):
         return '{} {} - {}'.format(self.street, self.house_number, self.city)
@@ -271,8 +674,10 @@ class Location(models.Model):
 @receiver(models.signals.pre_save, sender=Location)
 def add_geocode(sender, instance, *args, **kwargs):
     """
-    Adds the coordinates to a Location instance if not provided by the user.
-    Uses address and geocode api to retrieve longitude and latitude for provided address.
+    Keeps the geocode status and the geohash of a Location instance in sync with its coordinates.
+    Locations without coordinates are marked as pending, the geocoding itself is deferred to the background
+    (see geocode_location), so saving a Location never waits for the geocode api. Failed locations stay failed
+    until their address changes.
     Called on Location 'pre_save'.
 
     :param sender: Unused.
@@ -281,13 +686,100 @@ def add_geocode(sender, instance, *args, **kwargs):
     :param kwargs: Unused.
     :return:
     """
-    # only get geocode from adress if not provided already
-    if not instance.longitude or not instance.latitude:
-        latitude, longitude = geocoding.getGeoCode(house_number=instance.house_number, street=instance.street,
-                                                   city=instance.city)
-        if latitude and longitude:
-            instance.longitude = longitude
-            instance.latitude = latitude
+    if instance.latitude is not None and instance.longitude is not None:
+        instance.geohash = geohash.encode(instance.latitude, instance.longitude)
+        instance.geocode_status = Location.GEOCODE_DONE
+    else:
+        instance.geohash = None
+        address = (instance.house_number, instance.street, instance.city)
+        if instance.geocode_status != Location.GEOCODE_FAILED or (instance.pk and address != Location.objects.filter(
+                pk=instance.pk).values_list('house_number', 'street', 'city').first()):
+            instance.geocode_status = Location.GEOCODE_PENDING
+
+
+@receiver(models.signals.post_save, sender=Location)
+def schedule_geocode(sender, instance, *args, **kwargs):
+    """
+    Schedules the geocoding of a pending Location in the background worker.
+    Called on Location 'post_save'.
+    """
+    if instance.geocode_status == Location.GEOCODE_PENDING:
+        tasks.run_on_commit(geocode_location, instance.id)
+
+
+def geocode_location(location_id):
+    """
+    Retrieves the coordinates of a pending Location from its address and saves them.
+    Locations whose address can not be found are marked as failed, on service errors they stay pending.
+
+    :param location_id: id of the Location
+    :return: the new geocode status, None if the location is not pending (anymore)
+    """
+    location = Location.objects.filter(id=location_id, geocode_status=Location.GEOCODE_PENDING).first()
+    if not location:
+        return None
+    try:
+        latitude, longitude = geocoding.lookupGeoCode(house_number=location.house_number, street=location.street,
+                                                      city=location.city)
+    except geocoding.GeoCodingError as err:
+        logger.warning('geocoding of location %s failed: %s', location_id, err)
+        return Location.GEOCODE_PENDING
+    if latitude is None or longitude is None:
+        Location.objects.filter(id=location_id).update(geocode_status=Location.GEOCODE_FAILED)
+        return Location.GEOCODE_FAILED
+    location.latitude = latitude
+    location.longitude = longitude
+    location.save(update_fields=['latitude', 'longitude', 'geohash', 'geocode_status'])
+    return Location.GEOCODE_DONE
+
+
+@receiver(models.signals.pre_save, sender=Location)
+def remember_location_position(sender, instance, *args, **kwargs):
+    """
+    Remembers the stored coordinates of a Location, so the map tiles it is moved out of can be invalidated.
+    Called via receiver/signal on Location `pre_save`
+    """
+    if instance.pk:
+        instance._previous_position = Location.objects.filter(pk=instance.pk).values_list('latitude',
+                                                                                         'longitude').first()
+
+
+@receiver(models.signals.post_save, sender=Location)
+@receiver(models.signals.post_delete, sender=Location)
+def invalidate_location_map(sender, instance, *args, **kwargs):
+    """
+    Invalidates the map tiles of the previous and current position of a Location,
+    the position of all items at this location may have changed.
+    Called via receiver/signal on Location `post_save` and `post_delete`
+    """
+    positions = [(instance.latitude, instance.longitude)]
+    if getattr(instance, '_previous_position', None):
+        positions.append(instance._previous_position)
+    tiles.invalidate(positions)
+
+
+@receiver(connection_created)
+def register_database_functions(sender, connection, *args, **kwargs):
+    """
+    Registers the functions of the radius search (see geocoding.Distance) with new SQLite connections.
+    Called via receiver/signal on `connection_created`
+    """
+    if connection.vendor == 'sqlite':
+        geocoding.register_sqlite_functions(connection)
+
+
+class GeoCodeCacheEntry(models.Model):
+    """
+    Persistent tier of the geocode cache.
+    Holds the coordinates of a normalized address, both null if the address could not be found.
+    """
+    key = models.CharField(max_length=geocoding.MAX_CACHE_KEY_LENGTH, unique=True)
+    latitude = models.FloatField(blank=True, null=True)
+    longitude = models.FloatField(blank=True, null=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return '{} - {}, {}'.format(self.key, self.latitude, self.longitude)
 
 
 class Loan(models.Model):
@@ -338,3 +830,283 @@ class TimeInterval(models.Model):
 
     def __str__(self):
         return '{} - {}'.format(self.start_time.strftime('%d %b %Y %H:%M'), self.end_time.strftime('%d %b %Y %H:%M'))
+
+
+class ItemOccupancy(models.Model):
+    """
+    Denormalized copy of the Item.occupancies relation including the start and end time of each interval.
+    Used by the availability search, which checks interval overlaps per item on the
+    (item, start_time, end_time) index instead of joining through the many to many table.
+    Kept in sync via receivers on Item.occupancies `m2m_changed` and TimeInterval `post_save`.
+    """
+    item = models.ForeignKey(Item, on_delete=models.CASCADE, related_name='occupancy_slots')
+    time_interval = models.ForeignKey(TimeInterval, on_delete=models.CASCADE, related_name='occupancy_slots')
+    start_time = models.DateTimeField()
+    end_time = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('item', 'time_interval')
+        indexes = [models.Index(fields=['item', 'start_time', 'end_time'], name='respool_occupancy_item_time')]
+
+    def __str__(self):
+        return '{} - {} - {}'.format(self.item_id, self.start_time, self.end_time)
+
+
+@receiver(m2m_changed, sender=Item.occupancies.through)
+def sync_item_occupancies(sender, instance, action, reverse, pk_set, *args, **kwargs):
+    """
+    Mirrors changes of Item.occupancies to ItemOccupancy.
+    Called via receiver/signal on Item.occupancies `m2m_changed`, from either side of the relation.
+    """
+    if action == 'post_add':
+        if reverse:
+            intervals = {instance.id: instance}
+            pairs = [(item_id, instance.id) for item_id in pk_set]
+        else:
+            intervals = TimeInterval.objects.in_bulk(pk_set)
+            pairs = [(instance.id, interval_id) for interval_id in pk_set]
+        ItemOccupancy.objects.bulk_create(
+            [ItemOccupancy(item_id=item_id, time_interval_id=interval_id,
+                           start_time=intervals[interval_id].start_time, end_time=intervals[interval_id].end_time)
+             for item_id, interval_id in pairs])
+    elif action == 'post_remove':
+        if reverse:
+            ItemOccupancy.objects.filter(time_interval=instance, item__in=pk_set).delete()
+        else:
+            ItemOccupancy.objects.filter(item=instance, time_interval__in=pk_set).delete()
+    elif action == 'post_clear':
+        if reverse:
+            ItemOccupancy.objects.filter(time_interval=instance).delete()
+        else:
+            ItemOccupancy.objects.filter(item=instance).delete()
+
+
+@receiver(models.signals.post_save, sender=TimeInterval)
+def sync_time_interval(sender, instance, created, *args, **kwargs):
+    """
+    Updates the denormalized times of an edited TimeInterval.
+    Called via receiver/signal on TimeInterval `post_save`
+    """
+    if not created:
+        ItemOccupancy.objects.filter(time_interval=instance).update(start_time=instance.start_time,
+                                                                    end_time=instance.end_time)
+
+
+class Upload(models.Model):
+    """
+    Holds a file uploaded in chunks (see respool.utils.uploads) until a form consumes it.
+    The received bytes are kept in a partial file outside of the media storage, the random id is passed to the forms.
+    Uploads of anonymous users, i.e. the loan agreement of a registration, can be used by anyone knowing the id.
+    """
+    IMAGE = 'image'
+    LOAN_AGREEMENT = 'loan_agreement'
+
+    PURPOSE_CHOICES = ((IMAGE, 'Bild'), (LOAN_AGREEMENT, 'Leihvertrag'))
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True)
+    # session of an anonymous uploader, whose pending uploads are limited like those of a user
+    session_key = models.CharField(max_length=40, null=True, blank=True)
+    purpose = models.CharField(max_length=16, choices=PURPOSE_CHOICES)
+    filename = models.CharField(max_length=255)
+    size = models.PositiveIntegerField()
+    # number of bytes received so far, a resumed upload continues at this offset
+    offset = models.PositiveIntegerField(default=0)
+    completed = models.BooleanField(default=False)
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return '{} - {} ({}/{})'.format(self.id, self.filename, self.offset, self.size)
+
+    @property
+    def path(self):
+        """
+        :return: path of the partial file
+        """
+        return os.path.join(uploads.get_upload_dir(), str(self.id))
+
+    def is_usable_by(self, user):
+        """
+        :param user: User or AnonymousUser
+        :return: True if the user may continue or consume the upload
+        """
+        return self.user_id is None or self.user_id == user.id
+
+    def open(self):
+        """
+        :return: File of the received bytes, named like the uploaded file. Should be closed after use.
+        """
+        return File(open(self.path, 'rb'), name=self.filename)
+
+    def consume(self, create):
+        """
+        Passes the file of a completed upload to create, e.g. to create a model instance, and deletes the upload.
+
+        :param create: function called with the File of the upload
+        :return: result of create
+        """
+        with self.open() as file:
+            result = create(file)
+        self.delete()
+        return result
+
+
+@receiver(models.signals.post_delete, sender=Upload)
+def delete_upload(sender, instance, *args, **kwargs):
+    """
+    Deletes the partial file of an Upload once the deletion is committed.
+    Called via receiver/signal on Upload `post_delete`
+    """
+    path = instance.path
+    transaction.on_commit(lambda: uploads.delete_partial_file(path))
+
+
+class CatalogVersion(models.Model):
+    """
+    Single row counting the changes of the catalog, i.e. of items and all objects shown with them.
+    Used as validator for api responses, see catalog_changed.
+    """
+    SINGLETON_ID = 1
+
+    version = models.PositiveIntegerField(default=0)
+    updated = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return '{} - {}'.format(self.version, self.updated)
+
+    @classmethod
+    def get(cls):
+        """
+        :return: the current CatalogVersion
+        """
+        catalog_version, _ = cls.objects.get_or_create(id=cls.SINGLETON_ID)
+        return catalog_version
+
+    @classmethod
+    def bump(cls):
+        """
+        Increments the catalog version within the current transaction.
+        """
+        if not cls.objects.filter(id=cls.SINGLETON_ID).update(version=F('version') + 1, updated=timezone.now()):
+            cls.objects.get_or_create(id=cls.SINGLETON_ID, defaults={'version': 1})
+
+
+class TileVersion(models.Model):
+    """
+    Counts the changes of a slippy map tile of the item map, i.e. of the items and locations within it.
+    Used as validator for the tile responses, tiles without a row never changed. See tiles.invalidate.
+    """
+    # zoom/x/y of the tile
+    tile = models.CharField(max_length=32, unique=True)
+    version = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return '{} - {}'.format(self.tile, self.version)
+
+
+# lookup from Item to the related objects whose changes alter the api representation of the item,
+# lenders and their users are handled in accounts.models
+CATALOG_ITEM_LOOKUPS = {
+    Item: 'id',
+    Image: 'images',
+    Location: 'location',
+    Loan: 'loan',
+    RentalFee: 'loan__rental_fee',
+    Dimension: 'dimension',
+    LoanAgreement: 'loan_agreement',
+    Category: 'categories',
+    TimeInterval: 'occupancies',
+}
+
+
+def touch_items(item_filter):
+    """
+    Sets updated_at of the items matching the filter to now, without calling save() and its signals.
+
+    :param item_filter: Q object on Item
+    """
+    Item.objects.filter(item_filter).update(updated_at=timezone.now())
+
+
+def change_catalog(item_filter=None):
+    """
+    Bumps the catalog version and drops the cached responses of this process,
+    other processes miss them by the new catalog version.
+
+    :param item_filter: optional Q object on Item, the matching items are touched (see touch_items)
+    """
+    CatalogVersion.bump()
+    response_cache.cache.clear()
+    if item_filter is not None:
+        touch_items(item_filter)
+
+
+@receiver(models.signals.post_save, sender=Item)
+@receiver(models.signals.post_delete, sender=Item)
+@receiver(models.signals.post_save, sender=Image)
+@receiver(models.signals.post_delete, sender=Image)
+@receiver(models.signals.post_save, sender=Location)
+@receiver(models.signals.post_delete, sender=Location)
+@receiver(models.signals.post_save, sender=Loan)
+@receiver(models.signals.post_delete, sender=Loan)
+@receiver(models.signals.post_save, sender=RentalFee)
+@receiver(models.signals.pre_delete, sender=RentalFee)
+@receiver(models.signals.post_save, sender=Dimension)
+@receiver(models.signals.pre_delete, sender=Dimension)
+@receiver(models.signals.post_save, sender=LoanAgreement)
+@receiver(models.signals.pre_delete, sender=LoanAgreement)
+@receiver(models.signals.post_save, sender=Category)
+@receiver(models.signals.post_delete, sender=Category)
+@receiver(models.signals.post_save, sender=TimeInterval)
+@receiver(models.signals.post_delete, sender=TimeInterval)
+def catalog_changed(sender, instance, *args, **kwargs):
+    """
+    Bumps the catalog version and touches updated_at of the items showing the changed object.
+    Cached responses of this process are dropped, other processes miss them by the new catalog version.
+    Deleting a rental fee, dimension or loan agreement clears or deletes the referencing items before
+    `post_delete`, so these are handled on `pre_delete`, within the transaction of the delete.
+    Called via receiver/signal on `post_save` and `post_delete` resp. `pre_delete` of Item and the models in
+    CATALOG_ITEM_LOOKUPS
+    """
+    if sender is Item:
+        change_catalog()
+    else:
+        change_catalog(Q(**{CATALOG_ITEM_LOOKUPS[sender]: instance.pk}))
+
+
+@receiver(m2m_changed, sender=Item.categories.through)
+@receiver(m2m_changed, sender=Item.images.through)
+@receiver(m2m_changed, sender=Item.occupancies.through)
+def catalog_relation_changed(sender, instance, action, reverse, pk_set, *args, **kwargs):
+    """
+    Bumps the catalog version and touches the affected items when categories, images or occupancies
+    are added to or removed from items.
+    Called via receiver/signal on Item.categories, Item.images and Item.occupancies `m2m_changed`
+    """
+    if action in ('post_add', 'post_remove'):
+        item_filter = Q(id__in=pk_set) if reverse else Q(id=instance.pk)
+    elif action == 'pre_clear':
+        # the cleared items are only known before the relation is cleared
+        item_filter = Q(**{CATALOG_ITEM_LOOKUPS[type(instance)]: instance.pk}) if reverse else Q(id=instance.pk)
+    else:
+        return
+    change_catalog(item_filter)
+
+
+# sent after items were written in bulk, which skips the per row signals of Item and its relations
+items_bulk_saved = Signal(providing_args=['item_ids', 'location_ids'])
+
+
+@receiver(items_bulk_saved)
+def bulk_items_changed(sender, item_ids, location_ids, *args, **kwargs):
+    """
+    Bumps the catalog version, updates the search index and invalidates the map tiles for items written in bulk.
+    Called via receiver/signal on `items_bulk_saved`
+
+    :param item_ids: ids of the created or updated items
+    :param location_ids: ids of all current and previous locations of these items
+    """
+    change_catalog()
+    search.get_backend().index_many(Item.objects.filter(id__in=item_ids).values_list('id', 'title', 'description'))
+    tiles.invalidate(Location.objects.filter(id__in=location_ids).values_list('latitude', 'longitude'))
@@ -1,3 +1,761 @@
-from django.test import TestCase
+import base64
+import gzip
+import hashlib
+import os
+import shutil
+import tempfile
+from io import BytesIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from PIL import Image as pil_image
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.models import Count
+from django.test import TestCase, modify_settings, override_settings
+from django.urls import resolve
+from rest_framework.test import APIClient
+
+from accounts.models import Lender
+from respool.api.v1 import facets, fastpath
+from respool.models import Item, Image, ImageVariant, Location, Category, CatalogVersion, Loan, LoanAgreement, \
+    RentalFee, Upload, items_bulk_saved
+from respool.utils import geocoding, query_profile, response_cache, search, uploads
+
+'''Authors: Michael Götz, Marius Hofmann'''
+
+MEDIA_ROOT = tempfile.mkdtemp()
+UPLOAD_DIR = tempfile.mkdtemp()
+QUERY_PROFILE_CACHE_DIR = tempfile.mkdtemp()
+
+
+def create_image_file(name='image.png'):
+    """
+    Returns a small in-memory png file which can be assigned to an Image instance.
+    """
+    temp_handle = BytesIO()
+    pil_image.new('RGB', (8, 8)).save(temp_handle, 'png')
+    return SimpleUploadedFile(name, temp_handle.getvalue(), content_type='image/png')
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class ApiItemsQueryCountTest(TestCase):
+    """
+    Ensures that the item list endpoints run a constant number of queries, independent of the result size.
+    """
+    # catalog version, items, default images, image variants, facets
+    QUERY_COUNT = 5
+
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user(username='lender', password='1234567890abc')
+        cls.lender = Lender.objects.create(user=user, type=Lender.PRIVATE)
+        cls.location = Location.objects.create(house_number=1, street='Lange Straße', city='Bamberg',
+                                               latitude=49.8917, longitude=10.8875)
+        cls.category = Category.objects.create(title='Möbel')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def create_items(self, count):
+        for index in range(count):
+            item = Item.objects.create(title='Stuhl {}'.format(index), description='Ein Stuhl', type=Item.SERVICE,
+                                       lender=self.lender, location=self.location)
+            item.categories.add(self.category)
+            for order_id in (2, 1):
+                item.images.add(Image.objects.create(file=create_image_file(), order_id=order_id))
+
+    def assert_constant_query_count(self, url):
+        client = APIClient()
+        for count in (1, 5):
+            self.create_items(count)
+            with self.assertNumQueries(self.QUERY_COUNT):
+                response = client.get(url)
+            self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_minimal_item_list(self):
+        data = self.assert_constant_query_count('/api/v1/respool/items/').json()
+        for item in data['items']:
+            self.assertTrue(item['default_image']['file'])
+        images = Item.objects.get(id=data['items'][0]['id']).images.all()
+        self.assertEqual(data['items'][0]['default_image']['file'], images[0].file.url)
+
+    def test_map_item_list(self):
+        data = self.assert_constant_query_count('/api/v1/respool/items/?data-type=map').json()
+        for item in data['items']:
+            self.assertEqual(item['location']['street'], 'Lange Straße')
+
+
+class ApiItemsRadiusSearchTest(TestCase):
+    """
+    Ensures that the radius search filters and orders by the distance and rejects invalid positions.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user(username='lender', password='1234567890abc')
+        lender = Lender.objects.create(user=user, type=Lender.PRIVATE)
+        cls.items = []
+        for city, latitude, longitude in (('Bamberg', 49.8917, 10.8875), ('München', 48.1372, 11.5755)):
+            location = Location.objects.create(house_number=1, street='Hauptstraße', city=city, latitude=latitude,
+                                               longitude=longitude)
+            cls.items.append(Item.objects.create(title='Stuhl', description='Ein Stuhl', type=Item.SERVICE,
+                                                 lender=lender, location=location))
+        Location.objects.update(geocode_status=Location.GEOCODE_DONE)
+
+    def get_item_ids(self, query):
+        response = APIClient().get('/api/v1/respool/items/?' + query)
+        self.assertEqual(response.status_code, 200)
+        return [item['id'] for item in response.json()['items']]
+
+    def test_filter_and_order_by_distance(self):
+        bamberg, munich = [item.id for item in self.items]
+        self.assertEqual(self.get_item_ids('distance=10&lat=49.9&lon=10.9'), [bamberg])
+        self.assertEqual(self.get_item_ids('distance=300&lat=48.2&lon=11.6&order=distance'), [munich, bamberg])
+        self.assertEqual(self.get_item_ids('distance=10&lat=0&lon=0'), [])
+
+    def test_invalid_position(self):
+        for query in ('distance=ten&lat=49.9&lon=10.9', 'distance=-1&lat=49.9&lon=10.9',
+                      'distance=10&lat=91&lon=10.9', 'distance=10&lat=49.9&lon=nan'):
+            response = APIClient().get('/api/v1/respool/items/?' + query)
+            self.assertEqual(response.status_code, 400, query)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class ApiItemBatchTest(TestCase):
+    """
+    Ensures that the batch endpoint returns the requested items in order with the missing ids, validates the ids
+    and runs a constant number of queries.
+    """
+    # catalog version, items with their relations, images, image variants, occupancies
+    QUERY_COUNT = 5
+
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user(username='lender', password='1234567890abc')
+        lender = Lender.objects.create(user=user, type=Lender.PRIVATE)
+        location = Location.objects.create(house_number=1, street='Lange Straße', city='Bamberg')
+        cls.item_ids = []
+        for index in range(5):
+            item = Item.objects.create(title='Stuhl {}'.format(index), description='Ein Stuhl', type=Item.SERVICE,
+                                       lender=lender, location=location)
+            item.images.add(Image.objects.create(file=create_image_file(), order_id=1))
+            cls.item_ids.append(item.id)
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def get(self, ids, status_code=200):
+        response = APIClient().get('/api/v1/respool/items/batch', {'ids': ids})
+        self.assertEqual(response.status_code, status_code, ids)
+        return response
+
+    def test_order_and_missing(self):
+        first, second, third = self.item_ids[:3]
+        missing = max(self.item_ids) + 1
+        data = self.get('{},{},{},{}'.format(third, missing, first, second)).json()
+        self.assertEqual([item['id'] for item in data['items']], [third, first, second])
+        self.assertEqual(data['items'][0]['title'], 'Stuhl 2')
+        self.assertEqual(data['missing'], [missing])
+
+    def test_duplicate_ids(self):
+        first, second = self.item_ids[:2]
+        data = self.get('{0},{1},{0}, {1}'.format(first, second)).json()
+        self.assertEqual([item['id'] for item in data['items']], [first, second])
+        self.assertEqual(data['missing'], [])
+
+    def test_invalid_ids(self):
+        for ids in ('', ',', '1,zwei', '1.5', '1;2'):
+            self.get(ids, 400)
+
+    def test_batch_size(self):
+        ids = ','.join(str(item_id) for item_id in self.item_ids)
+        with override_settings(RESPOOL_ITEM_BATCH_SIZE=4):
+            self.get(ids, 400)
+        with override_settings(RESPOOL_ITEM_BATCH_SIZE=5):
+            self.get(ids)
+
+    def test_constant_query_count(self):
+        for count in (1, 5):
+            with self.assertNumQueries(self.QUERY_COUNT):
+                data = self.get(','.join(str(item_id) for item_id in self.item_ids[:count])).json()
+            self.assertEqual(len(data['items']), count)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class LoanAgreementTest(TestCase):
+    """
+    Ensures that loan agreements are stored once per content and deleted with their last reference only.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user(username='lender', password='1234567890abc')
+        cls.lender = Lender.objects.create(user=user, type=Lender.PRIVATE)
+        cls.location = Location.objects.create(house_number=1, street='Lange Straße', city='Bamberg')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    @staticmethod
+    def create_agreement(content=b'Vertrag'):
+        return LoanAgreement.get_or_create_for_file(SimpleUploadedFile('vertrag.pdf', content))
+
+    def create_item(self, agreement):
+        return Item.objects.create(title='Stuhl', description='Ein Stuhl', type=Item.SERVICE, lender=self.lender,
+                                   location=self.location, loan_agreement=agreement)
+
+    def test_deduplication(self):
+        agreement = self.create_agreement()
+        self.assertEqual(self.create_agreement().pk, agreement.pk)
+        self.assertNotEqual(self.create_agreement(b'Anderer Vertrag').pk, agreement.pk)
+        self.assertEqual(LoanAgreement.objects.count(), 2)
+        self.assertTrue(os.path.exists(agreement.file.path))
+
+    def test_delete_shared_agreement(self):
+        agreement = self.create_agreement()
+        first, second = self.create_item(agreement), self.create_item(agreement)
+        first.delete()
+        self.assertEqual(Item.objects.get(pk=second.pk).loan_agreement_id, agreement.pk)
+        self.assertTrue(os.path.exists(agreement.file.path))
+        second.delete()
+        self.assertFalse(LoanAgreement.objects.filter(pk=agreement.pk).exists())
+        self.assertFalse(os.path.exists(agreement.file.path))
+
+    def test_release_replaced_agreement(self):
+        agreement, shared = self.create_agreement(), self.create_agreement(b'Geteilter Vertrag')
+        item, other_item = self.create_item(agreement), self.create_item(shared)
+        item = Item.objects.get(pk=item.pk)
+        item.loan_agreement = shared
+        item.save()
+        self.assertFalse(LoanAgreement.objects.filter(pk=agreement.pk).exists())
+        self.assertFalse(os.path.exists(agreement.file.path))
+
+        item.loan_agreement = self.create_agreement(b'Neuer Vertrag')
+        item.save()
+        self.assertEqual(Item.objects.get(pk=other_item.pk).loan_agreement_id, shared.pk)
+        self.assertTrue(os.path.exists(shared.file.path))
+
+
+class ApiItemsBulkTest(TestCase):
+    """
+    Ensures that the bulk endpoint writes all rows of a lender in one transaction or none of them, and updates the
+    catalog and the search index once per request.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='lender', password='1234567890abc')
+        cls.lender = Lender.objects.create(user=cls.user, type=Lender.PRIVATE)
+        other_user = User.objects.create_user(username='other', password='1234567890abc')
+        other_lender = Lender.objects.create(user=other_user, type=Lender.PRIVATE)
+        location = Location.objects.create(house_number=1, street='Lange Straße', city='Bamberg')
+        cls.item = Item.objects.create(title='Stuhl', description='Ein Stuhl', type=Item.SERVICE, lender=cls.lender,
+                                       location=location)
+        cls.other_item = Item.objects.create(title='Tisch', description='Ein Tisch', type=Item.SERVICE,
+                                             lender=other_lender, location=location)
+        cls.category = Category.objects.create(title='Möbel')
+
+    @staticmethod
+    def row(title, **fields):
+        row = {'title': title, 'description': 'Ein {}'.format(title), 'type': Item.SERVICE,
+               'location': {'house_number': 2, 'street': 'Hauptstraße', 'city': 'Bamberg'}}
+        row.update(fields)
+        return row
+
+    def post(self, rows, status_code=200):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.post('/api/v1/respool/items/bulk', {'items': rows}, format='json')
+        self.assertEqual(response.status_code, status_code, response.content)
+        return response.json()
+
+    def test_created_ids(self):
+        rows = [self.row('Hocker {}'.format(index), categories=[self.category.pk]) for index in range(3)]
+        rows.insert(1, self.row('Sessel', id=self.item.pk))
+        results = self.post(rows)['items']
+        self.assertEqual([result['index'] for result in results], [0, 1, 2, 3])
+        self.assertEqual([result['created'] for result in results], [True, False, True, True])
+        self.assertEqual(results[1]['id'], self.item.pk)
+        for row, result in zip(rows, results):
+            item = Item.objects.get(pk=result['id'])
+            self.assertEqual((item.title, item.lender_id), (row['title'], self.lender.pk))
+        self.assertEqual(Item.objects.filter(categories=self.category).count(), 3)
+
+    def test_invalid_row_writes_nothing(self):
+        item_count, location_count = Item.objects.count(), Location.objects.count()
+        rows = [self.row('Hocker'), self.row('Sessel', id=self.item.pk),
+                self.row('Bank', weight=2), self.row('Regal', categories=[self.category.pk + 1])]
+        errors = self.post(rows, 400)['errors']
+        self.assertEqual([error['index'] for error in errors], [2, 3])
+        self.assertEqual((Item.objects.count(), Location.objects.count()), (item_count, location_count))
+        self.assertEqual(Item.objects.get(pk=self.item.pk).title, 'Stuhl')
+
+    def test_items_of_other_lenders(self):
+        errors = self.post([self.row('Sessel', id=self.item.pk), self.row('Sofa', id=self.other_item.pk)],
+                           400)['errors']
+        self.assertEqual([(error['index'], list(error['errors'])) for error in errors], [(1, ['id'])])
+        self.assertEqual(Item.objects.get(pk=self.other_item.pk).title, 'Tisch')
+        self.assertEqual(Item.objects.get(pk=self.item.pk).title, 'Stuhl')
+
+    def test_max_items(self):
+        rows = [self.row('Hocker {}'.format(index)) for index in range(3)]
+        with override_settings(RESPOOL_BULK_MAX_ITEMS=2):
+            self.post(rows, 400)
+        self.assertFalse(Item.objects.filter(title__startswith='Hocker').exists())
+        with override_settings(RESPOOL_BULK_MAX_ITEMS=3):
+            self.post(rows)
+        self.assertEqual(Item.objects.filter(title__startswith='Hocker').count(), 3)
+
+    def test_catalog_and_search_index_updated_once(self):
+        sent = []
+
+        def receiver(sender, item_ids, location_ids, **kwargs):
+            sent.append(sorted(item_ids))
+
+        items_bulk_saved.connect(receiver)
+        self.addCleanup(items_bulk_saved.disconnect, receiver)
+        version = CatalogVersion.get().version
+        backend = search.get_backend()
+        with mock.patch.object(backend, 'index_many', wraps=backend.index_many) as index_many:
+            results = self.post([self.row('Hocker'), self.row('Sessel', id=self.item.pk)])['items']
+        self.assertEqual(sent, [sorted(result['id'] for result in results)])
+        index_many.assert_called_once()
+        self.assertEqual(CatalogVersion.get().version, version + 1)
+        self.assertEqual(list(backend.search(Item.objects.all(), 'Sessel').values_list('id', flat=True)),
+                         [self.item.pk])
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class FastPathTest(TestCase):
+    """
+    Ensures that the fast path renders the item list byte for byte like the serializers and DRF's JSONRenderer.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user(username='lender', password='1234567890abc')
+        lender = Lender.objects.create(user=user, type=Lender.PRIVATE)
+        location = Location.objects.create(house_number=1, street='Lange Straße', city='Bamberg',
+                                           latitude=49.8917, longitude=10.8875)
+        Item.objects.create(title='Tisch', description='Ohne Bilder', type=Item.SERVICE, lender=lender,
+                            location=location)
+        item = Item.objects.create(title='Stühle\u2028und Bänke', description='Größe \u2029 "Eiche" \\ ✓',
+                                   type=Item.SERVICE, lender=lender, location=location)
+        first, second = Image.objects.create(file=create_image_file(), order_id=1), \
+            Image.objects.create(file=create_image_file('other.png'), order_id=2)
+        item.images.add(second, first)
+        Image.objects.filter(pk=first.pk).update(thumb='thumbs/stuhl.jpg')
+        for width, format in ((640, ImageVariant.WEBP), (320, ImageVariant.JPEG), (640, ImageVariant.JPEG)):
+            ImageVariant.objects.create(image=first, width=width, format=format,
+                                        file='variants/stuhl-{}.{}'.format(width, format))
+        item = Item.objects.create(title='Bank', description='', type=Item.SERVICE, lender=lender,
+                                   location=Location.objects.create(house_number=2, street='Hauptstraße'))
+        item.images.add(Image.objects.create(file=create_image_file('bank.png'), order_id=1))
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        response_cache.cache.clear()
+
+    def assert_fast_path_equal(self, url):
+        client = APIClient()
+        with mock.patch.object(fastpath, 'serialize_items', wraps=fastpath.serialize_items) as serialize_items:
+            fast = client.get(url)
+        serialize_items.assert_called_once()
+        response_cache.cache.clear()
+        with mock.patch.object(fastpath, 'is_supported', return_value=False):
+            serialized = client.get(url)
+        self.assertEqual(fast.status_code, 200)
+        self.assertEqual(fast['Content-Type'], serialized['Content-Type'])
+        self.assertEqual(fast.content, serialized.content)
+        return fast.content
+
+    def test_item_list(self):
+        content = self.assert_fast_path_equal('/api/v1/respool/items/')
+        self.assertIn('Stühle\\u2028und Bänke'.encode('utf-8'), content)
+        self.assertIn(b'"srcset":"', content)
+
+    def test_map_item_list(self):
+        content = self.assert_fast_path_equal('/api/v1/respool/items/?data-type=map')
+        self.assertIn(b'"latitude":null', content)
+
+    def test_item_page(self):
+        self.assert_fast_path_equal('/api/v1/respool/items/?page-size=2')
+
+
+class ResponseCacheTest(TestCase):
+    """
+    Ensures that the item list is served from the response cache per catalog version, query and media type,
+    in the best accepted content coding, and that the cache evicts the least recently used responses by size.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user(username='lender', password='1234567890abc')
+        cls.lender = Lender.objects.create(user=user, type=Lender.PRIVATE)
+        location = Location.objects.create(house_number=1, street='Lange Straße', city='Bamberg')
+        for index in range(3):
+            Item.objects.create(title='Stuhl {}'.format(index), description='Ein bequemer Stuhl', type=Item.SERVICE,
+                                lender=cls.lender, location=location)
+
+    def setUp(self):
+        response_cache.cache.clear()
+
+    def get(self, url='/api/v1/respool/items/', **extra):
+        response = APIClient().get(url, **extra)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_hit_and_catalog_version(self):
+        first = self.get()
+        self.assertEqual(first['X-Cache'], 'MISS')
+        second = self.get()
+        self.assertEqual(second['X-Cache'], 'HIT')
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(self.get('/api/v1/respool/items/?type={}'.format(Item.SERVICE))['X-Cache'], 'MISS')
+
+        item = Item.objects.first()
+        item.title = 'Tisch'
+        item.save()
+        response = self.get()
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertIn('Tisch', [item['title'] for item in response.json()['items']])
+
+    def test_media_type_parameters(self):
+        compact = self.get()
+        indented = self.get(HTTP_ACCEPT='application/json; indent=4')
+        self.assertEqual(indented['X-Cache'], 'MISS')
+        self.assertNotEqual(indented.content, compact.content)
+        self.assertEqual(self.get()['X-Cache'], 'HIT')
+        self.assertEqual(self.get(HTTP_ACCEPT='application/json; indent=4').content, indented.content)
+
+    def test_content_coding(self):
+        identity = self.get()
+        self.assertNotIn('Content-Encoding', identity)
+        self.assertIn('Accept-Encoding', identity['Vary'])
+        compressed = self.get(HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(compressed['X-Cache'], 'HIT')
+        self.assertEqual(compressed['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', compressed['Vary'])
+        self.assertEqual(gzip.decompress(compressed.content), identity.content)
+        self.assertNotIn('Content-Encoding', self.get(HTTP_ACCEPT_ENCODING='gzip;q=0'))
+
+    def test_eviction_by_size(self):
+        first_url = '/api/v1/respool/items/?lender={}'.format(self.lender.pk)
+        second_url = '/api/v1/respool/items/?type={}'.format(Item.SERVICE)
+        self.get(first_url)
+        stats = response_cache.cache.get_stats()
+        with override_settings(RESPOOL_RESPONSE_CACHE_BYTES=stats['bytes'] * 3 // 2):
+            self.assertEqual(self.get(second_url)['X-Cache'], 'MISS')
+            self.assertEqual(response_cache.cache.get_stats()['entries'], 1)
+            self.assertEqual(response_cache.cache.get_stats()['evictions'], stats['evictions'] + 1)
+            self.assertEqual(self.get(second_url)['X-Cache'], 'HIT')
+            self.assertEqual(self.get(first_url)['X-Cache'], 'MISS')
+
+
+class CatalogVersionTest(TestCase):
+    """
+    Ensures that items are revalidated by weak ETags which change with the name of their lender, but not with its
+    last login.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='lender', password='1234567890abc')
+        lender = Lender.objects.create(user=cls.user, type=Lender.PRIVATE)
+        location = Location.objects.create(house_number=1, street='Lange Straße', city='Bamberg')
+        cls.item = Item.objects.create(title='Stuhl', description='Ein Stuhl', type=Item.SERVICE, lender=lender,
+                                       location=location)
+
+    def test_lender_name_changes_etag(self):
+        client = APIClient()
+        urls = ('/api/v1/respool/items/', '/api/v1/respool/items/{}/'.format(self.item.pk))
+        etags = {url: client.get(url)['ETag'] for url in urls}
+        for url, etag in etags.items():
+            self.assertTrue(etag.startswith('W/"'), url)
+            self.assertEqual(client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304, url)
+
+        user = User.objects.get(pk=self.user.pk)
+        user.save(update_fields=['last_login'])
+        for url, etag in etags.items():
+            self.assertEqual(client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304, url)
+
+        user.first_name = 'Erika'
+        user.save()
+        for url, etag in etags.items():
+            self.assertEqual(client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200, url)
+        self.assertEqual(client.get(urls[1]).json()['lender']['user']['first_name'], 'Erika')
+
+
+class GeocodeTest(TestCase):
+    """
+    Ensures that failed locations are geocoded again after their address changed and that requests do not wait for
+    the throttled geocode api.
+    """
+
+    def test_failed_location_pending_after_address_change(self):
+        location = Location.objects.create(house_number=1, street='Gibtsnichtweg', city='Bamberg')
+        Location.objects.filter(pk=location.pk).update(geocode_status=Location.GEOCODE_FAILED)
+        location = Location.objects.get(pk=location.pk)
+        location.title = 'Lager'
+        location.save()
+        self.assertEqual(Location.objects.get(pk=location.pk).geocode_status, Location.GEOCODE_FAILED)
+        location.street = 'Lange Straße'
+        location.save()
+        self.assertEqual(Location.objects.get(pk=location.pk).geocode_status, Location.GEOCODE_PENDING)
+
+    @override_settings(RESPOOL_GEOCODE_MIN_INTERVAL=60)
+    @mock.patch('respool.utils.geocoding.requests.get')
+    def test_request_path_does_not_wait(self, get):
+        with mock.patch.object(geocoding, '_last_request', geocoding.time.monotonic()), \
+                mock.patch.object(geocoding.time, 'sleep') as sleep:
+            with self.assertRaises(geocoding.GeoCodingThrottled):
+                geocoding.lookupGeoCode(1, 'Unbekannte Straße', 'Bamberg', wait=False)
+            with self.assertLogs(geocoding.logger, 'WARNING'):
+                self.assertEqual(geocoding.getGeoCode(1, 'Unbekannte Straße', 'Bamberg', wait=False), (None, None))
+        sleep.assert_not_called()
+        get.assert_not_called()
+
+
+class FacetsTest(TestCase):
+    """
+    Ensures that the single facet query counts like the ORM, also for filters which can never match.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        location = Location.objects.create(house_number=1, street='Lange Straße', city='Bamberg')
+        lenders = [Lender.objects.create(user=User.objects.create_user(username=name, password='1234567890abc'),
+                                         type=Lender.PRIVATE) for name in ('anna', 'bernd')]
+        categories = [Category.objects.create(title=title) for title in ('Möbel', 'Technik', 'Garten')]
+        loans = [None, Loan.objects.create(rental_fee=RentalFee.objects.create(interval_unit=RentalFee.DAILY, costs=3)),
+                 Loan.objects.create(rental_fee=RentalFee.objects.create(interval_unit=RentalFee.WEEKLY, costs=9)),
+                 Loan.objects.create(caution=10)]
+        for index in range(12):
+            item = Item.objects.create(title='Stuhl {}'.format(index) if index % 3 else 'Tisch {}'.format(index),
+                                       description='', type=index % 3, lender=lenders[index % 2], location=location,
+                                       loan=loans[index % 4])
+            item.categories.set(categories[:index % 4])
+
+    def assert_facets_match(self, queryset):
+        def counts(rows):
+            return sorted((value, count) for value, count in rows if value is not None)
+
+        result = facets.compute_facets(queryset)
+        ids = queryset.values('id')
+        self.assertEqual(counts((value['id'], value['count']) for value in result[facets.TYPE_FACET]),
+                         counts(Item.objects.filter(id__in=ids).values_list('type').annotate(Count('id'))))
+        self.assertEqual(counts((value['id'], value['count']) for value in result[facets.LENDER_FACET]),
+                         counts(Item.objects.filter(id__in=ids).values_list('lender').annotate(Count('id'))))
+        self.assertEqual(counts((value['id'], value['count']) for value in result[facets.RENTAL_FEE_INTERVAL_FACET]),
+                         counts(Item.objects.filter(id__in=ids).values_list('loan__rental_fee__interval_unit')
+                                .annotate(Count('id'))))
+        self.assertEqual(counts((value['id'], value['count']) for value in result[facets.CATEGORY_FACET]),
+                         counts(Category.objects.filter(item__in=ids).values_list('id').annotate(Count('item'))))
+        return result
+
+    def test_filtered_counts(self):
+        result = self.assert_facets_match(Item.objects.filter(title__startswith='Stuhl', categories__isnull=False)
+                                          .distinct())
+        self.assertEqual({value['title'] for value in result[facets.LENDER_FACET]}, {'anna', 'bernd'})
+        self.assertEqual(dict((value['id'], value['title']) for value in result[facets.TYPE_FACET]),
+                         {Item.SERVICE: 'Dienstleistung', Item.OBJECT: 'Objekt'})
+        self.assert_facets_match(Item.objects.all())
+
+    def test_empty_filter(self):
+        result = self.assert_facets_match(Item.objects.filter(id__in=[]))
+        self.assertEqual(result, {facets.CATEGORY_FACET: [], facets.TYPE_FACET: [], facets.LENDER_FACET: [],
+                                  facets.RENTAL_FEE_INTERVAL_FACET: []})
+
+
+@skipUnless(connection.vendor == 'sqlite', 'tests the SQLite FTS5 search backend')
+class SqliteSearchTest(TestCase):
+    """
+    Ensures that the full text search matches stemmed words, ranks title matches first and follows item changes.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user(username='lender', password='1234567890abc')
+        lender = Lender.objects.create(user=user, type=Lender.PRIVATE)
+        location = Location.objects.create(house_number=1, street='Lange Straße', city='Bamberg')
+        cls.description_match, cls.title_match, cls.other = [
+            Item.objects.create(title=title, description=description, type=Item.SERVICE, lender=lender,
+                                location=location)
+            for title, description in (('Sessel', 'Passt zu jedem Stuhl'), ('Gepolsterter Stuhl', 'Bequem'),
+                                       ('Tisch', 'Aus Eiche'))]
+
+    def get_item_ids(self, search_token):
+        response = APIClient().get('/api/v1/respool/items/', {'search-token': search_token})
+        self.assertEqual(response.status_code, 200)
+        return [item['id'] for item in response.json()['items']]
+
+    def test_stemmed_match_ranked_by_title(self):
+        self.assertIsInstance(search.get_backend(), search.SqliteSearchBackend)
+        # 'Stühle' and 'Stuhl' share the stem, the title is weighted higher than the description
+        self.assertEqual(self.get_item_ids('Stühle'), [self.title_match.id, self.description_match.id])
+        # the last word may be incomplete, all words have to match
+        self.assertEqual(self.get_item_ids('gepolst Stuhl'), [self.title_match.id])
+        self.assertEqual(self.get_item_ids('Schrank'), [])
+
+    def test_index_follows_changes(self):
+        # instances of setUpTestData are shared by the tests
+        other = Item.objects.get(pk=self.other.pk)
+        other.title = 'Klappstuhl'
+        other.description = 'Für Stühle gedacht'
+        other.save()
+        self.assertIn(other.id, self.get_item_ids('Stuhl'))
+        self.assertEqual(self.get_item_ids('Eiche'), [])
+        Item.objects.get(pk=self.title_match.pk).delete()
+        self.assertNotIn(self.title_match.id, self.get_item_ids('Stuhl'))
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT COUNT(*) FROM {} WHERE rowid = %s'.format(search.SqliteSearchBackend.table),
+                           [self.title_match.id])
+            self.assertEqual(cursor.fetchone()[0], 0)
+
+
+@override_settings(RESPOOL_UPLOAD_DIR=UPLOAD_DIR, RESPOOL_UPLOAD_MAX_PENDING=2)
+class ApiUploadTest(TestCase):
+    """
+    Ensures that chunked uploads only keep verified chunks at the expected offset and can be resumed.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='lender', password='1234567890abc')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(UPLOAD_DIR, ignore_errors=True)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create_upload(self, content, purpose=Upload.LOAN_AGREEMENT, client=None):
+        response = (client or self.client).post('/api/v1/respool/uploads/', {
+            'purpose': purpose, 'filename': 'vertrag.pdf', 'size': len(content)})
+        self.assertEqual(response.status_code, 201, response.content)
+        return '/api/v1/respool/uploads/{}'.format(response.json()['id'])
+
+    def send_chunk(self, url, offset, chunk, checksum=None):
+        checksum = checksum or 'sha256 ' + base64.b64encode(hashlib.sha256(chunk).digest()).decode()
+        return self.client.patch(url, chunk, content_type='application/offset+octet-stream',
+                                 HTTP_UPLOAD_OFFSET=str(offset), HTTP_UPLOAD_CHECKSUM=checksum)
+
+    def test_resume_after_rejected_chunk(self):
+        content = b'0123456789'
+        url = self.create_upload(content)
+        self.assertEqual(self.send_chunk(url, 0, content[:4]).json()['offset'], 4)
+        # a corrupted chunk is not kept
+        response = self.send_chunk(url, 4, content[4:8], checksum='sha256 ' + base64.b64encode(b'x' * 32).decode())
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(os.path.getsize(Upload.objects.get().path), 4)
+        # the upload is resumed at the offset returned by GET
+        offset = self.client.get(url).json()['offset']
+        self.assertEqual(offset, 4)
+        response = self.send_chunk(url, offset, content[offset:])
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['completed'])
+        with Upload.objects.get().open() as file:
+            self.assertEqual(file.read(), content)
+
+    def test_offset_mismatch(self):
+        url = self.create_upload(b'0123456789')
+        response = self.send_chunk(url, 4, b'4567')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['offset'], 0)
+
+    def test_short_chunk(self):
+        path = os.path.join(UPLOAD_DIR, 'short')
+        uploads.create_partial_file(path)
+        checksum = 'sha256 ' + base64.b64encode(hashlib.sha256(b'0123').digest()).decode()
+        with self.assertRaises(uploads.ChunkError):
+            uploads.write_chunk(path, 0, BytesIO(b'01'), 4, checksum)
+        self.assertEqual(os.path.getsize(path), 0)
+
+    def test_non_image_rejected(self):
+        content = b'no image'
+        url = self.create_upload(content, purpose=Upload.IMAGE)
+        self.assertEqual(self.send_chunk(url, 0, content).status_code, 400)
+        self.assertFalse(Upload.objects.exists())
+
+    def test_deleted_while_uploading(self):
+        url = self.create_upload(b'0123456789')
+        os.remove(Upload.objects.get().path)
+        self.assertEqual(self.send_chunk(url, 0, b'0123').status_code, 404)
+
+    def test_pending_uploads_limited(self):
+        self.create_upload(b'1')
+        self.create_upload(b'2')
+        response = self.client.post('/api/v1/respool/uploads/', {
+            'purpose': Upload.LOAN_AGREEMENT, 'filename': 'vertrag.pdf', 'size': 1})
+        self.assertEqual(response.status_code, 429)
+
+    def test_anonymous_uploads(self):
+        client = APIClient()
+        response = client.post('/api/v1/respool/uploads/', {'purpose': Upload.IMAGE, 'filename': 'bild.png',
+                                                           'size': 1})
+        self.assertEqual(response.status_code, 403)
+        self.create_upload(b'1', client=client)
+        self.create_upload(b'2', client=client)
+        response = client.post('/api/v1/respool/uploads/', {
+            'purpose': Upload.LOAN_AGREEMENT, 'filename': 'vertrag.pdf', 'size': 1})
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(Upload.objects.filter(session_key=client.session.session_key).count(), 2)
+
+
+@modify_settings(MIDDLEWARE={'prepend': 'respool.middleware.QueryProfileMiddleware'})
+@override_settings(RESPOOL_QUERY_PROFILE_FLUSH_SECONDS=0, RESPOOL_QUERY_PROFILE_CACHE='query-profile', CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'query-profile': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                      'LOCATION': QUERY_PROFILE_CACHE_DIR},
+})
+class QueryProfileMiddlewareTest(TestCase):
+    """
+    Ensures that the query profile reports the queries of a request and finds repeated queries.
+    """
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(QUERY_PROFILE_CACHE_DIR, ignore_errors=True)
+
+    def setUp(self):
+        query_profile.clear()
+
+    def test_server_timing_and_summary(self):
+        url = '/api/v1/respool/items/'
+        response = self.client.get(url)
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="\d+ queries", db-repeated;desc="0 '
+                                                    r'repeated queries", total;dur=[\d.]+$')
+        summary = query_profile.summarize(query_profile.load_samples())
+        self.assertEqual([view['view'] for view in summary], ['GET ' + resolve(url).view_name])
+        self.assertEqual(summary[0]['requests'], 1)
+
+    def test_repeated_queries(self):
+        recorder = query_profile.QueryRecorder()
+        for item_id in (1, 2, 3):
+            recorder.fingerprints[query_profile.fingerprint(
+                'SELECT "title" FROM "respool_item" WHERE "id" = {}'.format(item_id))] += 1
+        recorder.fingerprints[query_profile.fingerprint('SELECT "id" FROM "respool_item" WHERE "id" IN (%s, %s)')] += 1
+        self.assertEqual(recorder.repeated_count, 2)
+        self.assertEqual(recorder.get_repeated(), [('SELECT "title" FROM "respool_item" WHERE "id" = ?', 3)])
+
+    def test_process_local_cache_rejected(self):
+        with self.settings(RESPOOL_QUERY_PROFILE_CACHE='default'):
+            with self.assertRaises(CommandError):
+                call_command('query_profile')
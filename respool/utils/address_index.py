@@ -0,0 +1,65 @@
+import os
+import sqlite3
+import threading
+
+'''
+Local address index for geocoding without network access.
+Author: Marius Hofmann
+'''
+
+TABLE = 'address'
+
+
+def build(rows, path):
+    """
+    Writes an address index to a SQLite file, replacing an existing one.
+    The file only holds a clustered primary key index on the normalized address, so a lookup is a single b-tree seek.
+
+    :param rows: iterable of (normalized address key, latitude, longitude)
+    :param path: path of the index file
+    :return: number of addresses in the index
+    """
+    temp_path = '{}.tmp'.format(path)
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+    connection = sqlite3.connect(temp_path)
+    try:
+        connection.execute('CREATE TABLE {} (key TEXT PRIMARY KEY, latitude REAL NOT NULL, longitude REAL NOT NULL) '
+                           'WITHOUT ROWID'.format(TABLE))
+        connection.executemany('INSERT OR REPLACE INTO {} (key, latitude, longitude) VALUES (?, ?, ?)'.format(TABLE),
+                               rows)
+        connection.commit()
+        count = connection.execute('SELECT COUNT(*) FROM {}'.format(TABLE)).fetchone()[0]
+        connection.execute('VACUUM')
+    finally:
+        connection.close()
+    os.replace(temp_path, path)
+    return count
+
+
+class AddressIndex:
+    """
+    Read only access to an address index file built by build().
+    Uses one SQLite connection per thread.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+
+    def _connection(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect('file:{}?mode=ro'.format(self.path), uri=True)
+            self.local.connection = connection
+        return connection
+
+    def lookup(self, key):
+        """
+        Returns the coordinates of a normalized address.
+
+        :param key: normalized address key
+        :return: tuple (latitude, longitude) or None if the address is not in the index
+        """
+        return self._connection().execute('SELECT latitude, longitude FROM {} WHERE key = ?'.format(TABLE),
+                                          (key,)).fetchone()
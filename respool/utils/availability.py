@@ -0,0 +1,51 @@
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+'''
+Availability search for items based on their occupancies.
+Author: Marius Hofmann
+'''
+
+DATE_FORMAT = '%Y-%m-%d'
+
+
+def get_day_range(start_date, end_date):
+    """
+    Returns the time range covering the given days completely.
+
+    :param start_date: first day as string, format = %Y-%m-%d
+    :param end_date: last day as string, format = %Y-%m-%d
+    :return: start (begin of the first day), end (begin of the day after the last day)
+    """
+    start = datetime.combine(datetime.strptime(start_date, DATE_FORMAT).date(), time.min)
+    end = datetime.combine(datetime.strptime(end_date, DATE_FORMAT).date(), time.min) + timedelta(days=1)
+    if settings.USE_TZ:
+        start, end = timezone.make_aware(start), timezone.make_aware(end)
+    return start, end
+
+
+def occupied_between(start, end):
+    """
+    Returns the occupancies overlapping the range from start to end.
+    Two intervals overlap if each one starts before the other one ends.
+
+    :return: ItemOccupancy queryset
+    """
+    from respool.models import ItemOccupancy
+    return ItemOccupancy.objects.filter(start_time__lt=end, end_time__gt=start)
+
+
+def free_between(queryset, start, end):
+    """
+    Filters an Item queryset to the items which are free for the whole range from start to end,
+    i.e. none of their occupancies overlaps the range. Items without occupancies are always free.
+    The overlap check per item is a lookup on the (item, start_time, end_time) index.
+
+    :param queryset: Item queryset
+    :return: filtered queryset
+    """
+    occupied = occupied_between(start, end).filter(item=OuterRef('pk'))
+    return queryset.annotate(is_occupied=Exists(occupied)).filter(is_occupied=False)
@@ -0,0 +1,128 @@
+from django.db import connection, transaction
+from django.db.models import Case, Q, Value, When
+
+'''
+Batched writes for many model instances, used where saving row by row would cost several queries per row.
+Like bulk_create, these functions do not send model signals. Receivers which have to run per instance, e.g. to set
+derived fields or to schedule background work, can be passed to the inserts, receivers which can run once for the
+whole batch afterwards, e.g. of the catalog or the search index, are left out this way.
+Author: Marius Hofmann
+'''
+
+# lowest limit of query parameters among the supported databases (SQLite before 3.32)
+MAX_QUERY_PARAMS = 999
+
+
+def call_receivers(receivers, model, objects, **kwargs):
+    """
+    Calls signal receivers for each instance like the signal would, for instances written without signals.
+
+    :param receivers: receiver functions of one signal of the model
+    :param model: model class, passed as sender
+    :param objects: list of instances
+    :param kwargs: further arguments of the signal, e.g. created=True for post_save
+    """
+    for instance in objects:
+        for receiver in receivers:
+            receiver(model, instance, raw=False, using=connection.alias, update_fields=None, **kwargs)
+
+
+def bulk_insert(model, objects, pre_save=(), post_save=()):
+    """
+    Inserts unsaved instances with bulk_create and sets their primary keys on every database,
+    even where bulk_create does not return them. Databases other than PostgreSQL and SQLite fall back to
+    inserting row by row, which sends the save signals.
+
+    :param model: model class
+    :param objects: list of unsaved instances
+    :param pre_save: receivers of the pre_save signal of the model called for each instance before the insert
+    :param post_save: receivers of the post_save signal of the model called for each instance after the insert
+    :return: the saved instances
+    """
+    if not objects:
+        return objects
+    if connection.features.can_return_ids_from_bulk_insert:
+        call_receivers(pre_save, model, objects)
+        model.objects.bulk_create(objects)
+        call_receivers(post_save, model, objects, created=True)
+        return objects
+    if connection.vendor == 'sqlite':
+        call_receivers(pre_save, model, objects)
+        with transaction.atomic():
+            model.objects.bulk_create(objects)
+            # sqlite locks the whole database for writing until the transaction ends and assigns
+            # autoincrement keys in insert order, so the highest keys are those just inserted
+            pks = list(model.objects.order_by('-pk').values_list('pk', flat=True)[:len(objects)])
+        for instance, pk in zip(objects, reversed(pks)):
+            instance.pk = pk
+            instance._state.adding = False
+        call_receivers(post_save, model, objects, created=True)
+        return objects
+    with transaction.atomic():
+        for instance in objects:
+            instance.save_base(force_insert=True)
+    return objects
+
+
+def bulk_update(model, objects, fields):
+    """
+    Writes the given fields of saved instances with one CASE update per batch.
+
+    :param model: model class
+    :param objects: list of saved instances
+    :param fields: names of the fields to write
+    """
+    fields = [model._meta.get_field(name) for name in fields]
+    batch_size = max(1, MAX_QUERY_PARAMS // (2 * len(fields) + 1))
+    for start in range(0, len(objects), batch_size):
+        batch = objects[start:start + batch_size]
+        model.objects.filter(pk__in=[instance.pk for instance in batch]).update(**{
+            field.attname: Case(*[When(pk=instance.pk, then=Value(getattr(instance, field.attname), output_field=field))
+                                  for instance in batch], output_field=field)
+            for field in fields})
+
+
+def get_or_create_many(model, objects, fields, pre_save=(), post_save=()):
+    """
+    Like get_or_create for each of the unsaved instances, matching existing rows by the given fields.
+    Instances with equal values share one row, the values of other fields are taken from the first of them.
+    Runs one lookup query per batch of rows, bounded by MAX_QUERY_PARAMS, and one insert of the missing rows.
+
+    :param model: model class
+    :param objects: list of unsaved instances
+    :param fields: names of the fields identifying a row
+    :param pre_save: receivers called for the created instances, see bulk_insert
+    :param post_save: receivers called for the created instances, see bulk_insert
+    :return: tuple (list of saved instances in the order of objects, list of the created instances)
+    """
+    attnames = [model._meta.get_field(name).attname for name in fields]
+
+    def key(instance):
+        return tuple(getattr(instance, attname) for attname in attnames)
+
+    unique = {}
+    for instance in objects:
+        unique.setdefault(key(instance), instance)
+    if not unique:
+        return [], []
+
+    existing = {}
+    keys = list(unique)
+    batch_size = max(1, MAX_QUERY_PARAMS // len(attnames))
+    for start in range(0, len(keys), batch_size):
+        # narrows the lookup to rows whose values all occur, the exact keys are matched below
+        batch = keys[start:start + batch_size]
+        condition = Q()
+        for index, attname in enumerate(attnames):
+            values = {values[index] for values in batch}
+            field_condition = Q(**{attname + '__in': [value for value in values if value is not None]})
+            if None in values:
+                field_condition |= Q(**{attname + '__isnull': True})
+            condition &= field_condition
+        for instance in model.objects.filter(condition).order_by('pk'):
+            existing.setdefault(key(instance), instance)
+
+    created = [instance for values, instance in unique.items() if values not in existing]
+    bulk_insert(model, created, pre_save, post_save)
+    existing.update((key(instance), instance) for instance in created)
+    return [existing[key(instance)] for instance in objects], created
@@ -0,0 +1,96 @@
+import math
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+
+'''
+Server side marker clustering for the map.
+Author: Marius Hofmann
+'''
+
+TILE_SIZE = 256
+# edge length of a cluster cell in screen pixels, close to the default radius of leaflet.markercluster
+CELL_SIZE = 64
+MAX_ZOOM = 18
+SAMPLE_SIZE = 5
+# latitude limit of the web mercator projection
+MAX_LATITUDE = 85.0511287798
+
+
+def get_item_zoom():
+    """
+    Returns the zoom level from which on single items instead of clusters are shown on the map.
+    Configured by the setting 'RESPOOL_CLUSTER_ITEM_ZOOM'.
+    """
+    return getattr(settings, 'RESPOOL_CLUSTER_ITEM_ZOOM', 15)
+
+
+def project(latitude, longitude, zoom):
+    """
+    Returns the web mercator pixel position of a coordinate at the given zoom level.
+
+    :return: x, y in pixels
+    """
+    scale = TILE_SIZE * 2 ** zoom
+    latitude = max(min(latitude, MAX_LATITUDE), -MAX_LATITUDE)
+    sin_latitude = math.sin(math.radians(latitude))
+    x = (longitude + 180.0) / 360.0 * scale
+    y = (0.5 - math.log((1 + sin_latitude) / (1 - sin_latitude)) / (4 * math.pi)) * scale
+    return x, y
+
+
+def compute_clusters(zoom):
+    """
+    Aggregates all geocoded items into a grid of CELL_SIZE pixels at the given zoom level.
+
+    :param zoom: zoom level
+    :return: list of clusters {'latitude', 'longitude', 'count', 'items'}, where latitude and longitude are the
+             centroid of the clustered items and items holds up to SAMPLE_SIZE item ids
+    """
+    Item = apps.get_model('respool', 'Item')
+    Location = apps.get_model('respool', 'Location')
+    cells = {}
+    rows = Item.objects.filter(location__geocode_status=Location.GEOCODE_DONE).order_by('id') \
+        .values_list('id', 'location__latitude', 'location__longitude')
+    for item_id, latitude, longitude in rows:
+        x, y = project(latitude, longitude, zoom)
+        cell = cells.setdefault((int(x // CELL_SIZE), int(y // CELL_SIZE)), [0.0, 0.0, 0, []])
+        cell[0] += latitude
+        cell[1] += longitude
+        cell[2] += 1
+        if len(cell[3]) < SAMPLE_SIZE:
+            cell[3].append(item_id)
+    return [{'latitude': latitude_sum / count, 'longitude': longitude_sum / count, 'count': count, 'items': items}
+            for latitude_sum, longitude_sum, count, items in cells.values()]
+
+
+def get_clusters(zoom):
+    """
+    Returns the clusters of a zoom level, computed once and then served from the cache
+    until the catalog version changes.
+
+    :param zoom: zoom level
+    :return: list of clusters, see compute_clusters()
+    """
+    CatalogVersion = apps.get_model('respool', 'CatalogVersion')
+    key = 'respool:clusters:{}:{}'.format(CatalogVersion.get().version, zoom)
+    clusters = cache.get(key)
+    if clusters is None:
+        clusters = compute_clusters(zoom)
+        cache.set(key, clusters, getattr(settings, 'RESPOOL_CLUSTER_CACHE_TTL', None))
+    return clusters
+
+
+def in_bbox(latitude, longitude, bbox):
+    """
+    Checks whether a coordinate lies within a bounding box, which may cross the antimeridian.
+
+    :param bbox: west, south, east, north in degrees
+    """
+    west, south, east, north = bbox
+    if not south <= latitude <= north:
+        return False
+    if west <= east:
+        return west <= longitude <= east
+    return longitude >= west or longitude <= east
@@ -1,6 +1,20 @@
+import hashlib
+import math
+import re
 import socket
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
 
 import requests
+from django.apps import apps
+from django.conf import settings
+from django.db.models import FloatField, Func, Value
+from django.utils import timezone
+
+from respool.utils import address_index
 
 API_ROOT = 'https://nominatim.openstreetmap.org'
 import logging
@@ -8,18 +22,232 @@ import logging
 logger = logging.getLogger(__name__)
 
 DEG_ONE_KM = 0.009006575
+EARTH_RADIUS_KM = 6371.0088
+
+MAX_CACHE_KEY_LENGTH = 128
+DEFAULT_CACHE_SIZE = 1024
+DEFAULT_CACHE_TTL = 30 * 24 * 60 * 60
+DEFAULT_CACHE_NEGATIVE_TTL = 24 * 60 * 60
+# nominatim allows one request per second
+DEFAULT_MIN_INTERVAL = 1.0
+
+NOMINATIM_GEOCODER = 'nominatim'
+OFFLINE_GEOCODER = 'offline'
+
+_STREET_SUFFIX = re.compile(r'(stra(ss|ß)e|str\.?)$')
+_WHITESPACE = re.compile(r'\s+')
+
+
+class GeoCodingError(Exception):
+    """Raised if the geocoding service could not be reached."""
+    pass
 
 
-def getGeoCode(house_number='', street='', city=''):
+class GeoCodingThrottled(GeoCodingError):
+    """Raised instead of waiting for the next allowed request to the geocoding service."""
+    pass
+
+
+class GeoCodeCache:
     """
-    Returns latitude and longitude for a given address using the openstreetmap api.
+    In-process LRU cache with a TTL per entry, in front of the GeoCodeCacheEntry table.
+    Caches negative results (address not found) with a shorter TTL. Counts hits and misses per tier.
+    """
+
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {'memory_hits': 0, 'db_hits': 0, 'misses': 0}
+
+    @property
+    def max_size(self):
+        return getattr(settings, 'RESPOOL_GEOCODE_CACHE_SIZE', DEFAULT_CACHE_SIZE)
+
+    @staticmethod
+    def get_ttl(latitude, longitude):
+        if latitude is None or longitude is None:
+            return getattr(settings, 'RESPOOL_GEOCODE_CACHE_NEGATIVE_TTL', DEFAULT_CACHE_NEGATIVE_TTL)
+        return getattr(settings, 'RESPOOL_GEOCODE_CACHE_TTL', DEFAULT_CACHE_TTL)
+
+    def get(self, key):
+        """
+        Returns the cached coordinates of a normalized address.
+
+        :param key: normalized address key
+        :return: tuple (latitude, longitude), both none for a cached negative result, or none if not cached
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry[1] > time.monotonic():
+                self.entries.move_to_end(key)
+                self.stats['memory_hits'] += 1
+                return entry[0]
+
+        GeoCodeCacheEntry = apps.get_model('respool', 'GeoCodeCacheEntry')
+        db_entry = GeoCodeCacheEntry.objects.filter(key=key).first()
+        if db_entry:
+            age = (timezone.now() - db_entry.updated).total_seconds()
+            ttl = self.get_ttl(db_entry.latitude, db_entry.longitude)
+            if age < ttl:
+                coordinates = db_entry.latitude, db_entry.longitude
+                self._remember(key, coordinates, ttl - age)
+                with self.lock:
+                    self.stats['db_hits'] += 1
+                return coordinates
+        with self.lock:
+            self.stats['misses'] += 1
+        return None
+
+    def set(self, key, latitude, longitude):
+        """Stores the coordinates (or a negative result) of a normalized address in both tiers."""
+        GeoCodeCacheEntry = apps.get_model('respool', 'GeoCodeCacheEntry')
+        GeoCodeCacheEntry.objects.update_or_create(key=key, defaults={'latitude': latitude, 'longitude': longitude})
+        self._remember(key, (latitude, longitude), self.get_ttl(latitude, longitude))
+
+    def clear(self):
+        """Clears the in-process tier and resets the counters."""
+        with self.lock:
+            self.entries.clear()
+            for counter in self.stats:
+                self.stats[counter] = 0
+
+    def _remember(self, key, coordinates, ttl):
+        with self.lock:
+            self.entries[key] = (coordinates, time.monotonic() + ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+
+cache = GeoCodeCache()
+
+
+def normalizeAddress(house_number='', street='', city=''):
+    """
+    Returns a cache key for an address which is independent of case, whitespace and the spelling of 'straße'.
+
+    :return: string key 'house number|street|city', hashed if longer than MAX_CACHE_KEY_LENGTH
+    """
+    street = _WHITESPACE.sub(' ', str(street or '')).strip().lower()
+    street = _STREET_SUFFIX.sub('str', street)
+    city = _WHITESPACE.sub(' ', str(city or '')).strip().lower()
+    key = '{}|{}|{}'.format(str(house_number or '').strip().lower(), street, city)
+    if len(key) > MAX_CACHE_KEY_LENGTH:
+        key = hashlib.sha256(key.encode('utf-8')).hexdigest()
+    return key
+
+
+def getCacheStats():
+    """
+    Returns the hit and miss counters of the geocode cache of this process.
+
+    :return: dict with 'memory_hits', 'db_hits', 'misses' and 'size' of the in-process tier
+    """
+    stats = dict(cache.stats)
+    stats['size'] = len(cache.entries)
+    return stats
+
+
+def getGeoCode(house_number='', street='', city='', wait=True):
+    """
+    Returns latitude and longitude for a given address.
+    Answers from the geocode cache if possible, uses the openstreetmap api otherwise.
 
     :param house_number: House number of the address.
     :param street: Street name of the address.
     :param city: City name of the address.
+    :param wait: False to give up instead of waiting for the throttled api, e.g. while answering a request
     :return: floats 'latitude, longitude' on success, 'none, none' on error.
     """
-    # TODO: Blocking check
+    try:
+        return lookupGeoCode(house_number, street, city, wait)
+    except GeoCodingThrottled as err:
+        logger.warning(err)
+    except GeoCodingError as err:
+        logger.error(err)
+    return None, None
+
+
+def lookupGeoCode(house_number='', street='', city='', wait=True):
+    """
+    Returns latitude and longitude for a given address, like getGeoCode, but raises on service errors.
+    If the setting 'RESPOOL_GEOCODER' is 'offline', the local address index ('RESPOOL_GEOCODER_INDEX') is asked
+    first. Addresses missing in the index are looked up via the api unless 'RESPOOL_GEOCODER_FALLBACK' is false.
+
+    :param wait: False to raise GeoCodingThrottled instead of waiting for the throttled api
+    :return: floats 'latitude, longitude' on success, 'none, none' if the address was not found.
+    :raises GeoCodingError: if the api could not be reached
+    """
+    key = normalizeAddress(house_number, street, city)
+    if getattr(settings, 'RESPOOL_GEOCODER', NOMINATIM_GEOCODER) == OFFLINE_GEOCODER:
+        try:
+            coordinates = getAddressIndex().lookup(key)
+        except sqlite3.Error as err:
+            logger.error('address index not available: %s', err)
+            coordinates = None
+        if coordinates:
+            return coordinates
+        if not getattr(settings, 'RESPOOL_GEOCODER_FALLBACK', True):
+            return None, None
+
+    coordinates = cache.get(key)
+    if coordinates is not None:
+        return coordinates
+    # errors are not cached, the address might be found on the next try
+    latitude, longitude = requestGeoCode(house_number, street, city, wait)
+    cache.set(key, latitude, longitude)
+    return latitude, longitude
+
+
+_address_index = None
+
+
+def getAddressIndex():
+    """
+    Returns the local address index configured by the setting 'RESPOOL_GEOCODER_INDEX'.
+
+    :return: AddressIndex instance
+    """
+    global _address_index
+    path = getattr(settings, 'RESPOOL_GEOCODER_INDEX', None)
+    if _address_index is None or _address_index.path != path:
+        _address_index = address_index.AddressIndex(path)
+    return _address_index
+
+
+_last_request = 0.0
+_request_lock = threading.Lock()
+
+
+def _throttle(wait=True):
+    """
+    Reserves the next api request, at least 'RESPOOL_GEOCODE_MIN_INTERVAL' seconds after the previous one, and waits
+    for it. The lock is only held for the reservation, so waiting callers do not block each other.
+
+    :param wait: False to raise GeoCodingThrottled instead of waiting
+    """
+    global _last_request
+    min_interval = getattr(settings, 'RESPOOL_GEOCODE_MIN_INTERVAL', DEFAULT_MIN_INTERVAL)
+    with _request_lock:
+        now = time.monotonic()
+        start = max(now, _last_request + min_interval)
+        if start > now and not wait:
+            raise GeoCodingThrottled('the geocode api allows the next request in {:.1f}s'.format(start - now))
+        _last_request = start
+    if start > now:
+        time.sleep(start - now)
+
+
+def requestGeoCode(house_number='', street='', city='', wait=True):
+    """
+    Returns latitude and longitude for a given address using the openstreetmap api.
+    Requests are throttled to respect the usage policy of the api.
+
+    :param wait: False to raise GeoCodingThrottled instead of waiting for the next allowed request
+    :return: floats 'latitude, longitude' on success, 'none, none' if the address was not found.
+    :raises GeoCodingError: if the api could not be reached
+    """
+    _throttle(wait)
     try:
         url = "{api_root}/search?street={house_number} {street}&city={city}&country={country}&format=json" \
             .format(api_root=API_ROOT, house_number=house_number, street=street, city=city, country="Germany")
@@ -28,9 +256,8 @@ def getGeoCode(house_number='', street='', city=''):
             latitude = response.json()[-1]['lat']
             longitude = response.json()[-1]['lon']
             return float(latitude), float(longitude)
-    except socket.error as err:
-        logger.error(err)
-        pass
+    except (socket.error, requests.RequestException, ValueError) as err:
+        raise GeoCodingError(err)
     return None, None
 
 
@@ -44,6 +271,80 @@ def getBoundingBox(latitude, longitude, distance):
     return (latitude - distance_deg), (latitude + distance_deg), (longitude - distance_deg), (longitude + distance_deg)
 
 
+def getDistance(latitude_a, longitude_a, latitude_b, longitude_b):
+    """
+    Returns the great circle distance between two positions using the haversine formula.
+
+    :return: distance in km
+    """
+    phi_a, phi_b = math.radians(latitude_a), math.radians(latitude_b)
+    delta_phi = phi_b - phi_a
+    delta_lambda = math.radians(longitude_b - longitude_a)
+    a = math.sin(delta_phi / 2) ** 2 + math.cos(phi_a) * math.cos(phi_b) * math.sin(delta_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def sqlite_distance(latitude_a, longitude_a, latitude_b, longitude_b):
+    """
+    getDistance as SQLite function 'respool_distance', which lacks the trigonometric functions.
+
+    :return: distance in km or None if a position is missing
+    """
+    if None in (latitude_a, longitude_a, latitude_b, longitude_b):
+        return None
+    return getDistance(latitude_a, longitude_a, latitude_b, longitude_b)
+
+
+def register_sqlite_functions(connection):
+    """
+    Registers the functions used by Distance with a new SQLite connection.
+    """
+    connection.connection.create_function('respool_distance', 4, sqlite_distance)
+
+
+def _float_func(function, *expressions):
+    return Func(*expressions, function=function, output_field=FloatField())
+
+
+class Distance(Func):
+    """
+    Database expression of the haversine distance in km between the positions of the rows and a given position,
+    see getDistance. On SQLite it calls the function registered by register_sqlite_functions.
+    """
+    function = 'respool_distance'
+    output_field = FloatField()
+
+    def __init__(self, latitude, longitude, position_latitude, position_longitude):
+        """
+        :param latitude: expression of the latitude of a row, e.g. F('location__latitude')
+        :param longitude: expression of the longitude of a row
+        :param position_latitude: latitude of the given position
+        :param position_longitude: longitude of the given position
+        """
+        super().__init__(latitude, longitude)
+        self.position = float(position_latitude), float(position_longitude)
+
+    def as_sql(self, compiler, connection, **extra_context):
+        latitude, longitude = self.get_source_expressions()
+        position_latitude, position_longitude = self.position
+
+        def half_angle_sin_squared(expression, value):
+            radians = _float_func('RADIANS', expression - Value(value))
+            return _float_func('POWER', _float_func('SIN', radians / Value(2.0)), Value(2.0))
+
+        a = half_angle_sin_squared(latitude, position_latitude) + Value(math.cos(math.radians(position_latitude))) * \
+            _float_func('COS', _float_func('RADIANS', latitude)) * half_angle_sin_squared(longitude, position_longitude)
+        # rounding may push a slightly above 1 for antipodal positions
+        distance = Value(2 * EARTH_RADIUS_KM) * _float_func('ASIN', _float_func('SQRT', _float_func('LEAST', Value(1.0),
+                                                                                                    a)))
+        return compiler.compile(distance)
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        sql, params = super().as_sql(compiler, connection, template='%(function)s(%(expressions)s, %%s, %%s)',
+                                     **extra_context)
+        return sql, params + list(self.position)
+
+
 if __name__ == "__main__":
     latitude, longitude = getGeoCode(36, "Margaretendamm", "Bamberg")
     print(latitude, longitude)
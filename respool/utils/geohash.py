@@ -0,0 +1,89 @@
+import math
+
+'''
+Geohash encoding used to index locations for radius searches.
+Author: Marius Hofmann
+'''
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+# sorts after every geohash character, 'cell' <= geohash < 'cell' + UPPER_BOUND selects all hashes within a cell
+UPPER_BOUND = '{'
+MAX_PRECISION = 9
+KM_PER_DEGREE = 111.32
+
+
+def encode(latitude, longitude, precision=MAX_PRECISION):
+    """
+    Returns the geohash of a position.
+
+    :param latitude: latitude in degrees
+    :param longitude: longitude in degrees
+    :param precision: number of characters of the hash
+    :return: geohash string
+    """
+    lat_interval = [-90.0, 90.0]
+    lon_interval = [-180.0, 180.0]
+    geohash = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(geohash) < precision:
+        if even:
+            interval, value = lon_interval, longitude
+        else:
+            interval, value = lat_interval, latitude
+        middle = (interval[0] + interval[1]) / 2
+        bits <<= 1
+        if value >= middle:
+            bits |= 1
+            interval[0] = middle
+        else:
+            interval[1] = middle
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            geohash.append(BASE32[bits])
+            bits = 0
+            bit_count = 0
+    return ''.join(geohash)
+
+
+def cell_size(precision):
+    """
+    Returns the extent of a geohash cell of the given precision.
+
+    :param precision: number of characters of the hash
+    :return: latitude span, longitude span in degrees
+    """
+    lon_bits = math.ceil(precision * 5 / 2)
+    lat_bits = math.floor(precision * 5 / 2)
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lon_bits
+
+
+def covering_cells(latitude, longitude, distance):
+    """
+    Returns geohash cells which together cover a circle around a position.
+    Uses the most precise cells which are at least as large as the radius in both directions,
+    so the cell of the center and its eight neighbours contain the whole circle.
+
+    :param latitude: latitude of the center in degrees
+    :param longitude: longitude of the center in degrees
+    :param distance: radius in km
+    :return: set of geohash prefixes, empty if the circle is too large to be narrowed down by cells
+    """
+    distance = float(distance)
+    # the circle reaches its widest longitude extent at the latitude closest to the pole
+    max_latitude = min(abs(latitude) + distance / KM_PER_DEGREE, 90.0)
+    lon_km_per_degree = KM_PER_DEGREE * math.cos(math.radians(max_latitude))
+    for precision in range(MAX_PRECISION, 0, -1):
+        lat_span, lon_span = cell_size(precision)
+        if lat_span * KM_PER_DEGREE >= distance and lon_span * lon_km_per_degree >= distance:
+            cells = set()
+            for lat_offset in (-lat_span, 0, lat_span):
+                for lon_offset in (-lon_span, 0, lon_span):
+                    neighbour_latitude = latitude + lat_offset
+                    if -90.0 <= neighbour_latitude <= 90.0:
+                        neighbour_longitude = (longitude + lon_offset + 180.0) % 360.0 - 180.0
+                        cells.add(encode(neighbour_latitude, neighbour_longitude, precision))
+            return cells
+    return set()
@@ -0,0 +1,266 @@
+import logging
+import re
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+
+'''
+Recording of the sql queries of requests, see respool.middleware.QueryProfileMiddleware.
+Each process keeps the last requests per view and shares them through the cache, so the summary of all processes
+can be dumped by the command 'query_profile'. This requires a cache shared by the processes, e.g. memcached or the
+database cache, see setting 'RESPOOL_QUERY_PROFILE_CACHE'.
+Author: Marius Hofmann
+'''
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WINDOW = 200
+DEFAULT_FLUSH_SECONDS = 10
+DEFAULT_REPEAT_LIMIT = 10
+DEFAULT_MAX_PROCESSES = 64
+# repeated queries kept per request and listed per view
+MAX_REPEATED = 5
+CACHE_TIMEOUT = 24 * 60 * 60
+
+_WHITESPACE = re.compile(r'\s+')
+_SAVEPOINT = re.compile(r'SAVEPOINT "[^"]*"')
+_LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b|%s")
+_IN_LIST = re.compile(r'IN \((?:\?, )*\?\)')
+
+
+def get_cache():
+    """
+    :return: the cache the processes share their samples through, see setting 'RESPOOL_QUERY_PROFILE_CACHE'
+    :raises ImproperlyConfigured: if the cache is local to a process, so the samples could not be summarized
+    """
+    alias = getattr(settings, 'RESPOOL_QUERY_PROFILE_CACHE', 'default')
+    cache = caches[alias]
+    if isinstance(cache, (LocMemCache, DummyCache)):
+        raise ImproperlyConfigured("The query profile requires a cache shared by all processes, e.g. memcached or "
+                                   "the database cache, the cache '{}' is {}. Configure another cache by the setting "
+                                   "'RESPOOL_QUERY_PROFILE_CACHE'.".format(alias, type(cache).__name__))
+    return cache
+
+
+def get_max_processes():
+    """
+    :return: number of processes whose samples can be kept at once, see setting 'RESPOOL_QUERY_PROFILE_MAX_PROCESSES'
+    """
+    return getattr(settings, 'RESPOOL_QUERY_PROFILE_MAX_PROCESSES', DEFAULT_MAX_PROCESSES)
+
+
+def _slot_key(slot):
+    return 'respool:query_profile:process:{}'.format(slot)
+
+
+def get_window():
+    """
+    :return: number of requests kept per view, see setting 'RESPOOL_QUERY_PROFILE_WINDOW'
+    """
+    return getattr(settings, 'RESPOOL_QUERY_PROFILE_WINDOW', DEFAULT_WINDOW)
+
+
+def get_flush_seconds():
+    """
+    :return: minimum seconds between two writes of the summary of a process to the cache,
+        see setting 'RESPOOL_QUERY_PROFILE_FLUSH_SECONDS'
+    """
+    return getattr(settings, 'RESPOOL_QUERY_PROFILE_FLUSH_SECONDS', DEFAULT_FLUSH_SECONDS)
+
+
+def get_repeat_limit():
+    """
+    :return: number of executions of one query in a request above which a warning is logged,
+        see setting 'RESPOOL_QUERY_PROFILE_REPEAT_LIMIT'
+    """
+    return getattr(settings, 'RESPOOL_QUERY_PROFILE_REPEAT_LIMIT', DEFAULT_REPEAT_LIMIT)
+
+
+@lru_cache(maxsize=1024)
+def fingerprint(sql):
+    """
+    Reduces a query to its shape, so the queries of an N+1 pattern, which only differ in their parameters,
+    share a fingerprint.
+
+    :param sql: sql with placeholders or inlined literals
+    :return: sql with literals and placeholders replaced by '?' and IN lists collapsed
+    """
+    sql = _WHITESPACE.sub(' ', sql.strip())
+    sql = _SAVEPOINT.sub('SAVEPOINT ?', sql)
+    sql = _LITERAL.sub('?', sql)
+    return _IN_LIST.sub('IN (...)', sql)
+
+
+class QueryRecorder:
+    """
+    Counts and times the queries of one request, installed with connection.execute_wrapper.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.fingerprints = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+            self.fingerprints[fingerprint(sql)] += 1
+
+    @property
+    def repeated_count(self):
+        """
+        :return: number of executions beyond the first of each query
+        """
+        return sum(executions - 1 for executions in self.fingerprints.values())
+
+    def get_repeated(self, limit=MAX_REPEATED):
+        """
+        :return: list of (fingerprint, executions) of the queries run more than once, most executed first
+        """
+        return [(query, executions) for query, executions in self.fingerprints.most_common(limit) if executions > 1]
+
+    def server_timing(self, duration):
+        """
+        :param duration: duration of the whole request in seconds
+        :return: value of a Server-Timing header with the database time, the query counts and the request time
+        """
+        return 'db;dur={:.2f};desc="{} queries", db-repeated;desc="{} repeated queries", total;dur={:.2f}'.format(
+            self.duration * 1000, self.count, self.repeated_count, duration * 1000)
+
+
+def get_view_name(request):
+    """
+    :return: method and name of the view which handled a request, e.g. 'GET respool:api-items'
+    """
+    match = getattr(request, 'resolver_match', None)
+    return '{} {}'.format(request.method, match.view_name if match else '<unresolved>')
+
+
+class QueryProfile:
+    """
+    Rolling window of the query counts of the last requests per view of this process.
+    The samples are written to the cache at most every few seconds, into a slot which the process claims with
+    cache.add, so processes never overwrite the samples of each other.
+    """
+
+    def __init__(self):
+        self.id = uuid.uuid4().hex
+        self.slot = None
+        self.views = {}
+        self.lock = threading.Lock()
+        self.flushed = 0.0
+
+    def add(self, view, recorder):
+        """
+        Adds the queries of a request and logs a warning if a query was repeated more often than allowed.
+
+        :param view: name of the view, see get_view_name
+        :param recorder: QueryRecorder of the request
+        """
+        repeated = recorder.get_repeated()
+        if repeated and repeated[0][1] > get_repeat_limit():
+            logger.warning('%s ran a query %s times: %s', view, repeated[0][1], repeated[0][0])
+
+        sample = (recorder.count, recorder.duration, recorder.repeated_count, repeated)
+        window = get_window()
+        with self.lock:
+            samples = self.views.get(view)
+            if samples is None or samples.maxlen != window:
+                samples = self.views[view] = deque(samples or (), maxlen=window)
+            samples.append(sample)
+            now = time.monotonic()
+            if now - self.flushed < get_flush_seconds():
+                return
+            self.flushed = now
+            views = {name: list(samples) for name, samples in self.views.items()}
+        self.flush(views)
+
+    def flush(self, views):
+        cache = get_cache()
+        entry = (self.id, views)
+        if self.slot is not None:
+            current = cache.get(_slot_key(self.slot))
+            if current is not None and current[0] == self.id:
+                cache.set(_slot_key(self.slot), entry, CACHE_TIMEOUT)
+                return
+        # the slot of this process expired or was cleared, it is claimed again unless another process took it
+        slots = ([self.slot] if self.slot is not None else []) + list(range(get_max_processes()))
+        for slot in slots:
+            if cache.add(_slot_key(slot), entry, CACHE_TIMEOUT):
+                self.slot = slot
+                return
+        self.slot = None
+        logger.warning('the query profile keeps the samples of at most %s processes', get_max_processes())
+
+    def clear(self):
+        """Drops the samples of this process."""
+        with self.lock:
+            self.views.clear()
+            self.flushed = 0.0
+
+
+profile = QueryProfile()
+
+
+def load_samples():
+    """
+    Loads the samples of all processes from the cache.
+
+    :return: dict of view name to list of samples (queries, database seconds, repeated queries, repeated list)
+    """
+    entries = get_cache().get_many([_slot_key(slot) for slot in range(get_max_processes())])
+    views = {}
+    for _, process_views in entries.values():
+        for view, samples in process_views.items():
+            views.setdefault(view, []).extend(samples)
+    return views
+
+
+def summarize(views):
+    """
+    :param views: samples per view, see load_samples
+    :return: list of dicts per view with the number of requests, mean and max of the queries,
+        database milliseconds and repeated queries and the most repeated queries
+    """
+    summary = []
+    for view, samples in views.items():
+        repeated = {}
+        for _, _, _, queries in samples:
+            for query, executions in queries:
+                requests, max_executions = repeated.get(query, (0, 0))
+                repeated[query] = requests + 1, max(max_executions, executions)
+        summary.append({
+            'view': view,
+            'requests': len(samples),
+            'queries': {'mean': sum(sample[0] for sample in samples) / len(samples),
+                        'max': max(sample[0] for sample in samples)},
+            'db_ms': {'mean': sum(sample[1] for sample in samples) / len(samples) * 1000,
+                      'max': max(sample[1] for sample in samples) * 1000},
+            'repeated': {'mean': sum(sample[2] for sample in samples) / len(samples),
+                         'max': max(sample[2] for sample in samples)},
+            'repeated_queries': [{'fingerprint': query, 'requests': requests, 'max_executions': max_executions}
+                                 for query, (requests, max_executions) in sorted(
+                                     repeated.items(), key=lambda entry: (-entry[1][0], -entry[1][1]))[:MAX_REPEATED]],
+        })
+    return summary
+
+
+def clear():
+    """
+    Drops the samples of all processes from the cache and of this process.
+    Other processes keep their local samples of the current window until they are replaced.
+    """
+    get_cache().delete_many([_slot_key(slot) for slot in range(get_max_processes())])
+    profile.clear()
@@ -0,0 +1,155 @@
+import gzip
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+try:
+    import brotli
+except ImportError:  # brotli variants are optional
+    brotli = None
+
+'''
+In-process cache for rendered api responses, including precompressed variants of each body.
+Author: Marius Hofmann
+'''
+
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+# bodies below this size are not worth compressing, same limit as django's GZipMiddleware
+MIN_COMPRESS_SIZE = 200
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+IDENTITY = 'identity'
+GZIP = 'gzip'
+BROTLI = 'br'
+
+
+def canonical_params(query_params, ignored=()):
+    """
+    Returns a hashable, order independent representation of query parameters.
+    Empty values are dropped, as the api treats them like missing parameters.
+
+    :param query_params: QueryDict
+    :param ignored: names of parameters which are not part of the representation
+    :return: tuple of (name, tuple of sorted values)
+    """
+    return tuple(sorted((name, tuple(sorted(value for value in values if value)))
+                        for name, values in query_params.lists()
+                        if name not in ignored and any(values)))
+
+
+def accepted_encodings(accept_encoding):
+    """
+    Returns the content codings accepted by a client.
+
+    :param accept_encoding: value of the Accept-Encoding header
+    :return: set of lower case codings, excluding those with q=0
+    """
+    encodings = set()
+    for coding in accept_encoding.split(','):
+        name, _, params = coding.strip().partition(';')
+        params = params.replace(' ', '')
+        if name and params not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            encodings.add(name.lower())
+    return encodings
+
+
+class CachedResponse:
+    """
+    Rendered body of a response and its compressed variants.
+    """
+
+    def __init__(self, content_type, body):
+        self.content_type = content_type
+        self.bodies = {IDENTITY: body}
+        if len(body) >= MIN_COMPRESS_SIZE:
+            self.bodies[GZIP] = gzip.compress(body, GZIP_LEVEL)
+            if brotli:
+                self.bodies[BROTLI] = brotli.compress(body, quality=BROTLI_QUALITY)
+        self.size = sum(len(variant) for variant in self.bodies.values())
+
+    def select(self, accept_encoding):
+        """
+        Returns the smallest variant acceptable for a client.
+
+        :param accept_encoding: value of the Accept-Encoding header
+        :return: tuple (content coding, body)
+        """
+        accepted = accepted_encodings(accept_encoding)
+        for encoding in (BROTLI, GZIP):
+            if encoding in self.bodies and (encoding in accepted or '*' in accepted):
+                return encoding, self.bodies[encoding]
+        return IDENTITY, self.bodies[IDENTITY]
+
+
+class ResponseCache:
+    """
+    LRU cache of CachedResponse objects, bounded by the total size of all stored bodies.
+    Counts hits, misses and evictions.
+    """
+
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    @property
+    def max_bytes(self):
+        return getattr(settings, 'RESPOOL_RESPONSE_CACHE_BYTES', DEFAULT_MAX_BYTES)
+
+    def get(self, key):
+        """
+        :param key: hashable key of the response
+        :return: CachedResponse or None if not cached
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return entry
+
+    def set(self, key, entry):
+        """
+        Stores a CachedResponse, evicting the least recently used entries until the cache fits its size limit.
+        Entries larger than the whole cache are not stored.
+        """
+        max_bytes = self.max_bytes
+        if entry.size > max_bytes:
+            return
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous:
+                self.size -= previous.size
+            self.entries[key] = entry
+            self.size += entry.size
+            while self.size > max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= evicted.size
+                self.stats['evictions'] += 1
+
+    def clear(self):
+        """Drops all entries, the counters are kept."""
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def get_stats(self):
+        """
+        :return: dict with 'hits', 'misses', 'evictions', 'hit_rate', 'entries', 'bytes' and 'max_bytes'
+        """
+        with self.lock:
+            stats = dict(self.stats)
+            stats['entries'] = len(self.entries)
+            stats['bytes'] = self.size
+        requests = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / requests if requests else 0.0
+        stats['max_bytes'] = self.max_bytes
+        return stats
+
+
+cache = ResponseCache()
@@ -0,0 +1,303 @@
+import re
+from abc import ABC, abstractmethod
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import F, FloatField, Func, Lookup, Q, TextField, Value
+from django.utils.module_loading import import_string
+
+'''
+Full text search over the title and description of items.
+Authors: Michael Götz, Marius Hofmann
+'''
+
+TOKEN_PATTERN = re.compile(r'\w+', re.UNICODE)
+
+_STRIP_GE = re.compile(r'^ge(.{4,})')
+_REPLACE_DOUBLE = re.compile(r'(.)\1')
+_STRIP_EMR = re.compile(r'e[mr]$')
+_STRIP_ND = re.compile(r'nd$')
+_STRIP_T = re.compile(r't$')
+_STRIP_ESN = re.compile(r'[esn]$')
+_RESTORE_DOUBLE = re.compile(r'(.)\*')
+
+
+def stem(word):
+    """
+    Returns the stem of a german word using the CISTEM stemmer (Weissweiler, Fraser 2017).
+    Case insensitive, so that query tokens and indexed words share the same stem.
+
+    :param word: a single word
+    :return: the stemmed, lower cased word
+    """
+    word = word.lower().replace('ü', 'u').replace('ö', 'o').replace('ä', 'a').replace('ß', 'ss')
+    word = _STRIP_GE.sub(r'\1', word)
+    word = word.replace('sch', '$').replace('ei', '%').replace('ie', '&')
+    word = _REPLACE_DOUBLE.sub(r'\1*', word)
+    while len(word) > 3:
+        if len(word) > 5:
+            word, count = _STRIP_EMR.subn('', word)
+            if count:
+                continue
+            word, count = _STRIP_ND.subn('', word)
+            if count:
+                continue
+        word, count = _STRIP_T.subn('', word)
+        if count:
+            continue
+        word, count = _STRIP_ESN.subn('', word)
+        if not count:
+            break
+    word = _RESTORE_DOUBLE.sub(r'\1\1', word)
+    return word.replace('%', 'ei').replace('&', 'ie').replace('$', 'sch')
+
+
+def tokenize(text):
+    """
+    Splits a text into stemmed words.
+
+    :param text: any text, e.g. an item title or a search token
+    :return: list of stems
+    """
+    return [stem(word) for word in TOKEN_PATTERN.findall(text or '')]
+
+
+class SqliteDocumentField(TextField):
+    """
+    Hidden column of a SQLite FTS5 table named like the table, matched against a full text query.
+    """
+
+
+@SqliteDocumentField.register_lookup
+class SqliteMatch(Lookup):
+    lookup_name = 'match'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return '{} MATCH {}'.format(lhs, rhs), lhs_params + rhs_params
+
+
+class PostgresDocumentField(TextField):
+    """
+    tsvector column, matched against a tsquery of the german text search configuration.
+    """
+    def db_type(self, connection):
+        return 'tsvector'
+
+
+@PostgresDocumentField.register_lookup
+class PostgresMatch(Lookup):
+    lookup_name = 'match'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return "{} @@ to_tsquery('german', {})".format(lhs, rhs), lhs_params + rhs_params
+
+
+class ToTsQuery(Func):
+    function = 'to_tsquery'
+    template = "%(function)s('german', %(expressions)s)"
+
+
+class SearchBackend(ABC):
+    """
+    Base class of the full text search backends.
+    A backend keeps its own index in sync with the items and filters/orders Item querysets by relevance.
+    """
+
+    @abstractmethod
+    def create_index(self, schema_editor):
+        """Creates the index structures. Called from a migration."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def drop_index(self, schema_editor):
+        """Removes the index structures. Called from a migration."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def index(self, item_id, title, description):
+        """Adds or replaces the index entry of a single item."""
+        raise NotImplementedError
+
+    def index_many(self, rows):
+        """
+        Adds or replaces the index entries of many items.
+
+        :param rows: iterable of (item_id, title, description)
+        """
+        for item_id, title, description in rows:
+            self.index(item_id, title, description)
+
+    @abstractmethod
+    def remove(self, item_id):
+        """Removes the index entry of a single item."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def search(self, queryset, search_token):
+        """
+        Filters the queryset to the items matching the search token and orders them by relevance.
+
+        :param queryset: Item queryset
+        :param search_token: raw search input of the user
+        :return: filtered and ordered queryset
+        """
+        raise NotImplementedError
+
+
+class ContainsSearchBackend(SearchBackend):
+    """
+    Fallback without an index for databases without full text support.
+    Matches title or description case insensitive, does not rank.
+    """
+
+    def create_index(self, schema_editor):
+        pass
+
+    def drop_index(self, schema_editor):
+        pass
+
+    def index(self, item_id, title, description):
+        pass
+
+    def index_many(self, rows):
+        pass
+
+    def remove(self, item_id):
+        pass
+
+    def search(self, queryset, search_token):
+        for word in search_token.split():
+            queryset = queryset.filter(Q(title__icontains=word) | Q(description__icontains=word))
+        return queryset
+
+
+class SqliteSearchBackend(SearchBackend):
+    """
+    Uses a SQLite FTS5 table holding the stemmed title and description of each item (rowid = item id).
+    Results are ranked by bm25 with the title weighted higher than the description, configured as the rank of the
+    table. The table is joined to the items through the unmanaged model respool.models.SqliteItemSearch.
+    """
+    table = 'respool_item_fts'
+    relation = 'sqlite_search'
+
+    def create_index(self, schema_editor):
+        schema_editor.execute("CREATE VIRTUAL TABLE IF NOT EXISTS {} USING fts5(title, description, "
+                              "tokenize='unicode61')".format(self.table))
+        schema_editor.execute("INSERT INTO {table} ({table}, rank) VALUES ('rank', 'bm25(2.0, 1.0)')".format(
+            table=self.table))
+
+    def drop_index(self, schema_editor):
+        schema_editor.execute('DROP TABLE IF EXISTS {}'.format(self.table))
+
+    def index(self, item_id, title, description):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM {} WHERE rowid = %s'.format(self.table), [item_id])
+            cursor.execute('INSERT INTO {} (rowid, title, description) VALUES (%s, %s, %s)'.format(self.table),
+                           [item_id, ' '.join(tokenize(title)), ' '.join(tokenize(description))])
+
+    def index_many(self, rows):
+        rows = list(rows)
+        if not rows:
+            return
+        with connection.cursor() as cursor:
+            cursor.executemany('DELETE FROM {} WHERE rowid = %s'.format(self.table), [[row[0]] for row in rows])
+            cursor.executemany('INSERT INTO {} (rowid, title, description) VALUES (%s, %s, %s)'.format(self.table),
+                               [[item_id, ' '.join(tokenize(title)), ' '.join(tokenize(description))]
+                                for item_id, title, description in rows])
+
+    def remove(self, item_id):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM {} WHERE rowid = %s'.format(self.table), [item_id])
+
+    def search(self, queryset, search_token):
+        # every word has to match, the last one may be incomplete while the user is still typing
+        words = tokenize(search_token)
+        if not words:
+            return queryset
+        match = ' '.join('"{}"*'.format(word) for word in words)
+        # bm25 is negative, lower is better
+        return queryset.filter(**{self.relation + '__document__match': match}).annotate(
+            search_rank=F(self.relation + '__rank') * -1
+        ).order_by('-search_rank', 'id')
+
+
+class PostgresSearchBackend(SearchBackend):
+    """
+    Uses a table of weighted tsvectors with a GIN index, built with the german text search configuration.
+    Results are ranked by ts_rank. The table is joined to the items through the unmanaged model
+    respool.models.PostgresItemSearch.
+    """
+    table = 'respool_item_search'
+    relation = 'postgres_search'
+
+    def create_index(self, schema_editor):
+        schema_editor.execute('CREATE TABLE IF NOT EXISTS {table} ('
+                              'item_id integer PRIMARY KEY REFERENCES respool_item (id) ON DELETE CASCADE '
+                              'DEFERRABLE INITIALLY DEFERRED, '
+                              'document tsvector NOT NULL)'.format(table=self.table))
+        schema_editor.execute('CREATE INDEX IF NOT EXISTS {table}_document ON {table} '
+                              'USING gin (document)'.format(table=self.table))
+
+    def drop_index(self, schema_editor):
+        schema_editor.execute('DROP TABLE IF EXISTS {}'.format(self.table))
+
+    def index(self, item_id, title, description):
+        with connection.cursor() as cursor:
+            cursor.execute("INSERT INTO {} (item_id, document) VALUES (%s, "
+                           "setweight(to_tsvector('german', %s), 'A') || setweight(to_tsvector('german', %s), 'B')) "
+                           "ON CONFLICT (item_id) DO UPDATE SET document = EXCLUDED.document".format(self.table),
+                           [item_id, title, description])
+
+    def index_many(self, rows):
+        rows = [list(row) for row in rows]
+        if not rows:
+            return
+        with connection.cursor() as cursor:
+            cursor.executemany("INSERT INTO {} (item_id, document) VALUES (%s, "
+                               "setweight(to_tsvector('german', %s), 'A') || "
+                               "setweight(to_tsvector('german', %s), 'B')) "
+                               "ON CONFLICT (item_id) DO UPDATE SET document = EXCLUDED.document".format(self.table),
+                               rows)
+
+    def remove(self, item_id):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM {} WHERE item_id = %s'.format(self.table), [item_id])
+
+    def search(self, queryset, search_token):
+        words = TOKEN_PATTERN.findall(search_token)
+        if not words:
+            return queryset
+        query = ' & '.join('{}:*'.format(word) for word in words)
+        document = self.relation + '__document'
+        return queryset.filter(**{document + '__match': query}).annotate(
+            search_rank=Func(F(document), ToTsQuery(Value(query)), function='ts_rank', output_field=FloatField())
+        ).order_by('-search_rank', 'id')
+
+
+BACKENDS = {
+    'sqlite': SqliteSearchBackend,
+    'postgresql': PostgresSearchBackend,
+}
+
+_backend = None
+
+
+def get_backend():
+    """
+    Returns the search backend configured by the setting 'RESPOOL_SEARCH_BACKEND' (dotted path to a SearchBackend
+    class). Defaults to the backend matching the database vendor.
+
+    :return: SearchBackend instance
+    """
+    global _backend
+    if _backend is None:
+        backend_path = getattr(settings, 'RESPOOL_SEARCH_BACKEND', None)
+        if backend_path:
+            _backend = import_string(backend_path)()
+        else:
+            _backend = BACKENDS.get(connection.vendor, ContainsSearchBackend)()
+    return _backend
@@ -0,0 +1,66 @@
+import logging
+import queue
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+'''
+Minimal background worker for deferring slow work out of the request.
+Author: Marius Hofmann
+'''
+
+logger = logging.getLogger(__name__)
+
+_tasks = queue.Queue()
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def _work():
+    while True:
+        function, args = _tasks.get()
+        close_old_connections()
+        try:
+            function(*args)
+        except Exception:
+            logger.exception('background task %s failed', function.__name__)
+        finally:
+            close_old_connections()
+            _tasks.task_done()
+
+
+def _ensure_worker():
+    global _worker
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_work, name='respool-tasks', daemon=True)
+            _worker.start()
+
+
+def run(function, *args):
+    """
+    Runs a function in the background worker thread of this process.
+    Runs it immediately instead if the setting 'RESPOOL_TASKS_SYNC' is set, e.g. for tests and commands.
+
+    :param function: function to call
+    :param args: arguments passed to the function, should be primitive values like ids
+    """
+    if getattr(settings, 'RESPOOL_TASKS_SYNC', False):
+        function(*args)
+        return
+    _ensure_worker()
+    _tasks.put((function, args))
+
+
+def run_on_commit(function, *args):
+    """
+    Runs a function in the background once the current transaction is committed,
+    so the worker sees the saved rows.
+    """
+    transaction.on_commit(lambda: run(function, *args))
+
+
+def wait():
+    """Blocks until all queued tasks are done."""
+    _tasks.join()
@@ -0,0 +1,81 @@
+import math
+
+from django.apps import apps
+from django.db.models import F
+
+from respool.utils import bulk, clustering
+
+'''
+Slippy map tiles of the item map with per tile versions.
+Author: Marius Hofmann
+'''
+
+
+def tile_of(latitude, longitude, zoom):
+    """
+    Returns the tile containing a coordinate.
+
+    :return: x, y of the tile at the given zoom level
+    """
+    x, y = clustering.project(latitude, longitude, zoom)
+    last = 2 ** zoom - 1
+    return min(max(int(x // clustering.TILE_SIZE), 0), last), min(max(int(y // clustering.TILE_SIZE), 0), last)
+
+
+def tile_bounds(zoom, x, y):
+    """
+    Returns the extent of a tile.
+
+    :return: west, south, east, north in degrees
+    """
+    count = 2 ** zoom
+
+    def latitude(tile_y):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * tile_y / count))))
+
+    return x / count * 360.0 - 180.0, latitude(y + 1), (x + 1) / count * 360.0 - 180.0, latitude(y)
+
+
+def is_valid(zoom, x, y):
+    return 0 <= zoom <= clustering.MAX_ZOOM and 0 <= x < 2 ** zoom and 0 <= y < 2 ** zoom
+
+
+def tile_key(zoom, x, y):
+    return '{}/{}/{}'.format(zoom, x, y)
+
+
+def get_version(zoom, x, y):
+    """
+    Returns the version of a tile, see respool.models.TileVersion.
+
+    :return: number of changes of the tile, 0 for tiles which never changed
+    """
+    TileVersion = apps.get_model('respool', 'TileVersion')
+    return TileVersion.objects.filter(tile=tile_key(zoom, x, y)).values_list('version', flat=True).first() or 0
+
+
+def invalidate(positions):
+    """
+    Increments the versions of the tiles of all zoom levels containing one of the given coordinates
+    within the current transaction.
+
+    :param positions: iterable of (latitude, longitude), None values are ignored
+    """
+    keys = set()
+    for latitude, longitude in positions:
+        if latitude is None or longitude is None:
+            continue
+        for zoom in range(clustering.MAX_ZOOM + 1):
+            keys.add(tile_key(zoom, *tile_of(latitude, longitude, zoom)))
+    if not keys:
+        return
+
+    TileVersion = apps.get_model('respool', 'TileVersion')
+    keys = sorted(keys)
+    updated = 0
+    for start in range(0, len(keys), bulk.MAX_QUERY_PARAMS):
+        updated += TileVersion.objects.filter(tile__in=keys[start:start + bulk.MAX_QUERY_PARAMS]) \
+            .update(version=F('version') + 1)
+    if updated < len(keys):
+        # tiles which never changed before have no row yet
+        bulk.get_or_create_many(TileVersion, [TileVersion(tile=key, version=1) for key in keys], ['tile'])
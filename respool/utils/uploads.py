@@ -0,0 +1,164 @@
+import base64
+import binascii
+import hashlib
+import os
+import tempfile
+from contextlib import contextmanager
+
+from PIL import Image as pil_image
+from django.conf import settings
+
+try:
+    import fcntl
+except ImportError:  # no file locks on windows, concurrent chunks of one upload are not guarded there
+    fcntl = None
+
+'''
+Chunked, resumable uploads: the chunks of an upload are streamed straight into a partial file outside of the
+media storage, each chunk is verified by its checksum and dropped again if it arrives incomplete or corrupted.
+The headers follow the tus protocol (https://tus.io/protocols/resumable-upload.html).
+Author: Marius Hofmann
+'''
+
+DEFAULT_MAX_FILE_SIZE = 20 * 1024 * 1024
+DEFAULT_MAX_CHUNK_SIZE = 4 * 1024 * 1024
+DEFAULT_EXPIRY_HOURS = 24
+DEFAULT_MAX_PENDING = 20
+DEFAULT_MAX_ANONYMOUS_PENDING = 100
+READ_SIZE = 64 * 1024
+CHECKSUM_ALGORITHMS = ('md5', 'sha1', 'sha256')
+
+
+class ChunkError(Exception):
+    """Raised if a chunk is rejected, nothing of the chunk is kept."""
+    pass
+
+
+def get_upload_dir():
+    """
+    :return: directory of the partial files, see setting 'RESPOOL_UPLOAD_DIR'
+    """
+    return getattr(settings, 'RESPOOL_UPLOAD_DIR', os.path.join(tempfile.gettempdir(), 'respool-uploads'))
+
+
+def get_max_file_size():
+    """
+    :return: maximum size of an uploaded file in bytes, see setting 'RESPOOL_UPLOAD_MAX_FILE_SIZE'
+    """
+    return getattr(settings, 'RESPOOL_UPLOAD_MAX_FILE_SIZE', DEFAULT_MAX_FILE_SIZE)
+
+
+def get_max_chunk_size():
+    """
+    :return: maximum size of a chunk, i.e. of the body of one request, see setting 'RESPOOL_UPLOAD_MAX_CHUNK_SIZE'
+    """
+    return getattr(settings, 'RESPOOL_UPLOAD_MAX_CHUNK_SIZE', DEFAULT_MAX_CHUNK_SIZE)
+
+
+def get_max_pending():
+    """
+    :return: maximum number of uploads a user or an anonymous session may have pending, i.e. not consumed by a form,
+        see setting 'RESPOOL_UPLOAD_MAX_PENDING'
+    """
+    return getattr(settings, 'RESPOOL_UPLOAD_MAX_PENDING', DEFAULT_MAX_PENDING)
+
+
+def get_max_anonymous_pending():
+    """
+    :return: maximum number of pending uploads of all anonymous sessions together, which bounds the disk space
+        taken by clients without a session cookie, see setting 'RESPOOL_UPLOAD_MAX_ANONYMOUS_PENDING'
+    """
+    return getattr(settings, 'RESPOOL_UPLOAD_MAX_ANONYMOUS_PENDING', DEFAULT_MAX_ANONYMOUS_PENDING)
+
+
+def create_partial_file(path):
+    """
+    Creates the empty partial file of a new upload.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, 'wb').close()
+
+
+def delete_partial_file(path):
+    """
+    Deletes the partial file of an upload, if it exists.
+    """
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def parse_checksum(header):
+    """
+    Parses an 'Upload-Checksum' header.
+
+    :param header: '<algorithm> <base64 encoded digest>', e.g. 'sha256 47DEQpj8HBSa+/TImW+5JCeuQeRkm5NMpJWZG3hSuFU='
+    :return: tuple (new hash object of the algorithm, expected digest)
+    :raises ChunkError: if the header is missing or malformed or names an unsupported algorithm
+    """
+    algorithm, _, digest = (header or '').strip().partition(' ')
+    if algorithm not in CHECKSUM_ALGORITHMS:
+        raise ChunkError('Upload-Checksum requires one of the algorithms {}'.format(', '.join(CHECKSUM_ALGORITHMS)))
+    try:
+        return hashlib.new(algorithm), base64.b64decode(digest.strip(), validate=True)
+    except binascii.Error:
+        raise ChunkError('Upload-Checksum requires a base64 encoded digest')
+
+
+@contextmanager
+def locked(path):
+    """
+    Holds an exclusive lock on a partial file, so chunks of one upload are written one after another,
+    also across processes.
+    """
+    with open(path, 'rb') as lock_file:
+        if fcntl:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def write_chunk(path, offset, stream, length, checksum_header):
+    """
+    Streams a chunk into the partial file at the given offset, without holding the chunk in memory.
+    Should be called while holding the lock of the file, see locked().
+
+    :param path: path of the partial file
+    :param offset: byte offset of the chunk in the file
+    :param stream: readable request stream
+    :param length: announced length of the chunk in bytes
+    :param checksum_header: value of the 'Upload-Checksum' header, see parse_checksum()
+    :raises ChunkError: if fewer bytes than announced arrive or the checksum does not match,
+        the partial file is truncated to the offset again
+    """
+    checksum, expected_digest = parse_checksum(checksum_header)
+    with open(path, 'r+b') as partial_file:
+        partial_file.seek(offset)
+        remaining = length
+        while remaining:
+            block = stream.read(min(READ_SIZE, remaining))
+            if not block:
+                break
+            checksum.update(block)
+            partial_file.write(block)
+            remaining -= len(block)
+        if remaining or checksum.digest() != expected_digest:
+            partial_file.truncate(offset)
+            if remaining:
+                raise ChunkError('The chunk ended after {} of {} bytes'.format(length - remaining, length))
+            raise ChunkError('The checksum of the chunk does not match')
+
+
+def is_image(path):
+    """
+    :param path: path of a completely received file
+    :return: True if the file is an image readable by Pillow
+    """
+    try:
+        with pil_image.open(path) as image:
+            image.verify()
+    except Exception:  # Pillow raises many exception types for unreadable images, like django's ImageField
+        return False
+    return True
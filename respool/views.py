@@ -5,6 +5,7 @@ from django.shortcuts import render, redirect
 
 from accounts.models import Lender
 from .models import Item
+from .utils import clustering
 
 logger = logging.getLogger(__name__)
 
@@ -30,7 +31,8 @@ def map(request):
     :return: rendered map page
     '''
     types = {'venue': Item.VENUE, 'service': Item.SERVICE, 'object': Item.OBJECT}
-    return render(request, "respool/map/leaflet.jinja", {'title': 'Respool Map', 'types': types})
+    return render(request, "respool/map/leaflet.jinja", {'title': 'Respool Map', 'types': types,
+                                                         'item_zoom': clustering.get_item_zoom()})
 
 
 def item_detail_page(request, pk):
@@ -41,7 +43,7 @@ def item_detail_page(request, pk):
     :param pk: the items id
     :return: rendered item detail page
     """
-    item = Item.objects.get(id=pk)
+    item = Item.objects.prefetch_related('images__variants').get(id=pk)
     title = 'Item: ' + item.title
     is_in_cart = pk in request.session.get('shopping_cart_items', [])
 
@@ -136,7 +138,8 @@ def shoppingcart(request):
     if item_ids:
         lenders = Lender.objects.filter(item__in=item_ids).distinct()
         for lender in lenders:
-            lender_items[lender] = Item.objects.filter(lender=lender, id__in=item_ids)
+            lender_items[lender] = Item.objects.filter(lender=lender, id__in=item_ids) \
+                .prefetch_related('images__variants')
 
     return render(request, "respool/shoppingcart.jinja",
                   {'title': 'Warenkorb', 'lender_items': lender_items, 'requesting_user': requesting_user})
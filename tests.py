@@ -1,3 +1,93 @@
-from django.test import TestCase
+import shutil
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.http import QueryDict
+from django.test import TestCase, override_settings
+
+from accounts.forms import ItemObjectForm
+from accounts.models import Lender
+from accounts.writers import ItemWriter
+from respool.models import Item, Category, Dimension, Loan, LoanAgreement, Location, RentalFee, items_bulk_saved
+
+'''Authors: Marius Hofmann'''
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class ItemWriterQueryCountTest(TestCase):
+    """
+    Guards the number of queries of saving an item form, which must not grow with further relations or signals.
+    """
+    # transaction (a savepoint within the test), lender, location, rental fee, loan, dimension,
+    # item insert and id (savepoint), categories, catalog version, search index (select, delete, insert),
+    # map tiles (location, tile versions)
+    ADD_QUERY_COUNT = 18
+    # transaction (a savepoint within the test), lender, item lock, location, rental fee, loan, dimension,
+    # item update, categories, images, catalog version, search index (select, delete, insert),
+    # map tiles (location, tile versions)
+    EDIT_QUERY_COUNT = 17
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='lender', password='secret')
+        Lender.objects.create(user=cls.user, type=Lender.PRIVATE)
+        cls.category = Category.objects.create(title='Möbel')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def create_form(self, **values):
+        data = QueryDict(mutable=True)
+        data.update({'title': 'Stuhl', 'description': 'Ein gepolsterter Stuhl', 'type': str(Item.OBJECT),
+                     'categories': str(self.category.id), 'location_house_number': '1',
+                     'location_street': 'Lange Straße', 'location_city': 'Bamberg', 'location_latitude': '49.89',
+                     'location_longitude': '10.89', 'loan_caution': '10', 'loan_rental_fee_interval_unit': '1',
+                     'loan_rental_fee_costs': '3', 'dimension_width': '1', 'dimension_height': '2',
+                     'dimension_depth': '3', 'weight': '4', 'amount': '5'})
+        data.update(values)
+        form = ItemObjectForm(data)
+        self.assertTrue(form.is_valid(), form.errors)
+        return form
+
+    def test_add_query_count(self):
+        # the first save creates the related rows, further saves share them
+        ItemWriter(self.create_form(), self.user).save()
+        form = self.create_form()
+        with self.assertNumQueries(self.ADD_QUERY_COUNT):
+            item = ItemWriter(form, self.user).save()
+        self.assertEqual(list(item.categories.all()), [self.category])
+        self.assertEqual(Item.objects.count(), 2)
+
+    def test_edit_query_count(self):
+        item = ItemWriter(self.create_form(), self.user).save()
+        form = self.create_form(title='Sessel')
+        with self.assertNumQueries(self.EDIT_QUERY_COUNT):
+            ItemWriter(form, self.user, item).save()
+        item.refresh_from_db()
+        self.assertEqual(item.title, 'Sessel')
+        self.assertEqual((item.dimension.width, item.weight, item.amount), (1, 4, 5))
+        self.assertEqual(item.loan.rental_fee.interval_unit, RentalFee.DAILY)
+        self.assertEqual(list(item.categories.all()), [self.category])
+
+    def test_edit_keeps_stored_loan_agreement(self):
+        item = ItemWriter(self.create_form(), self.user).save()
+        # the agreement was set by another submit after the item of this form was loaded
+        agreement = LoanAgreement.objects.create()
+        Item.objects.filter(pk=item.pk).update(loan_agreement=agreement)
+        ItemWriter(self.create_form(title='Sessel'), self.user, item).save()
+        self.assertEqual(Item.objects.get(pk=item.pk).loan_agreement_id, agreement.id)
+
+    def test_failed_save_writes_nothing(self):
+        form = self.create_form()
+        with mock.patch.object(items_bulk_saved, 'send', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                ItemWriter(form, self.user).save()
+        self.assertFalse(Item.objects.exists())
+        self.assertFalse(Location.objects.exists())
+        self.assertFalse(Loan.objects.exists())
+        self.assertFalse(Dimension.objects.exists())
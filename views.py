@@ -16,8 +16,8 @@ from accounts.models import Lender, Borrower
 from core.tokens import account_activation_token
 from accounts.forms import ItemVenueForm, ItemObjectForm, ItemServiceForm, LenderForm, BorrowerForm, \
     EditProfileForm
-from respool.models import Item, Image, Location, Dimension, Loan, RentalFee, LoanAgreement, reset_image_order_ids, \
-    get_next_order_id
+from accounts.writers import ItemWriter
+from respool.models import Item, Location, LoanAgreement
 
 logger = logging.getLogger(__name__)
 
@@ -82,7 +82,7 @@ def public_lender_profile(request, lender_pk):
     :return: public lender profile page
     """
     lender = Lender.objects.get(id=lender_pk)
-    items = Item.objects.filter(lender=lender)
+    items = Item.objects.filter(lender=lender).prefetch_related('images__variants')
     return render(request, 'accounts/public_lender_profile.jinja',
                   {'title': "Verleiher: " + lender.user.username, 'lender': lender, 'items': items})
 
@@ -125,73 +125,6 @@ def get_initial_basic_object(item):
     return inital_item
 
 
-def save_basic_item_attributes(form, user, item=None):
-    """
-    saves the basic item attribute values in an item database object.
-    if an item is given the values will be overwritten
-    otherwise a new object will be created
-
-    :param form: the formular which shall be saved
-    :param user: the user which saving the item
-    :param item: the item which shall be updated
-    :return: the updated item
-    """
-    title = form.cleaned_data.get('title')
-    description = form.cleaned_data.get('description')
-    type = form.cleaned_data.get('type')
-    lender = Lender.objects.get(user=user)
-    location, _ = Location.objects.get_or_create(
-        house_number=form.cleaned_data.get('location_house_number'),
-        street=form.cleaned_data.get('location_street'),
-        city=form.cleaned_data.get('location_city'),
-        defaults={
-            'title': form.cleaned_data.get('location_title'),
-            'latitude': form.cleaned_data.get('location_latitude'),
-            'longitude': form.cleaned_data.get('location_longitude')})
-    if not item:
-        item = Item.objects.create(title=title, description=description, type=type, lender=lender, location=location)
-    else:
-        item.title = title
-        item.description = form.cleaned_data.get('description')
-        item.type = type
-        item.lender = lender
-        item.location = location
-    item.categories.set(form.cleaned_data.get('categories'))
-
-    # remove existing loan_agreement if new one is provided
-    if item.loan_agreement and form.cleaned_data.get('loan_agreement_file'):
-        item.loan_agreement.delete()
-
-    item.loan_agreement = LoanAgreement.objects.create(file=form.cleaned_data.get('loan_agreement_file'))
-
-    images_to_delete_ids = form.data.getlist('deleteImages')
-    if images_to_delete_ids:
-        images_to_delete = item.images.filter(id__in=images_to_delete_ids).all()
-        for image in images_to_delete:
-            image.delete()
-
-    reset_image_order_ids(item)
-
-    if form.files:
-        image_files = form.files.getlist('images')
-        next_order_id = get_next_order_id(item)
-        if image_files:
-            for index, image_file in enumerate(image_files):
-                item.images.add(Image.objects.create(file=image_file, order_id=index + next_order_id))
-
-    if form.cleaned_data.get('loan_rental_fee_interval_unit') and form.cleaned_data.get('loan_rental_fee_costs'):
-        rental_fee, _ = RentalFee.objects.get_or_create(
-            interval_unit=form.cleaned_data.get('loan_rental_fee_interval_unit'),
-            costs=form.cleaned_data.get('loan_rental_fee_costs'))
-    else:
-        rental_fee = None
-    item.loan, _ = Loan.objects.get_or_create(caution=form.cleaned_data.get('loan_caution'),
-                                              single_rent=form.cleaned_data.get('loan_single_rent'),
-                                              rental_fee=rental_fee)
-
-    return item
-
-
 def add_item_venue(request):
     """
         render adding formular for venue item and save the formular
@@ -204,12 +137,7 @@ def add_item_venue(request):
                                    files=request.FILES or None)
     if request.method == 'POST':
         if item_base_form.is_valid():
-            item = save_basic_item_attributes(item_base_form, request.user)
-            item.dimension, _ = Dimension.objects.get_or_create(
-                width=item_base_form.cleaned_data.get('dimension_width'),
-                height=item_base_form.cleaned_data.get('dimension_height'),
-                depth=item_base_form.cleaned_data.get('dimension_depth'))
-            item.save()
+            ItemWriter(item_base_form, request.user).save()
             return redirect('accounts:account')
     return render(request, 'accounts/add_item/venue_item_form.jinja', {'title': 'Einen Veranstaltungsort hinzufügen',
                                                                        'item_base_form': item_base_form, 'item': None})
@@ -227,8 +155,7 @@ def add_item_service(request):
                                      files=request.FILES or None)
     if request.method == 'POST':
         if item_base_form.is_valid():
-            item = save_basic_item_attributes(item_base_form, request.user)
-            item.save()
+            ItemWriter(item_base_form, request.user).save()
             return redirect('accounts:account')
     # if a GET (or any other method) we'll create a blank form
     return render(request, 'accounts/add_item/service_item_form.jinja',
@@ -249,14 +176,7 @@ def add_item_object(request):
 
     if request.method == 'POST':
         if item_base_form.is_valid():
-            item = save_basic_item_attributes(item_base_form, request.user)
-            dimension, _ = Dimension.objects.get_or_create(width=item_base_form.cleaned_data.get('dimension_width'),
-                                                           height=item_base_form.cleaned_data.get('dimension_height'),
-                                                           depth=item_base_form.cleaned_data.get('dimension_depth'))
-            item.weight = item_base_form.cleaned_data.get('weight')
-            item.amount = item_base_form.cleaned_data.get('amount')
-            item.dimension = dimension
-            item.save()
+            ItemWriter(item_base_form, request.user).save()
             return redirect('accounts:account')
     return render(request, 'accounts/add_item/object_item_form.jinja', {'title': 'Ein Objekt hinzufügen',
                                                                         'item_base_form': item_base_form, 'item': None})
@@ -279,11 +199,7 @@ def edit_item_venue(request, item):
                          files=request.FILES or None)
     if request.method == 'POST':
         if form.is_valid():
-            item = save_basic_item_attributes(form=form, user=request.user, item=item)
-            item.dimension, _ = Dimension.objects.get_or_create(width=form.cleaned_data.get('dimension_width'),
-                                                                height=form.cleaned_data.get('dimension_height'),
-                                                                depth=form.cleaned_data.get('dimension_depth'))
-            item.save()
+            ItemWriter(form, request.user, item).save()
             return redirect('accounts:account')
     return render(request, 'accounts/add_item/venue_item_form.jinja',
                   {'title': 'Einen Venanstaltungsort editieren',
@@ -305,8 +221,7 @@ def edit_item_service(request, item):
                            files=request.FILES or None)
     if request.method == 'POST':
         if form.is_valid():
-            item = save_basic_item_attributes(form=form, user=request.user, item=item)
-            item.save()
+            ItemWriter(form, request.user, item).save()
             return redirect('accounts:account')
     return render(request, 'accounts/add_item/service_item_form.jinja',
                   {'title': 'Einen Service editieren',
@@ -334,13 +249,7 @@ def edit_item_object(request, item):
                           files=request.FILES or None)
     if request.method == 'POST':
         if form.is_valid():
-            item = save_basic_item_attributes(form=form, user=request.user, item=item)
-            item.dimension, _ = Dimension.objects.get_or_create(width=form.cleaned_data.get('dimension_width'),
-                                                                height=form.cleaned_data.get('dimension_height'),
-                                                                depth=form.cleaned_data.get('dimension_depth'))
-            item.weight = form.cleaned_data.get('weight')
-            item.amount = form.cleaned_data.get('amount')
-            item.save()
+            ItemWriter(form, request.user, item).save()
             return redirect('accounts:account')
     return render(request, 'accounts/add_item/object_item_form.jinja',
                   {'title': 'Ein Objekt editieren',
@@ -377,7 +286,7 @@ def order_images(request, pk):
     :param pk: item (id) which images shall be sorted
     :return: rendered image sorting page
     """
-    item = Item.objects.get(id=pk)
+    item = Item.objects.prefetch_related('images__variants').get(id=pk)
     return render(request, 'accounts/add_item/image_ordering_form.jinja',
                   {'title': '{}: Bilder anordnen'.format(item.title),
                    'item': item, })
@@ -427,7 +336,6 @@ def registration_lender(request):
                 'phone_number_mobile': lender_form.cleaned_data.get('phone_number_mobile'),
                 'type': lender_form.cleaned_data.get('type'),
                 'description': lender_form.cleaned_data.get('description'),
-                'default_loan_agreement': lender_form.cleaned_data.get('loan_agreement'),
                 'website': lender_form.cleaned_data.get('website')
             }
             location, _ = Location.objects.get_or_create(title=lender_form.cleaned_data['location_title'],
@@ -437,6 +345,13 @@ def registration_lender(request):
                                                          latitude=lender_form.cleaned_data['location_latitude'],
                                                          longitude=lender_form.cleaned_data['location_longitude'])
             lender_data['location'] = location
+            loan_agreement_file = lender_form.cleaned_data.get('loan_agreement')
+            loan_agreement_upload = lender_form.cleaned_data.get('loan_agreement_upload')
+            if loan_agreement_file:
+                lender_data['default_loan_agreement'] = LoanAgreement.get_or_create_for_file(loan_agreement_file)
+            elif loan_agreement_upload and loan_agreement_upload.is_usable_by(request.user):
+                lender_data['default_loan_agreement'] = loan_agreement_upload.consume(
+                    LoanAgreement.get_or_create_for_file)
             lender = Lender.objects.create(user=user, **lender_data)
 
             lender.user.is_active = False
@@ -0,0 +1,179 @@
+from contextlib import ExitStack
+
+from django.db import transaction
+from django.utils import timezone
+
+from accounts.models import Lender
+from respool.models import Item, Image, Location, Dimension, Loan, RentalFee, LoanAgreement, Upload, add_geocode, \
+    schedule_geocode, save_image, schedule_thumbnail, release_loan_agreement, items_bulk_saved
+from respool.utils import bulk
+
+'''Authors: Marius Hofmann'''
+
+ITEM_FIELDS = ('title', 'description', 'type', 'weight', 'amount', 'lender', 'location', 'loan', 'dimension',
+               'loan_agreement', 'updated_at')
+
+
+class ItemWriter:
+    """
+    Creates or updates an item from a valid item form (see ItemVenueForm, ItemServiceForm and ItemObjectForm)
+    in one transaction, so a failing submit leaves no half written item behind.
+    Like BulkItemWriter the item, its relations and its images are written with batched statements which skip the
+    per row signals, the catalog, the search index and the map tiles are updated once by `items_bulk_saved`.
+    Apart from the deleted and added images and the consumed uploads, a save runs a fixed number of queries.
+    """
+
+    def __init__(self, form, user, item=None):
+        """
+        :param form: the validated item form
+        :param user: the user saving the item, only its uploads are consumed
+        :param item: the item which shall be updated, a new item is created if None
+        """
+        self.form = form
+        self.user = user
+        self.item = item
+
+    def save(self):
+        """
+        Writes the item with its location, loan, dimension, categories, loan agreement and images.
+
+        :return: the saved item
+        """
+        data = self.form.cleaned_data
+        with transaction.atomic(), ExitStack() as files:
+            lender = Lender.objects.get(user=self.user)
+            item = self.item or Item()
+            previous_location_id, previous_loan_agreement_id = None, None
+            if item.pk:
+                # locks the item against concurrent submits, which would otherwise mix their relations
+                previous_location_id, previous_loan_agreement_id = Item.objects.select_for_update() \
+                    .filter(pk=item.pk).values_list('location_id', 'loan_agreement_id').get()
+
+            item.title = data.get('title')
+            item.description = data.get('description')
+            item.type = data.get('type')
+            item.lender = lender
+            if 'weight' in self.form.fields:
+                item.weight = data.get('weight')
+                item.amount = data.get('amount')
+            item.location = self.get_or_create_location(data)
+            item.loan = self.get_or_create_loan(data)
+            if 'dimension_width' in self.form.fields:
+                item.dimension = bulk.get_or_create_many(Dimension, [Dimension(
+                    width=data.get('dimension_width'), height=data.get('dimension_height'),
+                    depth=data.get('dimension_depth'))], ['width', 'height', 'depth'])[0][0]
+
+            # agreements are shared by content, a replaced agreement is released after the item is written
+            uploads = []
+            loan_agreement_file = data.get('loan_agreement_file')
+            loan_agreement_upload = data.get('loan_agreement_upload')
+            if loan_agreement_file:
+                item.loan_agreement = LoanAgreement.get_or_create_for_file(loan_agreement_file)
+            elif loan_agreement_upload and loan_agreement_upload.is_usable_by(self.user):
+                item.loan_agreement = LoanAgreement.get_or_create_for_file(files.enter_context(
+                    loan_agreement_upload.open()))
+                uploads.append(loan_agreement_upload)
+            elif previous_loan_agreement_id:
+                # the agreement locked above, a concurrent submit may have replaced the one of self.item
+                item.loan_agreement_id = previous_loan_agreement_id
+            else:
+                item.loan_agreement = lender.default_loan_agreement
+
+            created = not item.pk
+            if created:
+                bulk.bulk_insert(Item, [item])
+            else:
+                item.updated_at = timezone.now()
+                bulk.bulk_update(Item, [item], ITEM_FIELDS)
+            self.set_categories(item, data.get('categories') or [], created)
+
+            image_files = list(self.form.files.getlist('images')) if self.form.files else []
+            image_uploads = [upload for upload in data.get('image_uploads') or [] if upload.is_usable_by(self.user)]
+            image_files += [files.enter_context(upload.open()) for upload in image_uploads]
+            uploads += image_uploads
+            self.write_images(item, created, self.form.data.getlist('deleteImages'), image_files)
+            if uploads:
+                Upload.objects.filter(pk__in=[upload.pk for upload in uploads]).delete()
+
+            if previous_loan_agreement_id != item.loan_agreement_id:
+                release_loan_agreement(previous_loan_agreement_id)
+            location_ids = {item.location_id, previous_location_id} - {None}
+            items_bulk_saved.send(sender=Item, item_ids=[item.pk], location_ids=location_ids)
+        return item
+
+    @staticmethod
+    def get_or_create_location(data):
+        """
+        Matches the location by its address like Location.objects.get_or_create.
+
+        :return: saved Location
+        """
+        location = Location(house_number=data.get('location_house_number'), street=data.get('location_street'),
+                            city=data.get('location_city'), title=data.get('location_title'),
+                            latitude=data.get('location_latitude'), longitude=data.get('location_longitude'))
+        return bulk.get_or_create_many(Location, [location], ['house_number', 'street', 'city'],
+                                       pre_save=[add_geocode], post_save=[schedule_geocode])[0][0]
+
+    @staticmethod
+    def get_or_create_loan(data):
+        """
+        Matches the loan and its rental fee by their values like Loan.objects.get_or_create.
+
+        :return: saved Loan
+        """
+        rental_fee = None
+        if data.get('loan_rental_fee_interval_unit') and data.get('loan_rental_fee_costs'):
+            # the choice field returns the interval unit as a string, the rows are matched by the stored integer
+            rental_fee = bulk.get_or_create_many(RentalFee, [RentalFee(
+                interval_unit=int(data.get('loan_rental_fee_interval_unit')), costs=data.get('loan_rental_fee_costs'))],
+                ['interval_unit', 'costs'])[0][0]
+        return bulk.get_or_create_many(Loan, [Loan(caution=data.get('loan_caution'),
+                                                   single_rent=data.get('loan_single_rent'),
+                                                   rental_fee=rental_fee)],
+                                       ['caution', 'single_rent', 'rental_fee'])[0][0]
+
+    @staticmethod
+    def set_categories(item, categories, created):
+        """
+        Replaces the categories of a saved item, only the changed relations are written.
+
+        :param item: the saved item
+        :param categories: the new categories
+        :param created: True if the item was just created and has no categories yet
+        """
+        through = Item.categories.through
+        category_ids = {category.pk for category in categories}
+        current_ids = set(through.objects.filter(item_id=item.pk).values_list('category_id', flat=True)) \
+            if not created else set()
+        if current_ids - category_ids:
+            through.objects.filter(item_id=item.pk, category_id__in=current_ids - category_ids).delete()
+        if category_ids - current_ids:
+            through.objects.bulk_create([through(item_id=item.pk, category_id=category_id)
+                                         for category_id in sorted(category_ids - current_ids)])
+
+    @staticmethod
+    def write_images(item, created, delete_image_ids, image_files):
+        """
+        Deletes images of a saved item, numbers the remaining images from 1 to n without gaps and
+        appends new images in the given order.
+
+        :param item: the saved item
+        :param created: True if the item was just created and has no images yet
+        :param delete_image_ids: ids of the images of the item which shall be deleted
+        :param image_files: files of the new images
+        """
+        if delete_image_ids and not created:
+            Image.objects.filter(item=item, id__in=delete_image_ids).delete()
+
+        order_ids = list(Image.objects.filter(item=item).order_by('order_id', 'pk').values_list('id', 'order_id')) \
+            if not created else []
+        bulk.bulk_update(Image, [Image(id=image_id, order_id=index + 1)
+                                 for index, (image_id, order_id) in enumerate(order_ids) if order_id != index + 1],
+                         ['order_id'])
+        if not image_files:
+            return
+
+        images = [Image(file=file, order_id=index + len(order_ids) + 1) for index, file in enumerate(image_files)]
+        bulk.bulk_insert(Image, images, pre_save=[save_image], post_save=[schedule_thumbnail])
+        through = Item.images.through
+        through.objects.bulk_create([through(item_id=item.pk, image_id=image.pk) for image in images])